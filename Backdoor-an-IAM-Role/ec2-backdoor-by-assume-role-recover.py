@@ -1,4 +1,45 @@
-import boto3
+import os
+import sys
+import concurrent.futures
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.clients import get_client, get_session
+from common.journal import TeardownCheckpoint, replay_resources
+from common.tagging import RUN_TAG_KEY, SCENARIO_TAG_KEY, find_run_resources
+from common.teardown import TeardownNode, run_teardown, print_teardown_report
+from common.waiters import wait_for_all
+
+# ec2-backdoor-by-assume-role.py 寫入的資源日誌
+JOURNAL_PATH = 'ec2_backdoor_resources.jsonl'
+CHECKPOINT_PATH = 'ec2_backdoor_resources.checkpoint.jsonl'
+
+RESOURCE_TYPES = {
+    'run': 'runs',
+    'role': 'roles',
+    'instance_profile': 'instance_profiles',
+    'key_pair': 'key_pairs',
+    'instance': 'instances'
+}
+
+# 沒有日誌時（舊版情境腳本）以情境標籤或 EC2TestProfile 搜尋本情境建立的執行個體；
+# 有日誌時只以執行 ID 標籤搜尋，不會終止其他人執行的情境
+SCENARIO_TAG = {'Key': SCENARIO_TAG_KEY, 'Value': 'ec2-backdoor-by-assume-role'}
+INSTANCE_PROFILE_ARN_PATTERN = 'arn:aws:iam::*:instance-profile/*EC2TestProfile*'
+ACTIVE_STATES = ['pending', 'running', 'shutting-down', 'stopping', 'stopped']
+
+# 終止與輪詢設定（輪詢間隔由 common.waiters 從短間隔指數增加）
+TERMINATE_BATCH_SIZE = 1000
+TERMINATE_TIMEOUT = 600
+
+# 沒有日誌時（舊版情境腳本）使用的預設資源
+DEFAULT_REGION = 'us-east-2'
+DEFAULT_RESOURCES = {
+    'roles': [{'role_name': 'EC2TestRole'}],
+    'instance_profiles': [{'instance_profile_name': 'EC2TestProfile', 'role_name': 'EC2TestRole'}],
+    'key_pairs': [{'key_name': 'my-key-pair', 'region': DEFAULT_REGION}],
+    'instances': [],
+    'runs': []
+}
 
 def check_role_exists(iam_client, role_name):
     try:
@@ -10,73 +51,244 @@ def check_role_exists(iam_client, role_name):
 def detach_policies(iam_client, role_name):
     try:
         response = iam_client.list_attached_role_policies(RoleName=role_name)
-        for policy in response['AttachedPolicies']:
-            iam_client.detach_role_policy(RoleName=role_name, PolicyArn=policy['PolicyArn'])
-            print(f"Detached policy: {policy['PolicyName']} from role: {role_name}")
-    except Exception as e:
-        print(f"Error detaching policies: {e}")
+    except iam_client.exceptions.NoSuchEntityException:
+        return
+    for policy in response['AttachedPolicies']:
+        iam_client.detach_role_policy(RoleName=role_name, PolicyArn=policy['PolicyArn'])
+        print(f"Detached policy: {policy['PolicyName']} from role: {role_name}")
 
-def terminate_ec2_instances(ec2_client):
-    try:
-        instances = ec2_client.describe_instances(
-            Filters=[{'Name': 'instance-state-name', 'Values': ['running', 'stopped']}]
-        )
-        instance_ids = [instance['InstanceId'] for reservation in instances['Reservations'] for instance in reservation['Instances']]
-        
-        if instance_ids:
-            ec2_client.terminate_instances(InstanceIds=instance_ids)
-            waiter = ec2_client.get_waiter('instance_terminated')
-            waiter.wait(InstanceIds=instance_ids)
-            print(f"EC2 Instances terminated: {instance_ids}")
-    except Exception as e:
-        print(f"Error terminating EC2 instances: {e}")
+def get_enabled_regions(ec2_client):
+    response = ec2_client.describe_regions()
+    return [region['RegionName'] for region in response['Regions']]
+
+def describe_instance_states(ec2_client, filters):
+    # describe_instances 需分頁；以 filter 查詢時不存在的 instance-id 不會造成錯誤
+    states = {}
+    paginator = ec2_client.get_paginator('describe_instances')
+    for page in paginator.paginate(Filters=filters):
+        for reservation in page['Reservations']:
+            for instance in reservation['Instances']:
+                states[instance['InstanceId']] = instance['State']['Name']
+    return states
+
+def find_backdoor_instances(ec2_client, run_ids=(), journaled_ids=(), sweep=False):
+    """
+    找出日誌中各次執行建立的執行個體：帶有執行 ID 標籤，或記錄於日誌中；
+    sweep 時另外找出帶有情境標籤或使用 EC2TestProfile 的執行個體
+    """
+    state_filter = {'Name': 'instance-state-name', 'Values': ACTIVE_STATES}
+    instance_ids = set()
+    if run_ids:
+        instance_ids.update(describe_instance_states(ec2_client, [
+            state_filter,
+            {'Name': f"tag:{RUN_TAG_KEY}", 'Values': sorted(run_ids)}
+        ]))
+    if sweep:
+        instance_ids.update(describe_instance_states(ec2_client, [
+            state_filter,
+            {'Name': f"tag:{SCENARIO_TAG['Key']}", 'Values': [SCENARIO_TAG['Value']]}
+        ]))
+        instance_ids.update(describe_instance_states(ec2_client, [
+            state_filter,
+            {'Name': 'iam-instance-profile.arn', 'Values': [INSTANCE_PROFILE_ARN_PATTERN]}
+        ]))
+    if journaled_ids:
+        instance_ids.update(describe_instance_states(ec2_client, [
+            state_filter,
+            {'Name': 'instance-id', 'Values': list(journaled_ids)}
+        ]))
+    return sorted(instance_ids)
+
+def terminate_region_instances(ec2_client, run_ids=(), journaled_ids=(), sweep=False):
+    region = ec2_client.meta.region_name
+    instance_ids = find_backdoor_instances(ec2_client, run_ids, journaled_ids, sweep)
+    if not instance_ids:
+        return []
+
+    for i in range(0, len(instance_ids), TERMINATE_BATCH_SIZE):
+        ec2_client.terminate_instances(InstanceIds=instance_ids[i:i + TERMINATE_BATCH_SIZE])
+    print(f"Terminating EC2 instances in {region}: {instance_ids}")
+
+    # 不使用 instance_terminated waiter（固定 15 秒間隔），一次查詢所有未終止的執行個體，
+    # 終止後立即結束；逾時僅影響本區域
+    def terminated(pending):
+        states = describe_instance_states(ec2_client, [{'Name': 'instance-id', 'Values': sorted(pending)}])
+        return {instance_id for instance_id in pending if states.get(instance_id, 'terminated') == 'terminated'}
+
+    wait_for_all(instance_ids, terminated, timeout=TERMINATE_TIMEOUT,
+                 description=f"instances in {region} to terminate")
+    print(f"EC2 Instances terminated in {region}: {instance_ids}")
+    return instance_ids
+
+def terminate_ec2_instances(ec2_clients, run_ids, journaled_ids_by_region, sweep=False):
+    """各區域同時查詢、終止並輪詢，不會因單一區域等待而阻塞其他區域"""
+    errors = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(ec2_clients) or 1) as executor:
+        futures = {
+            executor.submit(terminate_region_instances, client, run_ids, journaled_ids_by_region.get(region, ()),
+                            sweep): region
+            for region, client in ec2_clients.items()
+        }
+        for future in concurrent.futures.as_completed(futures):
+            region = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Error terminating EC2 instances in {region}: {e}")
+                errors.append(region)
+    if errors:
+        raise RuntimeError(f"EC2 termination failed in regions: {sorted(errors)}")
 
 def delete_key_pair(ec2_client, key_name):
+    ec2_client.delete_key_pair(KeyName=key_name)
+    print(f"Deleted Key Pair: {key_name}")
+
+def remove_role_from_instance_profile(iam_client, instance_profile_name, role_name):
+    if role_name is None:
+        return
     try:
-        ec2_client.delete_key_pair(KeyName=key_name)
-        print(f"Deleted Key Pair: {key_name}")
-    except Exception as e:
-        print(f"Error deleting Key Pair: {e}")
+        iam_client.remove_role_from_instance_profile(
+            InstanceProfileName=instance_profile_name,
+            RoleName=role_name
+        )
+    except iam_client.exceptions.NoSuchEntityException:
+        print(f"Instance Profile '{instance_profile_name}' not found.")
 
-def delete_iam_resources(iam_client, role_name, instance_profile_name):
+def delete_instance_profile(iam_client, instance_profile_name):
     try:
-        if check_role_exists(iam_client, role_name):
-            if instance_profile_name:
-                try:
-                    iam_client.remove_role_from_instance_profile(
-                        InstanceProfileName=instance_profile_name,
-                        RoleName=role_name
-                    )
-                    iam_client.delete_instance_profile(InstanceProfileName=instance_profile_name)
-                    print(f"Deleted Instance Profile: {instance_profile_name}")
-                except iam_client.exceptions.NoSuchEntityException:
-                    print(f"Instance Profile '{instance_profile_name}' not found.")
-
-            # 先解除與角色相關聯的策略
-            detach_policies(iam_client, role_name)
-
-            # 再刪除角色
-            iam_client.delete_role(RoleName=role_name)
-            print(f"Deleted IAM Role: {role_name}")
-        else:
-            print(f"IAM Role '{role_name}' not found.")
-    except Exception as e:
-        print(f"Error deleting IAM resources: {e}")
+        iam_client.delete_instance_profile(InstanceProfileName=instance_profile_name)
+        print(f"Deleted Instance Profile: {instance_profile_name}")
+    except iam_client.exceptions.NoSuchEntityException:
+        print(f"Instance Profile '{instance_profile_name}' not found.")
+
+def delete_role(iam_client, role_name):
+    if check_role_exists(iam_client, role_name):
+        iam_client.delete_role(RoleName=role_name)
+        print(f"Deleted IAM Role: {role_name}")
+    else:
+        print(f"IAM Role '{role_name}' not found.")
+
+def load_resources():
+    if os.path.exists(JOURNAL_PATH):
+        return replay_resources(JOURNAL_PATH, RESOURCE_TYPES), True
+    return DEFAULT_RESOURCES, False
+
+def add_run_resources(resources, session, iam_client):
+    """
+    依日誌中的執行 ID 直接查出帶有標籤 / Path 的資源，
+    補上日誌來不及記錄的部分（例如情境腳本在寫入日誌前中斷）
+    """
+    for run in resources.get('runs', []):
+        found = find_run_resources(session, run['run_id'], [run['region']],
+                                   ['ec2:instance'], iam_client=iam_client)
+        for role_name in found['iam']['roles']:
+            resources['roles'].append({'role_name': role_name})
+        for profile in found['iam']['instance_profiles']:
+            # 尚未綁定角色的 Profile 也要刪除
+            for role_name in profile['role_names'] or [None]:
+                resources['instance_profiles'].append({
+                    'instance_profile_name': profile['instance_profile_name'],
+                    'role_name': role_name
+                })
+        for region, resource_type, resource_id in found['arns']:
+            if resource_type == 'instance':
+                resources['instances'].append({'instance_id': resource_id, 'region': region})
+
+        # Key Pair 以 describe_key_pairs 的標籤篩選直接查詢
+        ec2_client = get_client('ec2', region_name=run['region'], session=session, governed=True)
+        key_pairs = ec2_client.describe_key_pairs(
+            Filters=[{'Name': f"tag:{RUN_TAG_KEY}", 'Values': [run['run_id']]}]
+        )
+        for key_pair in key_pairs['KeyPairs']:
+            resources['key_pairs'].append({'key_name': key_pair['KeyName'], 'region': run['region']})
+    return resources
+
+def build_teardown_graph(resources, session, iam_client, sweep=False):
+    """
+    刪除順序：先終止 EC2 執行個體，再將角色從 Instance Profile 移除並刪除 Profile，
+    角色需在政策解除且不再屬於任何 Profile 後才能刪除；Key Pair 與其他節點無相依關係。
+    sweep 時以情境標籤與 EC2TestProfile 搜尋執行個體（沒有日誌時）。
+    """
+    nodes = []
+
+    def ec2_client_for(region):
+        # client 由 common.clients 依區域快取
+        return get_client('ec2', region_name=region, session=session, governed=True)
+
+    # 所有啟用的區域都要搜尋，日誌中記錄的執行個體 ID 依區域分組
+    journaled_ids_by_region = {}
+    for instance in resources.get('instances', []):
+        journaled_ids_by_region.setdefault(instance['region'], set()).add(instance['instance_id'])
+    regions = set(get_enabled_regions(ec2_client_for(DEFAULT_REGION))) | set(journaled_ids_by_region)
+    region_clients = {region: ec2_client_for(region) for region in sorted(regions)}
+    run_ids = sorted({run['run_id'] for run in resources.get('runs', [])})
+
+    # 搜尋並終止執行個體可重複執行，不寫入檢查點：前次清除失敗留下的檢查點不會讓
+    # 這次（可能是新的執行）的執行個體被略過
+    instance_node_ids = ['instances']
+    nodes.append(TeardownNode('instances',
+                              lambda: terminate_ec2_instances(region_clients, run_ids, journaled_ids_by_region, sweep),
+                              resumable=False))
+
+    # 日誌與標籤查詢可能記錄同一個 Key Pair，刪除不存在的 Key Pair 不會出錯
+    seen_key_pairs = set()
+    for key_pair in resources.get('key_pairs', []):
+        key = (key_pair['region'], key_pair['key_name'])
+        if key in seen_key_pairs:
+            continue
+        seen_key_pairs.add(key)
+        client = ec2_client_for(key_pair['region'])
+        nodes.append(TeardownNode(f"key-pair:{key[0]}:{key[1]}",
+                                  lambda c=client, k=key[1]: delete_key_pair(c, k)))
+
+    profile_role_node_ids = {}
+    seen_profiles = set()
+    for profile in resources.get('instance_profiles', []):
+        profile_name = profile['instance_profile_name']
+        if profile_name in seen_profiles:
+            continue
+        seen_profiles.add(profile_name)
+        remove_id = f"profile-role:{profile_name}"
+        profile_role_node_ids.setdefault(profile['role_name'], []).append(remove_id)
+        nodes.append(TeardownNode(
+            remove_id,
+            lambda p=profile_name, r=profile['role_name']: remove_role_from_instance_profile(iam_client, p, r),
+            depends_on=instance_node_ids))
+        nodes.append(TeardownNode(f"profile:{profile_name}",
+                                  lambda p=profile_name: delete_instance_profile(iam_client, p),
+                                  depends_on=[remove_id]))
+
+    seen_roles = set()
+    for role in resources.get('roles', []):
+        role_name = role['role_name']
+        if role_name in seen_roles:
+            continue
+        seen_roles.add(role_name)
+        # 先解除與角色相關聯的策略，再刪除角色
+        policies_id = f"role-policies:{role_name}"
+        nodes.append(TeardownNode(policies_id, lambda r=role_name: detach_policies(iam_client, r)))
+        nodes.append(TeardownNode(f"role:{role_name}", lambda r=role_name: delete_role(iam_client, r),
+                                  depends_on=[policies_id] + profile_role_node_ids.get(role_name, [])))
+
+    return nodes
 
 def delete_resources():
     try:
-        # 初始化 boto3 客戶端
-        session = boto3.Session(profile_name='harry-redteam')
-        iam_client = session.client('iam')
-        ec2_client = session.client('ec2', region_name='us-east-2')
-
-        role_name = 'EC2TestRole'
-        instance_profile_name = 'EC2TestProfile'
-        key_name = 'my-key-pair'
-
-        terminate_ec2_instances(ec2_client)
-        delete_key_pair(ec2_client, key_name)
-        delete_iam_resources(iam_client, role_name, instance_profile_name)
+        # 初始化 boto3 客戶端（經過共用的速率控制器並重試節流錯誤）
+        session = get_session(profile_name='harry-redteam')
+        iam_client = get_client('iam', session=session, governed=True)
+
+        resources, from_journal = load_resources()
+        add_run_resources(resources, session, iam_client)
+        checkpoint = TeardownCheckpoint(CHECKPOINT_PATH)
+        nodes = build_teardown_graph(resources, session, iam_client, sweep=not from_journal)
+        results = run_teardown(nodes, checkpoint=checkpoint)
+        if print_teardown_report(results) == 0:
+            checkpoint.remove()
+            if from_journal:
+                os.remove(JOURNAL_PATH)
+        else:
+            checkpoint.close()
     except Exception as e:
         print(f"Error: {e}")
 
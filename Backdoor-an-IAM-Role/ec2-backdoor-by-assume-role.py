@@ -1,9 +1,31 @@
 import os
-import time
-import boto3
+import sys
 import json
 
-def create_iam_role(iam_client):
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.clients import get_client
+from common.journal import ResourceJournal
+from common.manifest import start_manifest
+from common.tagging import new_run_id, run_path, run_tags, tag_specifications
+from common.waiters import retry_until_ready
+
+# 資源日誌檔，由 ec2-backdoor-by-assume-role-recover.py 重播
+JOURNAL_PATH = 'ec2_backdoor_resources.jsonl'
+
+# 等待 Instance Profile 傳遞到 EC2 的時間上限（秒）
+INSTANCE_PROFILE_TIMEOUT = 120
+
+# 所有資源都帶有執行 ID 與情境標籤（IAM 實體另以執行 ID 作為 Path），
+# 復原腳本以標籤與 Path 直接查出資源
+SCENARIO = 'ec2-backdoor-by-assume-role'
+
+resource_journal = None
+
+def record_resource(resource_type, **fields):
+  if resource_journal is not None:
+    resource_journal.record(resource_type, **fields)
+
+def create_iam_role(iam_client, role_name, run_id):
   trust_policy = {
     "Version": "2012-10-17",
     "Statement": [
@@ -18,92 +40,122 @@ def create_iam_role(iam_client):
   }
 
   try:
-    role = iam_client.get_role(RoleName='EC2TestRole')
+    role = iam_client.get_role(RoleName=role_name)
     print("Role already exists.")
   except iam_client.exceptions.NoSuchEntityException:
     role = iam_client.create_role(
-      RoleName='EC2TestRole',
-      AssumeRolePolicyDocument=json.dumps(trust_policy)
+      RoleName=role_name,
+      Path=run_path(run_id),
+      AssumeRolePolicyDocument=json.dumps(trust_policy),
+      Tags=run_tags(run_id, SCENARIO)
     )
     print("Role created.")
+  record_resource('role', role_name=role_name)
 
   # Attach the 'AdministratorAccess' managed policy
   iam_client.attach_role_policy(
-    RoleName='EC2TestRole',
+    RoleName=role_name,
     PolicyArn='arn:aws:iam::aws:policy/AdministratorAccess'
   )
   print("AdministratorAccess policy attached to the role.")
 
-def create_instance_profile(iam_client):
+def create_instance_profile(iam_client, instance_profile_name, role_name, run_id):
   try:
-    instance_profile_info = iam_client.get_instance_profile(InstanceProfileName='EC2TestProfile')
+    instance_profile_info = iam_client.get_instance_profile(InstanceProfileName=instance_profile_name)
     print("Instance profile already exists.")
-    
+
     # 檢查 Instance Profile 是否已綁定角色
     if not instance_profile_info['InstanceProfile']['Roles']:
       print("Binding Role to Instance Profile...")
       iam_client.add_role_to_instance_profile(
-        InstanceProfileName='EC2TestProfile',
-        RoleName='EC2TestRole'
+        InstanceProfileName=instance_profile_name,
+        RoleName=role_name
       )
       print("Role successfully bound to Instance Profile.")
     else:
       print("Instance Profile is already bound to a Role.")
   except iam_client.exceptions.NoSuchEntityException:
-    iam_client.create_instance_profile(InstanceProfileName='EC2TestProfile')
+    iam_client.create_instance_profile(
+      InstanceProfileName=instance_profile_name,
+      Path=run_path(run_id),
+      Tags=run_tags(run_id, SCENARIO)
+    )
     iam_client.add_role_to_instance_profile(
-      InstanceProfileName='EC2TestProfile',
-      RoleName='EC2TestRole'
+      InstanceProfileName=instance_profile_name,
+      RoleName=role_name
     )
+  record_resource('instance_profile', instance_profile_name=instance_profile_name, role_name=role_name)
 
-def create_key_pair(ec2_client):
-  key_pair_name = 'my-key-pair'
+def create_key_pair(ec2_client, key_pair_name, run_id):
   try:
     ec2_client.describe_key_pairs(KeyNames=[key_pair_name])
     print("Key Pair already exists.")
   except ec2_client.exceptions.ClientError:
-    new_key_pair = ec2_client.create_key_pair(KeyName=key_pair_name)
+    new_key_pair = ec2_client.create_key_pair(
+      KeyName=key_pair_name,
+      TagSpecifications=tag_specifications(run_id, SCENARIO, ['key-pair'])
+    )
     private_key = new_key_pair['KeyMaterial']
     filename = f"{key_pair_name}.pem"
     with open(filename, 'w') as file:
       file.write(private_key)
     os.chmod(filename, 0o400)
+  record_resource('key_pair', key_name=key_pair_name, region=ec2_client.meta.region_name)
 
-def create_ec2_instance(ec2_client, ami_id, instance_type):
-  time.sleep(10)
-  try:
-    ec2_response = ec2_client.run_instances(
+def create_ec2_instance(ec2_client, ami_id, instance_type, key_pair_name, instance_profile_name, run_id):
+  # 新建立的 Instance Profile 需要數秒才能被 EC2 使用；
+  # 不再固定等待 10 秒，而是在 EC2 回報 Profile 無效時退避重試，生效後立即建立
+  def run_instance():
+    return ec2_client.run_instances(
       ImageId=ami_id,
       MinCount=1,
       MaxCount=1,
       InstanceType=instance_type,
-      KeyName='my-key-pair',
+      KeyName=key_pair_name,
       IamInstanceProfile={
-        'Name': 'EC2TestProfile'
-      }
+        'Name': instance_profile_name
+      },
+      # 建立時即加上標籤，避免執行個體存在卻沒有標籤的空窗
+      TagSpecifications=tag_specifications(
+        run_id, SCENARIO, ['instance', 'volume'],
+        extra_tags=[
+          {'Key': 'Name', 'Value': 'MyInstance'},
+          {'Key': 'Environment', 'Value': 'Production'}
+        ]
+      )
     )
-    instance_id = ec2_response['Instances'][0]['InstanceId']
-    print("EC2 Instance Created:", instance_id)
 
-    # Add tags to the created instance
-    ec2_client.create_tags(
-      Resources=[instance_id],
-      Tags=[
-        {'Key': 'Name', 'Value': 'MyInstance'},
-        {'Key': 'Environment', 'Value': 'Production'}
-      ]
+  try:
+    ec2_response = retry_until_ready(
+      run_instance, ['InvalidParameterValue'], message='iamInstanceProfile',
+      timeout=INSTANCE_PROFILE_TIMEOUT, description=f"instance profile {instance_profile_name}"
     )
+    instance_id = ec2_response['Instances'][0]['InstanceId']
+    print("EC2 Instance Created:", instance_id)
+    record_resource('instance', instance_id=instance_id, region=ec2_client.meta.region_name)
   except ec2_client.exceptions.ClientError as e:
     print(f"Error creating EC2 instance: {e}")
 
 if __name__ == "__main__":
-  session = boto3.Session(profile_name='harry-redteam')
-  iam_client = session.client('iam')
-  ec2_client = session.client('ec2', region_name='us-east-2')
-
-  create_iam_role(iam_client)
-  create_instance_profile(iam_client)
-  create_key_pair(ec2_client)
-  ami_id = 'ami-0cd3c7f72edd5b06d'
-  instance_type = 't2.micro'
-  create_ec2_instance(ec2_client,ami_id,instance_type)
+  iam_client = get_client('iam', profile_name='harry-redteam')
+  ec2_client = get_client('ec2', region_name='us-east-2', profile_name='harry-redteam')
+
+  # 資源名稱加上執行 ID，同時執行的兩次情境不會互相衝突
+  run_id = new_run_id()
+  role_name = f'EC2TestRole-{run_id}'
+  instance_profile_name = f'EC2TestProfile-{run_id}'
+  key_pair_name = f'my-key-pair-{run_id}'
+  print(f"Run ID: {run_id}")
+  start_manifest(run_id, SCENARIO)
+
+  resource_journal = ResourceJournal(JOURNAL_PATH)
+  try:
+    resource_journal.record('run', run_id=run_id, scenario=SCENARIO, region=ec2_client.meta.region_name)
+    create_iam_role(iam_client, role_name, run_id)
+    create_instance_profile(iam_client, instance_profile_name, role_name, run_id)
+    create_key_pair(ec2_client, key_pair_name, run_id)
+    ami_id = 'ami-0cd3c7f72edd5b06d'
+    instance_type = 't2.micro'
+    create_ec2_instance(ec2_client, ami_id, instance_type, key_pair_name, instance_profile_name, run_id)
+  finally:
+    resource_journal.close()
@@ -1,63 +1,169 @@
-import boto3
+import os
+import sys
 import json
 
-def delete_generated_resources(region_name):
-    # 讀取 generated_resources.json 檔案
-    with open('generated_resources.json', 'r') as file:
-        resources = json.load(file)
-
-    # 初始化 AWS 客戶端
-    session = boto3.Session(profile_name='peace-key')
-    iam_client = session.client('iam')
-    lambda_client = session.client('lambda',region_name=region_name)
-
-    # 刪除 IAM 用戶
-    for user in resources.get("iam_users", []):
-        user_name = user['user_name']
-        try:
-            # 列出用戶的所有附加政策
-            attached_policies = iam_client.list_attached_user_policies(UserName=user_name)
-            for policy in attached_policies.get('AttachedPolicies', []):
-                # 解除附加的政策
-                iam_client.detach_user_policy(
-                    UserName=user_name,
-                    PolicyArn=policy['PolicyArn']
-                )
-
-            # 刪除用戶的所有存取金鑰
-            access_keys = iam_client.list_access_keys(UserName=user_name)
-            for key in access_keys.get('AccessKeyMetadata', []):
-                iam_client.delete_access_key(UserName=user_name, AccessKeyId=key['AccessKeyId'])
-
-            # 最後刪除用戶
-            iam_client.delete_user(UserName=user_name)
-            print(f"Deleted IAM user: {user_name}")
-        except Exception as e:
-            print(f"Error deleting IAM user {user_name}: {e}")
-        
-
-    # 刪除 Lambda 函數
-    for lambda_function in resources.get("lambda_functions", []):
-        function_name = lambda_function['function_name']
-        try:
-            lambda_client.delete_function(FunctionName=function_name)
-            print(f"Deleted Lambda function: {function_name}")
-        except Exception as e:
-            print(f"Error deleting Lambda function {function_name}: {e}")
-
-    # 刪除 IAM 角色
-    for role in resources.get("roles", []):
-        role_name = role['role_name']
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.clients import get_client, get_session
+from common.journal import TeardownCheckpoint, replay_resources
+from common.tagging import find_run_resources
+from common.teardown import TeardownNode, run_teardown, print_teardown_report
+from common.waiters import retry_until_ready
+
+# 同時執行的刪除請求上限
+MAX_WORKERS = 8
+
+# 等待 Lambda 函數可刪除的時間上限（秒）
+FUNCTION_DELETE_TIMEOUT = 120
+
+# aksk-loop-muti-lambda.py 寫入的資源日誌，舊版則只有 generated_resources.json
+JOURNAL_PATH = 'generated_resources.jsonl'
+LEGACY_RESOURCES_PATH = 'generated_resources.json'
+CHECKPOINT_PATH = 'generated_resources.checkpoint.jsonl'
+
+RESOURCE_TYPES = {
+    "run": "runs",
+    "role": "roles",
+    "lambda_function": "lambda_functions",
+    "iam_user": "iam_users"
+}
+
+def load_generated_resources():
+    if os.path.exists(JOURNAL_PATH):
+        return replay_resources(JOURNAL_PATH, RESOURCE_TYPES)
+    with open(LEGACY_RESOURCES_PATH, 'r') as file:
+        return json.load(file)
+
+def add_run_resources(resources, session, iam_client):
+    """
+    依日誌中的執行 ID 直接查詢：IAM 用戶與角色以 Path、Lambda 函數以標籤。
+    可補上 Lambda 已建立用戶、但情境腳本在寫入日誌前中斷的情況
+    """
+    for run in resources.get("runs", []):
+        found = find_run_resources(session, run['run_id'], [run['region']],
+                                   ['lambda:function'], iam_client=iam_client)
+        resources.setdefault("iam_users", []).extend({"user_name": name} for name in found['iam']['users'])
+        resources.setdefault("roles", []).extend({"role_name": name} for name in found['iam']['roles'])
+        for _, resource_type, function_name in found['arns']:
+            if resource_type == 'function':
+                resources.setdefault("lambda_functions", []).append({"function_name": function_name})
+    return resources
+
+def detach_user_policies(iam_client, user_name):
+    # 列出用戶的所有附加政策並解除
+    attached_policies = iam_client.list_attached_user_policies(UserName=user_name)
+    for policy in attached_policies.get('AttachedPolicies', []):
+        iam_client.detach_user_policy(
+            UserName=user_name,
+            PolicyArn=policy['PolicyArn']
+        )
+
+def delete_user_access_keys(iam_client, user_name):
+    # 刪除用戶的所有存取金鑰
+    access_keys = iam_client.list_access_keys(UserName=user_name)
+    for key in access_keys.get('AccessKeyMetadata', []):
+        iam_client.delete_access_key(UserName=user_name, AccessKeyId=key['AccessKeyId'])
+
+def delete_user(iam_client, user_name):
+    try:
+        iam_client.delete_user(UserName=user_name)
+        print(f"Deleted IAM user: {user_name}")
+    except iam_client.exceptions.NoSuchEntityException:
+        print(f"IAM user {user_name} already deleted.")
+
+def delete_lambda_function(lambda_client, function_name):
+    try:
+        # 函數仍在建立或更新中（Pending / InProgress）時會回傳 ResourceConflictException，
+        # 退避重試直到可以刪除，不需固定等待
+        retry_until_ready(lambda: lambda_client.delete_function(FunctionName=function_name),
+                          ['ResourceConflictException'], timeout=FUNCTION_DELETE_TIMEOUT,
+                          description=f"Lambda function {function_name}")
+        print(f"Deleted Lambda function: {function_name}")
+    except lambda_client.exceptions.ResourceNotFoundException:
+        print(f"Lambda function {function_name} already deleted.")
+
+def detach_role_policies(iam_client, role_name):
+    policies = iam_client.list_attached_role_policies(RoleName=role_name)
+    for policy in policies['AttachedPolicies']:
+        iam_client.detach_role_policy(RoleName=role_name, PolicyArn=policy['PolicyArn'])
+
+def delete_role(iam_client, role_name):
+    try:
+        iam_client.delete_role(RoleName=role_name)
+        print(f"Deleted IAM role:{role_name}")
+    except iam_client.exceptions.NoSuchEntityException:
+        print(f"IAM role {role_name} already deleted.")
+
+def ignore_missing(iam_client, action):
+    # 實體已不存在時，其政策與金鑰自然也不存在，視為完成
+    def run():
         try:
-            # 首先解除角色的策略綁定
-            policies = iam_client.list_attached_role_policies(RoleName=role_name)
-            for policy in policies['AttachedPolicies']:
-                iam_client.detach_role_policy(RoleName=role_name, PolicyArn=policy['PolicyArn'])
-
-            iam_client.delete_role(RoleName=role_name)
-            print(f"Deleted IAM role:{role_name}")
-        except Exception as e:
-            print(f"Error deleting IAM role {role_name}: {e}")
+            action()
+        except iam_client.exceptions.NoSuchEntityException:
+            pass
+    return run
+
+def unique_names(entries, key):
+    # 日誌可能包含多次執行的記錄，同名資源只刪除一次
+    names = []
+    for entry in entries:
+        if entry[key] not in names:
+            names.append(entry[key])
+    return names
+
+def build_teardown_graph(resources, iam_client, lambda_client):
+    """
+    將 generated_resources 轉為刪除相依圖：
+    用戶的政策與存取金鑰先於用戶本身，Lambda 函數先於執行角色。
+    """
+    nodes = []
+
+    for user_name in unique_names(resources.get("iam_users", []), 'user_name'):
+        policies_id = f"user-policies:{user_name}"
+        keys_id = f"user-keys:{user_name}"
+        nodes.append(TeardownNode(policies_id, ignore_missing(
+            iam_client, lambda u=user_name: detach_user_policies(iam_client, u))))
+        nodes.append(TeardownNode(keys_id, ignore_missing(
+            iam_client, lambda u=user_name: delete_user_access_keys(iam_client, u))))
+        nodes.append(TeardownNode(f"user:{user_name}", lambda u=user_name: delete_user(iam_client, u),
+                                  depends_on=[policies_id, keys_id]))
+
+    function_ids = []
+    for function_name in unique_names(resources.get("lambda_functions", []), 'function_name'):
+        function_id = f"function:{function_name}"
+        function_ids.append(function_id)
+        nodes.append(TeardownNode(function_id, lambda f=function_name: delete_lambda_function(lambda_client, f)))
+
+    for role_name in unique_names(resources.get("roles", []), 'role_name'):
+        policies_id = f"role-policies:{role_name}"
+        nodes.append(TeardownNode(policies_id, ignore_missing(
+            iam_client, lambda r=role_name: detach_role_policies(iam_client, r))))
+        nodes.append(TeardownNode(f"role:{role_name}", lambda r=role_name: delete_role(iam_client, r),
+                                  depends_on=[policies_id] + function_ids))
+
+    return nodes
+
+def delete_generated_resources(region_name):
+    # 重播資源日誌（或讀取舊版 generated_resources.json）
+    resources = load_generated_resources()
+
+    # 初始化 AWS 客戶端（client 可跨執行緒共用，並經過共用的速率控制器）
+    session = get_session(profile_name='peace-key')
+    iam_client = get_client('iam', session=session, governed=True)
+    lambda_client = get_client('lambda', region_name=region_name, session=session, governed=True)
+    add_run_resources(resources, session, iam_client)
+
+    # 檢查點記錄已完成的節點，中斷後再次執行會從中斷處繼續
+    checkpoint = TeardownCheckpoint(CHECKPOINT_PATH)
+    nodes = build_teardown_graph(resources, iam_client, lambda_client)
+    results = run_teardown(nodes, max_workers=MAX_WORKERS, checkpoint=checkpoint)
+    if print_teardown_report(results) == 0:
+        # 全部清除完成，移除日誌與檢查點
+        checkpoint.remove()
+        if os.path.exists(JOURNAL_PATH):
+            os.remove(JOURNAL_PATH)
+    else:
+        checkpoint.close()
+    return results
 
 if __name__ == "__main__":
     # 執行刪除資源的函數
@@ -1,10 +1,33 @@
-import boto3
+import os
+import sys
 import json
 import zipfile
 import io
-import time
 import stat
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.clients import get_client, get_session
+from common.journal import ResourceJournal
+from common.manifest import start_manifest
+from common.tagging import new_run_id, run_path, run_tags, run_tag_dict
+from common.waiters import retry_until_ready, wait_for
+
+SCENARIO = 'aksk-loop-muti-lambda'
+
+# 等待 IAM 角色傳遞到 Lambda、函數轉為 Active 的時間上限（秒）
+ROLE_PROPAGATION_TIMEOUT = 120
+FUNCTION_ACTIVE_TIMEOUT = 300
+
+# 資源日誌檔：每個資源建立後立即寫入，程式中斷時復原腳本仍可得知已建立的資源
+JOURNAL_PATH = 'generated_resources.jsonl'
+
+# 日誌記錄 type 與 generated_resources 鍵的對應，復原腳本重播時使用
+RESOURCE_TYPES = {
+    "role": "roles",
+    "lambda_function": "lambda_functions",
+    "iam_user": "iam_users"
+}
+
 # 初始化用來儲存生成資源的字典
 generated_resources = {
     "roles": [],
@@ -12,8 +35,15 @@ generated_resources = {
     "iam_users": []
 }
 
-def create_lambda_role(role_name,access_key_id, secret_access_key):
-    iam_client = boto3.client(
+resource_journal = None
+
+def record_resource(resource_type, **fields):
+    generated_resources[RESOURCE_TYPES[resource_type]].append(fields)
+    if resource_journal is not None:
+        resource_journal.record(resource_type, **fields)
+
+def create_lambda_role(role_name,access_key_id, secret_access_key,run_id):
+    iam_client = get_client(
         'iam',
         aws_access_key_id=access_key_id,
         aws_secret_access_key=secret_access_key
@@ -37,8 +67,10 @@ def create_lambda_role(role_name,access_key_id, secret_access_key):
         # 創建 IAM 角色
         role = iam_client.create_role(
             RoleName=role_name,
+            Path=run_path(run_id),
             AssumeRolePolicyDocument=json.dumps(trust_relationship),
-            Description="Role for Lambda execution"
+            Description="Role for Lambda execution",
+            Tags=run_tags(run_id, SCENARIO)
         )
         role_arn = role['Role']['Arn']
         print(f"Created role: {role_arn}")
@@ -49,7 +81,7 @@ def create_lambda_role(role_name,access_key_id, secret_access_key):
             PolicyArn='arn:aws:iam::aws:policy/AdministratorAccess'
         )
         print(f"Attached AdministratorAccess policy to role {role_name}")
-        generated_resources["roles"].append({"role_name": role_name, "role_arn": role_arn})
+        record_resource("role", role_name=role_name, role_arn=role_arn)
 
         return role_arn
 
@@ -57,8 +89,8 @@ def create_lambda_role(role_name,access_key_id, secret_access_key):
         print(f"Role {role_name} already exists.")
         return None
 
-def deploy_lambda_function(function_name,access_key_id, secret_access_key,account_id,region_name):
-    lambda_client = boto3.client(
+def deploy_lambda_function(function_name,access_key_id, secret_access_key,role_arn,region_name,run_id):
+    lambda_client = get_client(
         'lambda',
         aws_access_key_id=access_key_id,
         aws_secret_access_key=secret_access_key,
@@ -69,17 +101,25 @@ def deploy_lambda_function(function_name,access_key_id, secret_access_key,accoun
 import boto3
 import time
 import json
+import uuid
 
-def create_account_and_keys(parent_access_key_id, parent_secret_access_key):
+def create_account_and_keys(parent_access_key_id, parent_secret_access_key, run_id, hop):
     client = boto3.client(
         'iam',
         aws_access_key_id=parent_access_key_id,
         aws_secret_access_key=parent_secret_access_key
     )
 
-    # 創建用戶
-    user_name = f"nested_user_{int(time.time())}"
-    client.create_user(UserName=user_name)
+    # 創建用戶（名稱含執行 ID 與層數，並加上執行 ID 標籤與 Path）
+    user_name = f"nested_user_{run_id}_{hop}"
+    client.create_user(
+        UserName=user_name,
+        Path=f"/cloud-attack/{run_id}/",
+        Tags=[
+            {'Key': 'cloud-attack:run-id', 'Value': run_id},
+            {'Key': 'cloud-attack:scenario', 'Value': 'aksk-loop-muti-lambda'}
+        ]
+    )
 
     # 創建存取金鑰和安全金鑰
     response = client.create_access_key(UserName=user_name)
@@ -107,12 +147,17 @@ def test_access_key(access_key_id, secret_access_key):
     except:
         return False
 
-def wait_for_key_activation(access_key_id, secret_access_key, max_attempts=6, delay=10):
-    for _ in range(max_attempts):
+def wait_for_key_activation(access_key_id, secret_access_key, timeout=50, max_delay=10):
+    # 新金鑰通常數秒內生效：從 0.5 秒開始指數增加間隔，生效後立即繼續
+    deadline = time.time() + timeout
+    delay = 0.5
+    while True:
         if test_access_key(access_key_id, secret_access_key):
             return True
-        time.sleep(delay)  # 等待一段時間後重試
-    return False
+        if time.time() + delay > deadline:
+            return False
+        time.sleep(delay)
+        delay = min(max_delay, delay * 2)
 
 def delete_keys(user_names, access_key_ids):
     client = boto3.client('iam')
@@ -127,10 +172,13 @@ def lambda_handler(event, context):
     initial_access_key_id = event.get('access_key_id', 'default_ak')
     initial_secret_access_key = event.get('secret_access_key', 'default_sk')
 
+    run_id = event.get('run_id') or uuid.uuid4().hex[:12]
+    hop = event.get('hop', 0)
+
     current_ak = initial_access_key_id
     current_sk = initial_secret_access_key
 
-    user_name, new_ak, new_sk = create_account_and_keys(current_ak, current_sk)
+    user_name, new_ak, new_sk = create_account_and_keys(current_ak, current_sk, run_id, hop)
     if wait_for_key_activation(new_ak, new_sk):
         current_ak = new_ak
         current_sk = new_sk
@@ -161,35 +209,41 @@ def lambda_handler(event, context):
     timeout_seconds = 60  # 設置超時時間，這裡設為 60 秒
 
     # 創建Lambda函數
-    print("waiting for 10 seconds")
-    time.sleep(10)
-    response = lambda_client.create_function(
-        FunctionName=function_name,
-        Runtime='python3.8',
-        Role='arn:aws:iam::%s:role/MyLambdaExecutionRole' % account_id,  # 替換為你的Lambda角色ARN
-        Handler='lambda_function.lambda_handler',
-        Timeout=timeout_seconds,
-        Code={
-            'ZipFile': zip_output.read()
-        }
-        # 其他配置...
+    # 新建立的角色需要數秒才能被 Lambda 承擔；不再固定等待，
+    # 而是在 Lambda 回報角色無法承擔時退避重試，角色生效後立即建立
+    zip_bytes = zip_output.read()
+    response = retry_until_ready(
+        lambda: lambda_client.create_function(
+            FunctionName=function_name,
+            Runtime='python3.8',
+            Role=role_arn,
+            Handler='lambda_function.lambda_handler',
+            Timeout=timeout_seconds,
+            Code={
+                'ZipFile': zip_bytes
+            },
+            Tags=run_tag_dict(run_id, SCENARIO)
+            # 其他配置...
+        ),
+        ['InvalidParameterValueException'], message='cannot be assumed',
+        timeout=ROLE_PROPAGATION_TIMEOUT, description=f"role {role_arn}"
     )
 
     # 更新生成資源字典
-    generated_resources["lambda_functions"].append({"function_name": function_name, "function_arn": response['FunctionArn']})
+    record_resource("lambda_function", function_name=function_name, function_arn=response['FunctionArn'])
 
-    while True:
-        response = lambda_client.get_function(FunctionName=function_name)
-        if response['Configuration']['State'] == 'Active':
-            print("Lambda function is now active.")
-            break
-        print("Waiting for Lambda function to become active...")
-        time.sleep(10)  # 每10秒檢查一次
+    # 從短間隔開始輪詢，函數轉為 Active 後立即繼續
+    def function_state():
+        state = lambda_client.get_function(FunctionName=function_name)['Configuration']['State']
+        if state == 'Failed':
+            raise Exception(f"Lambda function {function_name} failed to become active")
+        return state == 'Active'
 
-        
+    wait_for(function_state, timeout=FUNCTION_ACTIVE_TIMEOUT, description=f"Lambda function {function_name}")
+    print("Lambda function is now active.")
 
-def invoke_lambda_function(function_name,access_key_id, secret_access_key,region_name):
-    lambda_client = boto3.client(
+def invoke_lambda_function(function_name,access_key_id, secret_access_key,region_name,run_id,hop):
+    lambda_client = get_client(
     'lambda',
     aws_access_key_id=access_key_id,
     aws_secret_access_key=secret_access_key,
@@ -197,7 +251,9 @@ def invoke_lambda_function(function_name,access_key_id, secret_access_key,region
     # 觸發Lambda函數
     lambda_parameters = {
     'access_key_id': access_key_id,
-    'secret_access_key': secret_access_key
+    'secret_access_key': secret_access_key,
+    'run_id': run_id,
+    'hop': hop
     }
     response = lambda_client.invoke(
         FunctionName=function_name,
@@ -210,30 +266,32 @@ def invoke_lambda_function(function_name,access_key_id, secret_access_key,region
     print("result:" + result)
     return result
 
-def save_generated_resources():
-    with open('generated_resources.json', 'w') as file:
-        json.dump(generated_resources, file, indent=4)
-
 def main():
-    account_id = '350667048426'
     region_name = 'ap-southeast-1'
-    session = boto3.Session(profile_name='peace-key',region_name=region_name)
+    session = get_session(profile_name='peace-key', region_name=region_name)
     access_key_id=session.get_credentials().access_key
     secret_access_key=session.get_credentials().secret_key
 
-    role_name = "MyLambdaExecutionRole"
-    create_lambda_role(role_name,access_key_id, secret_access_key)
+    # 資源名稱加上執行 ID，同時執行的兩次情境不會互相衝突
+    run_id = new_run_id()
+    print(f"Run ID: {run_id}")
+    start_manifest(run_id, SCENARIO)
+    if resource_journal is not None:
+        resource_journal.record("run", run_id=run_id, scenario=SCENARIO, region=region_name)
+
+    role_name = f"MyLambdaExecutionRole-{run_id}"
+    role_arn = create_lambda_role(role_name,access_key_id, secret_access_key,run_id)
 
     # 觸發Lambda函數
     
     for i in range(16):
         # 部署並運行Lambda函數
-        function_name = f"MyLambdaFunctionLoop{i+1}"  # 替換為您的 Lambda 函數名稱
-        deploy_lambda_function(function_name,access_key_id, secret_access_key,account_id,region_name)
+        function_name = f"MyLambdaFunctionLoop{i+1}-{run_id}"
+        deploy_lambda_function(function_name,access_key_id, secret_access_key,role_arn,region_name,run_id)
         print("Lambda Function Deployed and Executed")
 
         print(f"Invoking Lambda function {i+1}")
-        result = invoke_lambda_function(function_name,access_key_id, secret_access_key,region_name)
+        result = invoke_lambda_function(function_name,access_key_id, secret_access_key,region_name,run_id,i+1)
         print(result)
         data = json.loads(result)
         body = data['body']
@@ -242,14 +300,16 @@ def main():
         secret_access_key = body['secret_access_key']
         # 更新生成資源字典
         if user_name and access_key_id and secret_access_key:
-            generated_resources["iam_users"].append({
-                "user_name": user_name,
-                "access_key_id": access_key_id,
-                "secret_access_key": secret_access_key
-        })
-    
-    save_generated_resources()
+            record_resource("iam_user",
+                user_name=user_name,
+                access_key_id=access_key_id,
+                secret_access_key=secret_access_key
+            )
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    resource_journal = ResourceJournal(JOURNAL_PATH)
+    try:
+        main()
+    finally:
+        resource_journal.close()
\ No newline at end of file
@@ -1,13 +1,25 @@
-import boto3
+import os
+import sys
 import json
 from botocore.exceptions import ClientError
 import zipfile
 import io
-import time
 import stat
 
-def create_lambda_role(role_name,access_key_id, secret_access_key):
-    iam_client = boto3.client(
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.clients import get_client
+from common.manifest import start_manifest
+from common.tagging import new_run_id, run_path, run_tags, run_tag_dict
+from common.waiters import retry_until_ready, wait_for
+
+SCENARIO = 'aksk-loop-one-lambda'
+
+# 等待 IAM 角色傳遞到 Lambda、函數轉為 Active 的時間上限（秒）
+ROLE_PROPAGATION_TIMEOUT = 120
+FUNCTION_ACTIVE_TIMEOUT = 300
+
+def create_lambda_role(role_name,access_key_id, secret_access_key,run_id):
+    iam_client = get_client(
         'iam',
         aws_access_key_id=access_key_id,
         aws_secret_access_key=secret_access_key,
@@ -31,8 +43,10 @@ def create_lambda_role(role_name,access_key_id, secret_access_key):
         # 創建 IAM 角色
         role = iam_client.create_role(
             RoleName=role_name,
+            Path=run_path(run_id),
             AssumeRolePolicyDocument=json.dumps(trust_relationship),
-            Description="Role for Lambda execution"
+            Description="Role for Lambda execution",
+            Tags=run_tags(run_id, SCENARIO)
         )
         role_arn = role['Role']['Arn']
         print(f"Created role: {role_arn}")
@@ -50,8 +64,8 @@ def create_lambda_role(role_name,access_key_id, secret_access_key):
         print(f"Role {role_name} already exists.")
         return None
 
-def deploy_lambda_function(function_name,access_key_id, secret_access_key):
-    lambda_client = boto3.client(
+def deploy_lambda_function(function_name,access_key_id, secret_access_key,role_arn,run_id):
+    lambda_client = get_client(
         'lambda',
         aws_access_key_id=access_key_id,
         aws_secret_access_key=secret_access_key,
@@ -62,17 +76,25 @@ def deploy_lambda_function(function_name,access_key_id, secret_access_key):
 import boto3
 import time
 import json
+import uuid
 
-def create_account_and_keys(parent_access_key_id, parent_secret_access_key):
+def create_account_and_keys(parent_access_key_id, parent_secret_access_key, run_id, hop):
     client = boto3.client(
         'iam',
         aws_access_key_id=parent_access_key_id,
         aws_secret_access_key=parent_secret_access_key
     )
 
-    # 創建用戶
-    user_name = f"nested_user_{int(time.time())}"
-    client.create_user(UserName=user_name)
+    # 創建用戶（名稱含執行 ID 與層數，並加上執行 ID 標籤與 Path）
+    user_name = f"nested_user_{run_id}_{hop}"
+    client.create_user(
+        UserName=user_name,
+        Path=f"/cloud-attack/{run_id}/",
+        Tags=[
+            {'Key': 'cloud-attack:run-id', 'Value': run_id},
+            {'Key': 'cloud-attack:scenario', 'Value': 'aksk-loop-one-lambda'}
+        ]
+    )
 
     # 創建存取金鑰和安全金鑰
     response = client.create_access_key(UserName=user_name)
@@ -100,12 +122,17 @@ def test_access_key(access_key_id, secret_access_key):
     except:
         return False
 
-def wait_for_key_activation(access_key_id, secret_access_key, max_attempts=6, delay=10):
-    for _ in range(max_attempts):
+def wait_for_key_activation(access_key_id, secret_access_key, timeout=50, max_delay=10):
+    # 新金鑰通常數秒內生效：從 0.5 秒開始指數增加間隔，生效後立即繼續
+    deadline = time.time() + timeout
+    delay = 0.5
+    while True:
         if test_access_key(access_key_id, secret_access_key):
             return True
-        time.sleep(delay)  # 等待一段時間後重試
-    return False
+        if time.time() + delay > deadline:
+            return False
+        time.sleep(delay)
+        delay = min(max_delay, delay * 2)
 
 def delete_keys(user_names, access_key_ids):
     client = boto3.client('iam')
@@ -120,13 +147,16 @@ def lambda_handler(event, context):
     initial_access_key_id = event.get('access_key_id', 'default_ak')
     initial_secret_access_key = event.get('secret_access_key', 'default_sk')
 
+    run_id = event.get('run_id') or uuid.uuid4().hex[:12]
+    hop = event.get('hop', 0)
+
     current_ak = initial_access_key_id
     current_sk = initial_secret_access_key
 
     user_names = []
     access_key_ids = []
 
-    user_name, new_ak, new_sk = create_account_and_keys(current_ak, current_sk)
+    user_name, new_ak, new_sk = create_account_and_keys(current_ak, current_sk, run_id, hop)
     user_names.append(user_name)
     access_key_ids.append(new_ak)
     if wait_for_key_activation(new_ak, new_sk):
@@ -158,31 +188,38 @@ def lambda_handler(event, context):
     timeout_seconds = 60  # 設置超時時間，這裡設為 60 秒
 
     # 創建Lambda函數
-    response = lambda_client.create_function(
-        FunctionName=function_name,
-        Runtime='python3.8',
-        Role='arn:aws:iam::576625574995:role/MyLambdaExecutionRole',  # 替換為你的Lambda角色ARN
-        Handler='lambda_function.lambda_handler',
-        Timeout=timeout_seconds,
-        Code={
-            'ZipFile': zip_output.read()
-        }
-        # 其他配置...
+    # 新建立的角色需要數秒才能被 Lambda 承擔；不再固定等待，
+    # 而是在 Lambda 回報角色無法承擔時退避重試，角色生效後立即建立
+    zip_bytes = zip_output.read()
+    retry_until_ready(
+        lambda: lambda_client.create_function(
+            FunctionName=function_name,
+            Runtime='python3.8',
+            Role=role_arn,
+            Handler='lambda_function.lambda_handler',
+            Timeout=timeout_seconds,
+            Code={
+                'ZipFile': zip_bytes
+            },
+            Tags=run_tag_dict(run_id, SCENARIO)
+            # 其他配置...
+        ),
+        ['InvalidParameterValueException'], message='cannot be assumed',
+        timeout=ROLE_PROPAGATION_TIMEOUT, description=f"role {role_arn}"
     )
 
+    # 從短間隔開始輪詢，函數轉為 Active 後立即繼續
+    def function_state():
+        state = lambda_client.get_function(FunctionName=function_name)['Configuration']['State']
+        if state == 'Failed':
+            raise Exception(f"Lambda function {function_name} failed to become active")
+        return state == 'Active'
 
-    while True:
-        response = lambda_client.get_function(FunctionName=function_name)
-        if response['Configuration']['State'] == 'Active':
-            print("Lambda function is now active.")
-            break
-        print("Waiting for Lambda function to become active...")
-        time.sleep(10)  # 每10秒檢查一次
-
-        
+    wait_for(function_state, timeout=FUNCTION_ACTIVE_TIMEOUT, description=f"Lambda function {function_name}")
+    print("Lambda function is now active.")
 
-def invoke_lambda_function(function_name,access_key_id, secret_access_key):
-    lambda_client = boto3.client(
+def invoke_lambda_function(function_name,access_key_id, secret_access_key,run_id,hop):
+    lambda_client = get_client(
     'lambda',
     aws_access_key_id=access_key_id,
     aws_secret_access_key=secret_access_key,
@@ -190,7 +227,9 @@ def invoke_lambda_function(function_name,access_key_id, secret_access_key):
     # 觸發Lambda函數
     lambda_parameters = {
     'access_key_id': access_key_id,
-    'secret_access_key': secret_access_key
+    'secret_access_key': secret_access_key,
+    'run_id': run_id,
+    'hop': hop
     }
     response = lambda_client.invoke(
         FunctionName=function_name,
@@ -207,19 +246,24 @@ def main():
     access_key_id='AKIAxxxxxxxxxxxxxxxxxxxxDM6'
     secret_access_key='yWM26VxxxxxxxxxxxxxxxxxxxxxxxpxKnLx4yqf'
 
-    role_name = "MyLambdaExecutionRole"
-    create_lambda_role(role_name,access_key_id, secret_access_key)
+    # 資源名稱加上執行 ID，同時執行的兩次情境不會互相衝突
+    run_id = new_run_id()
+    print(f"Run ID: {run_id}")
+    start_manifest(run_id, SCENARIO)
+
+    role_name = f"MyLambdaExecutionRole-{run_id}"
+    role_arn = create_lambda_role(role_name,access_key_id, secret_access_key,run_id)
 
     # 部署並運行Lambda函數
-    function_name = "MyLambdaFunctionLoop"  # 替換為您的 Lambda 函數名稱
-    deploy_lambda_function(function_name,access_key_id, secret_access_key)
+    function_name = f"MyLambdaFunctionLoop-{run_id}"
+    deploy_lambda_function(function_name,access_key_id, secret_access_key,role_arn,run_id)
     print("Lambda Function Deployed and Executed")
 
     # 觸發Lambda函數
     
     for i in range(16):
         print(f"Invoking Lambda function {i+1}")
-        result = invoke_lambda_function(function_name,access_key_id, secret_access_key)
+        result = invoke_lambda_function(function_name,access_key_id, secret_access_key,run_id,i+1)
         print(result)
         data = json.loads(result)
         body = data['body']
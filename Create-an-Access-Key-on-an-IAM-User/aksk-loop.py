@@ -1,16 +1,24 @@
-import boto3
-import time
+import os
+import sys
 
-def create_account_and_keys(parent_access_key_id, parent_secret_access_key):
-    client = boto3.client(
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.clients import get_client
+from common.manifest import start_manifest
+from common.tagging import new_run_id, run_path, run_tags
+from common.waiters import WaitTimeout, wait_for
+
+SCENARIO = 'aksk-loop'
+
+def create_account_and_keys(parent_access_key_id, parent_secret_access_key, run_id, hop):
+    client = get_client(
         'iam',
         aws_access_key_id=parent_access_key_id,
         aws_secret_access_key=parent_secret_access_key
     )
 
-    # 創建用戶
-    user_name = f"nested_user_{int(time.time())}"
-    client.create_user(UserName=user_name)
+    # 創建用戶（名稱含執行 ID 與層數，並加上執行 ID 標籤與 Path）
+    user_name = f"nested_user_{run_id}_{hop}"
+    client.create_user(UserName=user_name, Path=run_path(run_id), Tags=run_tags(run_id, SCENARIO))
 
     # 創建存取金鑰和安全金鑰
     response = client.create_access_key(UserName=user_name)
@@ -26,7 +34,7 @@ def create_account_and_keys(parent_access_key_id, parent_secret_access_key):
     return user_name, access_key_id, secret_access_key
 
 def test_access_key(access_key_id, secret_access_key):
-    client = boto3.client(
+    client = get_client(
         'iam',
         aws_access_key_id=access_key_id,
         aws_secret_access_key=secret_access_key
@@ -38,15 +46,16 @@ def test_access_key(access_key_id, secret_access_key):
     except:
         return False
 
-def wait_for_key_activation(access_key_id, secret_access_key, max_attempts=6, delay=10):
-    for _ in range(max_attempts):
-        if test_access_key(access_key_id, secret_access_key):
-            return True
-        time.sleep(delay)  # 等待一段時間後重試
-    return False
+def wait_for_key_activation(access_key_id, secret_access_key, timeout=60):
+    # 從短間隔開始指數退避輪詢，金鑰生效後立即繼續
+    try:
+        return wait_for(lambda: test_access_key(access_key_id, secret_access_key),
+                        timeout=timeout, description=f"access key {access_key_id}")
+    except WaitTimeout:
+        return False
 
 def delete_keys(user_names, access_key_ids):
-    client = boto3.client('iam')
+    client = get_client('iam')
 
     for user_name, access_key_id in zip(user_names, access_key_ids):
         # 移除指定的AK/SK
@@ -64,9 +73,13 @@ def main():
     user_names = []
     access_key_ids = []
 
+    run_id = new_run_id()
+    print(f"Run ID: {run_id}")
+    start_manifest(run_id, SCENARIO)
+
     for i in range(10):
         print(f"Creating user {i+1}")
-        user_name, new_ak, new_sk = create_account_and_keys(current_ak, current_sk)
+        user_name, new_ak, new_sk = create_account_and_keys(current_ak, current_sk, run_id, i+1)
         user_names.append(user_name)
         access_key_ids.append(new_ak)
         print(f"Waiting for new keys to activate for user {user_name}")
@@ -1,4 +1,20 @@
-import boto3
+import collections
+import hashlib
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.clients import get_client, get_session
+from common.journal import ResourceJournal, read_journal
+from common.manifest import start_manifest
+from common.tagging import new_run_id
+
+SCENARIO = 'muti-get-secrets'
+
+# 讀取結果只記錄每個秘密值的 SHA-256 與長度，不寫出明文；由 muti-get-secrets-recover.py 刪除
+READS_PATH = 'muti_get_secrets_reads.jsonl'
+# seed-canary-secrets.py 建立的誘餌秘密與其雜湊
+CANARY_JOURNAL_PATH = 'canary_secrets.jsonl'
 
 # 獲取所有 AWS 區域
 def get_all_regions():
@@ -42,35 +58,64 @@ def get_all_secret_names(secretsmanager_client):
         print(f"Error retrieving secret names: {str(e)}")
     return secret_names
 
-# 檢索並保存秘密
-def retrieve_and_save_secrets(secretsmanager_client, region, secret_names):
+def secret_hash(value):
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()
+
+# 檢索秘密，只記錄雜湊
+def retrieve_and_hash_secrets(secretsmanager_client, region, secret_names, journal):
+    hashes = {}
     for name in secret_names:
         try:
             secret = secretsmanager_client.get_secret_value(SecretId=name)
-            secret_value = secret['SecretString']
-
-            # 替換秘密名稱中的特殊字符
-            safe_name = name.replace('/', '_')
-
-            # 保存秘密到檔案
-            with open(f"{region}_{safe_name}.json", "w") as file:
-                file.write(secret_value)
+            # 二進位秘密沒有 SecretString
+            secret_value = secret.get('SecretString')
+            if secret_value is None:
+                secret_value = secret['SecretBinary'].hex()
+            hashes[name] = secret_hash(secret_value)
+            journal.record('secret', region=region, name=name, sha256=hashes[name], length=len(secret_value))
         except Exception as e:
             print(f"Error retrieving secret {name} in region {region}: {str(e)}")
+    return hashes
+
+def verify_canaries(hashes):
+    """比對讀到的雜湊與 seed-canary-secrets.py 記錄的誘餌秘密；沒有誘餌日誌時回傳 None"""
+    canaries = {(record['region'], record['name']): record['sha256']
+                for record in read_journal(CANARY_JOURNAL_PATH) if record.get('type') == 'canary'}
+    if not canaries:
+        return None
+    matched = sum(1 for key, digest in canaries.items() if hashes.get(key) == digest)
+    mismatched = sum(1 for key, digest in canaries.items() if key in hashes and hashes[key] != digest)
+    return {'canaries': len(canaries), 'matched': matched, 'mismatched': mismatched,
+            'missing': len(canaries) - matched - mismatched}
 
 # 主執行程序
 def main():
-    session = boto3.Session(profile_name='peace-key')
+    session = get_session(profile_name='peace-key')
+    run_id = new_run_id()
+    print(f"Run ID: {run_id}")
+    start_manifest(run_id, SCENARIO)
     regions = get_all_regions()
     print(f"Processing regions: {regions}")
     
-    for region in regions:
-        print(f"Processing region: {region}")
-        secretsmanager_client = session.client('secretsmanager', region_name=region)
-        secret_names = get_all_secret_names(secretsmanager_client)
-        retrieve_and_save_secrets(secretsmanager_client, region, secret_names)
-    
-    print("所有區域的秘密已被檢索並保存為檔案。")
+    hashes = {}
+    counts = collections.Counter()
+    with ResourceJournal(READS_PATH) as journal:
+        journal.record('run', run_id=run_id, scenario=SCENARIO)
+        for region in regions:
+            print(f"Processing region: {region}")
+            secretsmanager_client = get_client('secretsmanager', region_name=region, session=session)
+            secret_names = get_all_secret_names(secretsmanager_client)
+            for name, digest in retrieve_and_hash_secrets(secretsmanager_client, region, secret_names,
+                                                          journal).items():
+                hashes[(region, name)] = digest
+                counts[region] += 1
+        canaries = verify_canaries(hashes)
+        journal.record('summary', run_id=run_id, read=len(hashes), regions=dict(counts), canaries=canaries)
+
+    print(f"所有區域的秘密已被檢索，共 {len(hashes)} 個（{len(counts)} 個區域），雜湊記錄於 {READS_PATH}。")
+    if canaries:
+        print(f"Canary secrets: {canaries['matched']}/{canaries['canaries']} read and matched, "
+              f"{canaries['mismatched']} mismatched, {canaries['missing']} missing.")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,151 @@
+import argparse
+import concurrent.futures
+import hashlib
+import os
+import secrets
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.clients import get_client, get_session
+from common.journal import ResourceJournal, read_journal
+from common.tagging import find_tagged_arns, new_run_id, run_tags
+from common.teardown import TeardownNode, run_teardown, print_teardown_report
+
+# 誘餌秘密的日誌：每次執行的區域與數量、每個秘密的名稱與值的 SHA-256（不含明文），
+# 由 muti-get-secrets.py 比對讀取結果，並由 --teardown 重播
+JOURNAL_PATH = 'canary_secrets.jsonl'
+
+SCENARIO = 'seed-canary-secrets'
+
+# 與 muti-get-secrets.py 掃描的區域相同
+REGIONS = [
+    "us-east-1", "us-east-2", "us-west-1", "us-west-2", "ap-east-1", "ap-south-1", "ap-northeast-3",
+    "ap-northeast-2", "ap-southeast-1", "ap-southeast-2", "ap-northeast-1", "ca-central-1", "eu-central-1",
+    "eu-west-1", "eu-west-2", "eu-west-3", "eu-north-1", "sa-east-1"
+]
+
+DEFAULT_COUNT = 2000
+# 同時進行的 CreateSecret / DeleteSecret；實際速率由 common.governor 依 (服務, 區域) 控制
+MAX_WORKERS = 32
+
+def secret_hash(value):
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()
+
+def canary_name(run_id, index):
+    # 名稱含執行 ID，同一次執行的秘密可以名稱前綴辨識
+    return f"canary/{run_id}/{index:05d}"
+
+def create_canary(client, journal, run_id, index):
+    name = canary_name(run_id, index)
+    value = secrets.token_urlsafe(24)
+    response = client.create_secret(
+        Name=name,
+        SecretString=value,
+        Description="cloud-attack canary secret",
+        Tags=run_tags(run_id, SCENARIO)
+    )
+    journal.record('canary', run_id=run_id, region=client.meta.region_name, name=name, arn=response['ARN'],
+                   sha256=secret_hash(value))
+
+def seed(session, regions, count, max_workers=MAX_WORKERS):
+    """
+    以執行緒池同時建立 count 個誘餌秘密，依序分配到各區域；
+    每個區域一個經過速率控制的 client，節流時由 botocore 重試
+    """
+    run_id = new_run_id()
+    clients = {region: get_client('secretsmanager', region_name=region, session=session, governed=True)
+               for region in regions}
+    created = 0
+    failed = 0
+    started = time.perf_counter()
+    with ResourceJournal(JOURNAL_PATH) as journal:
+        journal.record('run', run_id=run_id, regions=list(regions), count=count)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(create_canary, clients[regions[index % len(regions)]], journal, run_id, index)
+                       for index in range(count)]
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    future.result()
+                    created += 1
+                except Exception as e:
+                    failed += 1
+                    print(f"Error creating canary secret: {e}")
+    elapsed = time.perf_counter() - started
+    print(f"Run ID: {run_id}")
+    print(f"Created {created} canary secrets in {len(regions)} regions in {elapsed:.1f}s "
+          f"({created / elapsed if elapsed else 0:.0f}/s), {failed} failed.")
+    return run_id, failed
+
+def load_runs(run_id=None, regions=None):
+    """日誌中的執行與其秘密 ARN；指定 run_id 時只取該次執行（日誌中沒有時以 regions 搜尋標籤）"""
+    runs = {}
+    for record in read_journal(JOURNAL_PATH):
+        if run_id and record.get('run_id') != run_id:
+            continue
+        if record.get('type') == 'run':
+            runs.setdefault(record['run_id'], {'regions': set(), 'arns': set()})['regions'].update(record['regions'])
+        elif record.get('type') == 'canary':
+            runs.setdefault(record['run_id'], {'regions': set(), 'arns': set()})['arns'].add(record['arn'])
+    if run_id and run_id not in runs:
+        runs[run_id] = {'regions': set(regions or REGIONS), 'arns': set()}
+    return runs
+
+def delete_canary(client, arn):
+    try:
+        client.delete_secret(SecretId=arn, ForceDeleteWithoutRecovery=True)
+    except client.exceptions.ResourceNotFoundException:
+        pass
+
+def build_teardown_graph(session, runs):
+    """
+    每個區域以 Tagging API 一次查出帶有執行 ID 標籤的秘密，並補上日誌中記錄、
+    標籤索引尚未更新的 ARN；秘密之間沒有相依關係，全部同時刪除
+    """
+    nodes = []
+    for run_id, run in runs.items():
+        arns = set(run['arns'])
+        for region in sorted(run['regions']):
+            tagging_client = get_client('resourcegroupstaggingapi', region_name=region, session=session,
+                                        governed=True)
+            arns.update(find_tagged_arns(tagging_client, run_id, ['secretsmanager:secret']))
+        print(f"Run {run_id}: {len(arns)} canary secrets to delete")
+        for arn in sorted(arns):
+            client = get_client('secretsmanager', region_name=arn.split(':')[3], session=session, governed=True)
+            nodes.append(TeardownNode(f"secret:{arn}", lambda c=client, a=arn: delete_canary(c, a)))
+    return nodes
+
+def teardown(session, run_id=None, regions=None, max_workers=MAX_WORKERS):
+    runs = load_runs(run_id, regions)
+    if not runs:
+        print(f"No canary runs recorded in {JOURNAL_PATH}.")
+        return 0
+    results = run_teardown(build_teardown_graph(session, runs), max_workers=max_workers)
+    failed = print_teardown_report(results)
+    # 日誌中所有執行都已清除時移除日誌
+    if failed == 0 and (run_id is None or set(load_runs()) == {run_id}) and os.path.exists(JOURNAL_PATH):
+        os.remove(JOURNAL_PATH)
+    return failed
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Seed canary secrets across regions for muti-get-secrets.py, or delete them by run tag.")
+    parser.add_argument('--profile', default='harry-redteam')
+    parser.add_argument('--count', type=int, default=DEFAULT_COUNT, help="number of canary secrets in total")
+    parser.add_argument('--regions', nargs='+', default=REGIONS)
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS)
+    parser.add_argument('--teardown', action='store_true',
+                        help=f"delete the canary secrets of every run in {JOURNAL_PATH}")
+    parser.add_argument('--run-id', help="with --teardown, only delete this run (searched by tag in --regions "
+                                         "when it is not in the journal)")
+    args = parser.parse_args()
+
+    session = get_session(profile_name=args.profile)
+    if args.teardown:
+        failed = teardown(session, args.run_id, args.regions, args.workers)
+    else:
+        _, failed = seed(session, args.regions, args.count, args.workers)
+    raise SystemExit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+# 各情境腳本與復原腳本共用的輔助模組
@@ -0,0 +1,130 @@
+import collections
+import hashlib
+import threading
+
+import boto3
+import botocore.loaders
+import botocore.session
+
+from common.governor import RETRY_CONFIG, default_governor
+
+# 快取的 client 數量上限；超過時關閉最久未使用的 client
+MAX_CLIENTS = 64
+
+
+def credential_fingerprint(access_key_id, secret_access_key=None, session_token=None):
+    """以雜湊識別一組憑證，快取鍵中不保存明文金鑰"""
+    material = '\0'.join([access_key_id or '', secret_access_key or '', session_token or ''])
+    return hashlib.sha256(material.encode()).hexdigest()[:16]
+
+
+class ClientPool:
+    """
+    以 (服務, 區域, 憑證指紋) 快取 boto3 client，LRU 淘汰。
+    同一 profile 共用一個 Session，所有 Session 共用同一個 loader，
+    服務模型只解析一次；重複使用的 client 也會沿用既有的 HTTP 連線池。
+    """
+
+    def __init__(self, max_clients=MAX_CLIENTS):
+        self.max_clients = max_clients
+        self._loader = botocore.loaders.create_loader()
+        self._sessions = {}
+        self._clients = collections.OrderedDict()
+        # boto3 的 Session 與 client 建立過程並非執行緒安全
+        self._lock = threading.RLock()
+        self._client_hooks = []
+        self.hits = 0
+        self.misses = 0
+
+    def session(self, profile_name=None, region_name=None):
+        key = (profile_name, region_name)
+        with self._lock:
+            if key not in self._sessions:
+                botocore_session = botocore.session.get_session()
+                botocore_session.register_component('data_loader', self._loader)
+                session = boto3.Session(botocore_session=botocore_session, profile_name=profile_name,
+                                        region_name=region_name)
+                # 每個 boto3.Session 都會把自己的資料路徑加到 loader，共用 loader 時去除重複
+                search_paths = self._loader.search_paths
+                search_paths[:] = list(dict.fromkeys(search_paths))
+                self._sessions[key] = session
+            return self._sessions[key]
+
+    def client(self, service_name, region_name=None, session=None, profile_name=None,
+               aws_access_key_id=None, aws_secret_access_key=None, aws_session_token=None,
+               governed=False):
+        """
+        取得（或建立）client。指定金鑰時以金鑰指紋區分，否則以 Session 的 profile 區分；
+        governed=True 時經過 common.governor 的速率控制並重試節流錯誤。
+        """
+        if aws_access_key_id:
+            session = self.session()
+            fingerprint = credential_fingerprint(aws_access_key_id, aws_secret_access_key, aws_session_token)
+        elif session is None or any(session is pooled for pooled in self._sessions.values()):
+            # 池內的 Session 以 profile 區分，臨時憑證到期時由 client 自行更新
+            session = session or self.session(profile_name)
+            fingerprint = f"profile:{session.profile_name}"
+        else:
+            # 外部傳入的 Session 可能以明文金鑰建立，依實際憑證區分
+            credentials = session.get_credentials()
+            if credentials is None:
+                fingerprint = 'anonymous'
+            else:
+                frozen = credentials.get_frozen_credentials()
+                fingerprint = credential_fingerprint(frozen.access_key, frozen.secret_key, frozen.token)
+        region_name = region_name or session.region_name
+        key = (service_name, region_name, fingerprint, governed)
+
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+                self.hits += 1
+                return client
+
+            self.misses += 1
+            kwargs = {}
+            if aws_access_key_id:
+                kwargs = {
+                    'aws_access_key_id': aws_access_key_id,
+                    'aws_secret_access_key': aws_secret_access_key,
+                    'aws_session_token': aws_session_token
+                }
+            if governed:
+                kwargs['config'] = RETRY_CONFIG
+            client = session.client(service_name, region_name=region_name, **kwargs)
+            if governed:
+                default_governor.attach(client)
+            for hook in self._client_hooks:
+                hook(client)
+
+            self._clients[key] = client
+            while len(self._clients) > self.max_clients:
+                _, evicted = self._clients.popitem(last=False)
+                evicted.close()
+            return client
+
+    def add_client_hook(self, hook):
+        """hook(client) 套用到已快取與之後建立的每個 client（例如註冊 botocore 事件）"""
+        with self._lock:
+            self._client_hooks.append(hook)
+            for client in self._clients.values():
+                hook(client)
+
+    def close(self):
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+
+
+default_pool = ClientPool()
+
+
+def get_session(profile_name=None, region_name=None):
+    return default_pool.session(profile_name, region_name)
+
+
+def get_client(service_name, region_name=None, **kwargs):
+    """default_pool.client 的簡寫，參數同 ClientPool.client"""
+    return default_pool.client(service_name, region_name=region_name, **kwargs)
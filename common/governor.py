@@ -0,0 +1,131 @@
+import random
+import threading
+import time
+
+from botocore.config import Config
+
+# 視為節流的錯誤碼
+THROTTLING_ERROR_CODES = {
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestThrottledException',
+    'TooManyRequestsException',
+    'RequestLimitExceeded',
+    'RequestThrottled',
+    'SlowDown',
+    'ProvisionedThroughputExceededException'
+}
+
+# 各服務的 (初始速率, 速率上限)，單位為每秒請求數；IAM 控制平面的限制最低
+DEFAULT_RATES = {
+    'iam': (5.0, 20.0),
+    'sts': (10.0, 50.0),
+    'lambda': (10.0, 50.0),
+    'ec2': (20.0, 100.0),
+    'secretsmanager': (20.0, 100.0),
+    'resourcegroupstaggingapi': (5.0, 20.0)
+}
+FALLBACK_RATE = (10.0, 50.0)
+
+MIN_RATE = 0.5
+
+# 由 botocore 的 standard 重試模式負責重送（指數退避加抖動），此處只放寬次數上限
+RETRY_CONFIG = Config(retries={'mode': 'standard', 'max_attempts': 10})
+
+
+def backoff_delay(attempt, base=0.5, cap=20.0):
+    """指數退避加完整抖動：介於 0 與 min(cap, base * 2^attempt) 之間"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class TokenBucket:
+    """
+    AIMD 令牌桶：成功時緩慢提高速率，遇到節流時速率減半、清空令牌並暫停一段抖動時間。
+    可跨執行緒共用。
+    """
+
+    def __init__(self, rate, max_rate, min_rate=MIN_RATE):
+        self.rate = rate
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.increase = max_rate / 100.0
+        self.tokens = 1.0
+        self.throttles = 0
+        self._last = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(max(self.rate, 1.0), self.tokens + (now - self._last) * self.rate)
+            self._last = now
+            # 先預扣令牌再於鎖外等待，其他執行緒會排在後面
+            self.tokens -= 1.0
+            wait = max(self._blocked_until - now, -self.tokens / self.rate if self.tokens < 0 else 0.0)
+        if wait > 0:
+            time.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self.throttles = 0
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self):
+        with self._lock:
+            self.throttles += 1
+            self.rate = max(self.min_rate, self.rate / 2.0)
+            self.tokens = 0.0
+            self._blocked_until = max(self._blocked_until,
+                                      time.monotonic() + backoff_delay(self.throttles))
+
+
+class RateGovernor:
+    """依 (服務, 區域) 共用令牌桶的速率控制器，掛在 botocore client 的事件上"""
+
+    def __init__(self, rates=None):
+        self.rates = dict(DEFAULT_RATES, **(rates or {}))
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, service_name, region_name):
+        key = (service_name, region_name)
+        with self._lock:
+            if key not in self._buckets:
+                rate, max_rate = self.rates.get(service_name, FALLBACK_RATE)
+                self._buckets[key] = TokenBucket(rate, max_rate)
+            return self._buckets[key]
+
+    def attach(self, client):
+        bucket = self.bucket(client.meta.service_model.service_name, client.meta.region_name)
+
+        # before-send 每次實際送出請求（包含重試）都會觸發
+        def before_send(**kwargs):
+            bucket.acquire()
+
+        # needs-retry 在每次收到回應後觸發，可得知是否被節流
+        def needs_retry(response=None, **kwargs):
+            if response is None:
+                return None
+            http_response, parsed = response
+            error_code = parsed.get('Error', {}).get('Code') if isinstance(parsed, dict) else None
+            if error_code in THROTTLING_ERROR_CODES or http_response.status_code == 429:
+                bucket.on_throttle()
+            elif http_response.status_code < 400:
+                bucket.on_success()
+            return None
+
+        client.meta.events.register('before-send', before_send)
+        client.meta.events.register('needs-retry', needs_retry)
+        return client
+
+
+default_governor = RateGovernor()
+
+
+def governed_client(session, service_name, region_name=None, governor=None, **kwargs):
+    """建立經過速率控制且會重試節流錯誤的 client"""
+    kwargs.setdefault('config', RETRY_CONFIG)
+    client = session.client(service_name, region_name=region_name, **kwargs)
+    return (governor or default_governor).attach(client)
@@ -0,0 +1,89 @@
+import json
+import os
+import time
+
+# 預設要抓取的實體種類（GetAccountAuthorizationDetails 的 Filter）
+DEFAULT_FILTERS = ('User', 'Role', 'Group', 'LocalManagedPolicy')
+
+
+class IamSnapshot:
+    """
+    GetAccountAuthorizationDetails 的結果與索引。
+    一次分頁讀取即可得到所有用戶、角色的附加政策、內嵌政策、群組與 Instance Profile，
+    不需對每個實體各自呼叫 list_attached_*_policies。
+    注意：此 API 不包含存取金鑰，金鑰仍需以 list_access_keys 查詢。
+    """
+
+    def __init__(self, details, fetched_at):
+        self.details = details
+        self.fetched_at = fetched_at
+        self.users = {user['UserName']: user for user in details.get('UserDetailList', [])}
+        self.roles = {role['RoleName']: role for role in details.get('RoleDetailList', [])}
+        self.groups = {group['GroupName']: group for group in details.get('GroupDetailList', [])}
+        self.policies = {policy['Arn']: policy for policy in details.get('Policies', [])}
+
+        # Instance Profile 只出現在角色的 InstanceProfileList 中
+        self.instance_profiles = {}
+        for role in self.roles.values():
+            for profile in role.get('InstanceProfileList', []):
+                self.instance_profiles[profile['InstanceProfileName']] = profile
+
+    def attached_policy_arns(self, entity):
+        return [policy['PolicyArn'] for policy in entity.get('AttachedManagedPolicies', [])]
+
+    def user_inline_policy_names(self, user):
+        return [policy['PolicyName'] for policy in user.get('UserPolicyList', [])]
+
+    def role_inline_policy_names(self, role):
+        return [policy['PolicyName'] for policy in role.get('RolePolicyList', [])]
+
+    def role_instance_profile_names(self, role):
+        return [profile['InstanceProfileName'] for profile in role.get('InstanceProfileList', [])]
+
+    def tags(self, entity):
+        return {tag['Key']: tag['Value'] for tag in entity.get('Tags', [])}
+
+
+def fetch_authorization_details(iam_client, filters=DEFAULT_FILTERS):
+    details = {}
+    paginator = iam_client.get_paginator('get_account_authorization_details')
+    for page in paginator.paginate(Filter=list(filters)):
+        for key, value in page.items():
+            if isinstance(value, list):
+                details.setdefault(key, []).extend(value)
+    return details
+
+
+def load_iam_snapshot(iam_client, cache_path='iam_snapshot.json', max_age=300,
+                      filters=DEFAULT_FILTERS, refresh=False):
+    """
+    讀取 IAM 快照；本機快取未超過 max_age 秒且 filters 相同時直接使用快取，
+    否則重新呼叫 GetAccountAuthorizationDetails 並寫回快取。
+    """
+    if not refresh and cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'r') as file:
+                cached = json.load(file)
+            if (cached.get('filters') == sorted(filters)
+                    and time.time() - cached.get('fetched_at', 0) <= max_age):
+                return IamSnapshot(cached['details'], cached['fetched_at'])
+        except (OSError, ValueError, KeyError):
+            pass
+
+    fetched_at = time.time()
+    details = fetch_authorization_details(iam_client, filters)
+    if cache_path:
+        # 日期欄位序列化為字串；先寫入暫存檔再取代，避免留下不完整的快取
+        tmp_path = cache_path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump({'fetched_at': fetched_at, 'filters': sorted(filters), 'details': details},
+                      file, default=str)
+        os.replace(tmp_path, cache_path)
+    details = json.loads(json.dumps(details, default=str))
+    return IamSnapshot(details, fetched_at)
+
+
+def invalidate_iam_snapshot(cache_path='iam_snapshot.json'):
+    # 刪除動作完成後快取已過時
+    if cache_path and os.path.exists(cache_path):
+        os.remove(cache_path)
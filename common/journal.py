@@ -0,0 +1,111 @@
+import json
+import os
+import threading
+import time
+
+
+class ResourceJournal:
+    """
+    只能附加寫入的 JSON lines 日誌。
+    每筆記錄寫入後立即 flush，並以批次方式 fsync：
+    累積 fsync_every 筆或距上次 fsync 超過 fsync_interval 秒時同步到磁碟，close() 時必定同步。
+    """
+
+    def __init__(self, path, fsync_every=8, fsync_interval=1.0):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def append(self, record):
+        line = json.dumps(record, separators=(',', ':'), default=str)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+            self._pending += 1
+            if (self._pending >= self.fsync_every
+                    or time.monotonic() - self._last_sync >= self.fsync_interval):
+                self._sync()
+
+    def record(self, resource_type, **fields):
+        self.append(dict(fields, type=resource_type, ts=time.time()))
+
+    def sync(self):
+        with self._lock:
+            self._sync()
+
+    def _sync(self):
+        if self._pending:
+            os.fsync(self._file.fileno())
+            self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._sync()
+                self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_journal(path):
+    """逐筆讀取日誌；程式中斷時最後一行可能只寫了一半，直接略過"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def replay_resources(path, resource_types):
+    """
+    重播日誌，依 resource_types 的對應 ({記錄 type: 結果鍵}) 組出與舊版
+    generated_resources.json 相同格式的字典
+    """
+    resources = {key: [] for key in resource_types.values()}
+    for record in read_journal(path):
+        key = resource_types.get(record.get('type'))
+        if key is None:
+            continue
+        entry = {k: v for k, v in record.items() if k not in ('type', 'ts')}
+        resources[key].append(entry)
+    return resources
+
+
+class TeardownCheckpoint:
+    """記錄已完成的刪除節點，讓中斷的清除作業可以從中斷處繼續"""
+
+    def __init__(self, path):
+        self.path = path
+        self.done = {record['node'] for record in read_journal(path) if 'node' in record}
+        self._journal = ResourceJournal(path)
+
+    def is_done(self, node_id):
+        return node_id in self.done
+
+    def mark_done(self, node_id):
+        self.done.add(node_id)
+        self._journal.append({'node': node_id, 'ts': time.time()})
+
+    def close(self):
+        self._journal.close()
+
+    def remove(self):
+        # 全部清除完成後移除檢查點檔案
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,117 @@
+import atexit
+import re
+import time
+
+from common.clients import default_pool
+from common.journal import ResourceJournal, read_journal
+
+CREDENTIAL_PATTERN = re.compile(r'Credential=([^/,\s]+)/')
+
+
+def manifest_path(run_id):
+    return f"api_manifest_{run_id}.jsonl"
+
+
+class ApiManifest:
+    """
+    以 botocore 事件記錄每次 API 呼叫的精簡清單（append-only JSON lines）：
+    ts 呼叫開始時間、op "服務:操作"、region、principal 簽章使用的存取金鑰 ID
+    （與 CloudTrail userIdentity.accessKeyId 相同，不含秘密金鑰）、
+    rid 請求 ID（對應 CloudTrail requestID）、ms 耗時、status HTTP 狀態、outcome "ok" 或錯誤碼。
+    """
+
+    def __init__(self, path, run_id=None, scenario=None):
+        self.path = path
+        self._journal = ResourceJournal(path)
+        self._journal.append({'type': 'manifest', 'run_id': run_id, 'scenario': scenario, 'ts': time.time()})
+        self._attached = set()
+
+    def attach(self, client):
+        # 同一個 client 只註冊一次
+        if id(client) in self._attached:
+            return client
+        self._attached.add(id(client))
+        events = client.meta.events
+        events.register('before-call.*.*', self._before_call)
+        # before-send 時簽章已完成，可從 Authorization 取得存取金鑰 ID
+        events.register('before-send.*.*', self._before_send)
+        events.register('after-call.*.*', self._after_call)
+        events.register('after-call-error.*.*', self._after_call_error)
+        return client
+
+    def _before_call(self, model, context, **kwargs):
+        # after-call-error 不提供 model，先記在這次呼叫的 context 中
+        context['manifest_op'] = f"{model.service_model.service_name}:{model.name}"
+        context['manifest_started'] = (time.time(), time.perf_counter())
+
+    def _before_send(self, request, **kwargs):
+        authorization = request.headers.get('Authorization') or b''
+        if isinstance(authorization, bytes):
+            authorization = authorization.decode('utf-8', 'replace')
+        match = CREDENTIAL_PATTERN.search(authorization)
+        if match and request.context is not None:
+            request.context['manifest_principal'] = match.group(1)
+
+    def _record(self, context, status, request_id, outcome):
+        if 'manifest_op' not in context:
+            return
+        started_at, started = context['manifest_started']
+        self._journal.append({
+            'ts': round(started_at, 3),
+            'op': context['manifest_op'],
+            'region': context.get('client_region'),
+            'principal': context.get('manifest_principal'),
+            'rid': request_id,
+            'ms': round((time.perf_counter() - started) * 1000, 1),
+            'status': status,
+            'outcome': outcome
+        })
+
+    def _after_call(self, http_response, parsed, context, **kwargs):
+        metadata = parsed.get('ResponseMetadata', {})
+        error_code = parsed.get('Error', {}).get('Code')
+        self._record(context, http_response.status_code, metadata.get('RequestId'), error_code or 'ok')
+
+    def _after_call_error(self, exception, context, **kwargs):
+        # 連線錯誤等沒有 HTTP 回應的失敗
+        self._record(context, None, None, type(exception).__name__)
+
+    def close(self):
+        self._journal.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def start_manifest(run_id, scenario, path=None, pool=default_pool):
+    """
+    為 client pool 中所有（包含之後建立的）client 記錄 API 呼叫；程式結束時自動關閉。
+    情境腳本取得執行 ID 後呼叫一次；清單中的請求 ID 供 detection.verify 與 CloudTrail 比對
+    """
+    manifest = ApiManifest(path or manifest_path(run_id), run_id=run_id, scenario=scenario)
+    pool.add_client_hook(manifest.attach)
+    atexit.register(manifest.close)
+    return manifest
+
+
+def read_manifest(path):
+    """回傳 (標頭, 呼叫記錄的 iterator)"""
+    records = read_journal(path)
+    header = next(records, None)
+    return header, records
+
+
+def load_manifest_index(path):
+    """以請求 ID 建立索引，與 CloudTrail 的 requestID 一次比對；沒有請求 ID 的呼叫（連線失敗）另外回傳"""
+    header, records = read_manifest(path)
+    by_request_id = {}
+    without_request_id = []
+    for record in records:
+        if record.get('rid'):
+            by_request_id[record['rid']] = record
+        else:
+            without_request_id.append(record)
+    return header, by_request_id, without_request_id
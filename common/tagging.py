@@ -0,0 +1,103 @@
+import uuid
+
+from common.clients import get_client
+
+# 每次執行產生的資源都帶有這兩個標籤，清除與驗證時直接以標籤查詢
+RUN_TAG_KEY = 'cloud-attack:run-id'
+SCENARIO_TAG_KEY = 'cloud-attack:scenario'
+
+
+def new_run_id():
+    # 12 個十六進位字元；GetFederationToken 的 Name 上限為 32 字元，名稱需保持簡短
+    return uuid.uuid4().hex[:12]
+
+
+def run_tags(run_id, scenario):
+    """IAM / EC2 使用的 [{'Key': ..., 'Value': ...}] 格式"""
+    return [
+        {'Key': RUN_TAG_KEY, 'Value': run_id},
+        {'Key': SCENARIO_TAG_KEY, 'Value': scenario}
+    ]
+
+
+def run_tag_dict(run_id, scenario):
+    """Lambda 等服務使用的 {key: value} 格式"""
+    return {RUN_TAG_KEY: run_id, SCENARIO_TAG_KEY: scenario}
+
+
+def tag_specifications(run_id, scenario, resource_types, extra_tags=()):
+    # EC2 建立時即加上標籤（TagSpecifications），避免資源存在卻沒有標籤的空窗
+    tags = list(extra_tags) + run_tags(run_id, scenario)
+    return [{'ResourceType': resource_type, 'Tags': tags} for resource_type in resource_types]
+
+
+def has_run_tag(tags, run_id):
+    if isinstance(tags, list):
+        tags = {tag['Key']: tag['Value'] for tag in tags}
+    return tags.get(RUN_TAG_KEY) == run_id
+
+
+def find_tagged_arns(tagging_client, run_id, resource_type_filters):
+    """以 Resource Groups Tagging API 直接查詢帶有執行 ID 標籤的資源 ARN（單一區域）"""
+    arns = []
+    paginator = tagging_client.get_paginator('get_resources')
+    for page in paginator.paginate(
+            TagFilters=[{'Key': RUN_TAG_KEY, 'Values': [run_id]}],
+            ResourceTypeFilters=list(resource_type_filters)):
+        for mapping in page['ResourceTagMappingList']:
+            arns.append(mapping['ResourceARN'])
+    return arns
+
+
+def run_path(run_id):
+    """
+    IAM 實體的 Path。Resource Groups Tagging API 不支援 IAM，
+    以 Path 建立後即可用 list_users/list_roles(PathPrefix=...) 直接查出同一次執行的實體
+    """
+    return f"/cloud-attack/{run_id}/"
+
+
+def find_run_iam_entities(iam_client, run_id):
+    """回傳 {'users': [...], 'roles': [...], 'instance_profiles': [{'instance_profile_name', 'role_names'}]}"""
+    path_prefix = run_path(run_id)
+    users = []
+    for page in iam_client.get_paginator('list_users').paginate(PathPrefix=path_prefix):
+        users.extend(user['UserName'] for user in page['Users'])
+    roles = []
+    for page in iam_client.get_paginator('list_roles').paginate(PathPrefix=path_prefix):
+        roles.extend(role['RoleName'] for role in page['Roles'])
+    instance_profiles = []
+    for page in iam_client.get_paginator('list_instance_profiles').paginate(PathPrefix=path_prefix):
+        for profile in page['InstanceProfiles']:
+            instance_profiles.append({
+                'instance_profile_name': profile['InstanceProfileName'],
+                'role_names': [role['RoleName'] for role in profile['Roles']]
+            })
+    return {'users': users, 'roles': roles, 'instance_profiles': instance_profiles}
+
+
+def arn_resource(arn):
+    """'arn:aws:ec2:us-east-2:123:instance/i-abc' -> ('us-east-2', 'instance', 'i-abc')"""
+    parts = arn.split(':', 6)
+    region = parts[3]
+    resource = parts[5] if len(parts) == 6 else parts[5] + ':' + parts[6]
+    if '/' in resource:
+        resource_type, resource_id = resource.split('/', 1)
+    else:
+        resource_type, _, resource_id = resource.partition(':')
+    return region, resource_type, resource_id
+
+
+def find_run_resources(session, run_id, regions, resource_type_filters, iam_client=None):
+    """
+    直接查出一次執行建立的所有資源：IAM 以 Path 查詢，其餘以各區域的 Tagging API 查詢。
+    回傳 {'iam': find_run_iam_entities(...) 或 None, 'arns': [(region, resource_type, resource_id), ...]}
+    """
+    found = {'iam': None, 'arns': []}
+    if iam_client is not None:
+        found['iam'] = find_run_iam_entities(iam_client, run_id)
+    for region in regions:
+        tagging_client = get_client('resourcegroupstaggingapi', region_name=region, session=session, governed=True)
+        for arn in find_tagged_arns(tagging_client, run_id, resource_type_filters):
+            found['arns'].append(arn_resource(arn))
+    return found
@@ -0,0 +1,134 @@
+import concurrent.futures
+
+# 節點執行結果
+STATUS_OK = 'ok'
+STATUS_FAILED = 'failed'
+STATUS_SKIPPED = 'skipped'
+# 先前執行時已完成，由檢查點略過
+STATUS_RESUMED = 'resumed'
+
+
+class TeardownNode:
+    """
+    刪除圖中的一個節點：action 為無參數函數，depends_on 為必須先完成的節點 ID；
+    resumable=False 的節點不寫入檢查點，每次都會重新執行（用於可重複執行的搜尋與清除）
+    """
+
+    def __init__(self, node_id, action, depends_on=(), resumable=True):
+        self.node_id = node_id
+        self.action = action
+        self.depends_on = list(depends_on)
+        self.resumable = resumable
+
+
+class TeardownResult:
+    def __init__(self, node_id, status, error=None):
+        self.node_id = node_id
+        self.status = status
+        self.error = error
+
+    def __repr__(self):
+        return f"TeardownResult({self.node_id!r}, {self.status!r}, {self.error!r})"
+
+
+def _validate_graph(nodes):
+    node_map = {}
+    for node in nodes:
+        if node.node_id in node_map:
+            raise ValueError(f"Duplicate teardown node: {node.node_id}")
+        node_map[node.node_id] = node
+    for node in nodes:
+        for dep in node.depends_on:
+            if dep not in node_map:
+                raise ValueError(f"Teardown node {node.node_id} depends on unknown node {dep}")
+    return node_map
+
+
+def run_teardown(nodes, max_workers=8, checkpoint=None):
+    """
+    依相依關係平行執行刪除節點。
+    沒有相依關係的節點會同時在執行緒池中執行，整體時間取決於最長的相依鏈。
+    某節點失敗時，所有相依於它的節點都會被標記為 skipped，不會執行。
+    若提供 checkpoint (common.journal.TeardownCheckpoint)，已完成的節點不再執行，
+    每個成功的節點也會寫入檢查點。
+    回傳 {node_id: TeardownResult}
+    """
+    node_map = _validate_graph(nodes)
+
+    # 計算每個節點尚未完成的前置節點數，以及反向的相依表
+    remaining = {node_id: len(set(node.depends_on)) for node_id, node in node_map.items()}
+    dependents = {node_id: [] for node_id in node_map}
+    for node in node_map.values():
+        for dep in set(node.depends_on):
+            dependents[dep].append(node.node_id)
+
+    results = {}
+
+    def skip_dependents(node_id, reason):
+        stack = list(dependents[node_id])
+        while stack:
+            dep_id = stack.pop()
+            if dep_id in results:
+                continue
+            results[dep_id] = TeardownResult(dep_id, STATUS_SKIPPED, reason)
+            stack.extend(dependents[dep_id])
+
+    def complete(node_id, status):
+        results[node_id] = TeardownResult(node_id, status)
+        ready = []
+        for dep_id in dependents[node_id]:
+            remaining[dep_id] -= 1
+            if remaining[dep_id] == 0:
+                ready.append(dep_id)
+        return ready
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        running = {}
+
+        def submit_ready(node_ids):
+            node_ids = list(node_ids)
+            while node_ids:
+                node_id = node_ids.pop()
+                if node_id in results:
+                    continue
+                if checkpoint is not None and node_map[node_id].resumable and checkpoint.is_done(node_id):
+                    node_ids.extend(complete(node_id, STATUS_RESUMED))
+                    continue
+                future = executor.submit(node_map[node_id].action)
+                running[future] = node_id
+
+        submit_ready([node_id for node_id, count in remaining.items() if count == 0])
+
+        while running:
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                node_id = running.pop(future)
+                error = future.exception()
+                if error is not None:
+                    results[node_id] = TeardownResult(node_id, STATUS_FAILED, error)
+                    skip_dependents(node_id, f"dependency {node_id} failed")
+                    continue
+
+                if checkpoint is not None and node_map[node_id].resumable:
+                    checkpoint.mark_done(node_id)
+                submit_ready(complete(node_id, STATUS_OK))
+
+    # 仍未執行的節點表示圖中有循環相依
+    for node_id in node_map:
+        if node_id not in results:
+            results[node_id] = TeardownResult(node_id, STATUS_SKIPPED, "dependency cycle")
+
+    return results
+
+
+def print_teardown_report(results):
+    failed = 0
+    for node_id in sorted(results):
+        result = results[node_id]
+        if result.status in (STATUS_OK, STATUS_RESUMED):
+            print(f"[{result.status}] {node_id}")
+        else:
+            failed += 1
+            print(f"[{result.status}] {node_id}: {result.error}")
+    print(f"Teardown finished: {len(results) - failed} succeeded, {failed} failed or skipped.")
+    return failed
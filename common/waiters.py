@@ -0,0 +1,87 @@
+import random
+import time
+
+from botocore.exceptions import ClientError
+
+# 第一次輪詢間隔很短，之後指數增加到上限；大多數資源在數秒內就會到達目標狀態
+FIRST_DELAY = 0.5
+MAX_DELAY = 15.0
+DEFAULT_TIMEOUT = 300
+
+
+class WaitTimeout(Exception):
+    """超過總等待時間仍未到達目標狀態；pending 為尚未完成的項目"""
+
+    def __init__(self, message, pending=()):
+        super().__init__(message)
+        self.pending = pending
+
+
+def poll_delays(first_delay=FIRST_DELAY, max_delay=MAX_DELAY):
+    """指數增加的輪詢間隔，每次取上限的 50%~100% 作為抖動，避免同時輪詢的請求集中"""
+    delay = first_delay
+    while True:
+        yield delay * random.uniform(0.5, 1.0)
+        delay = min(max_delay, delay * 2)
+
+
+def wait_for(check, timeout=DEFAULT_TIMEOUT, first_delay=FIRST_DELAY, max_delay=MAX_DELAY,
+             description='condition'):
+    """重複呼叫 check() 直到回傳真值並回傳該值；超過 timeout 秒則拋出 WaitTimeout"""
+    deadline = time.monotonic() + timeout
+    for delay in poll_delays(first_delay, max_delay):
+        result = check()
+        if result:
+            return result
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise WaitTimeout(f"Timed out after {timeout}s waiting for {description}")
+        time.sleep(min(delay, remaining))
+
+
+def wait_for_all(keys, check_many, timeout=DEFAULT_TIMEOUT, first_delay=FIRST_DELAY,
+                 max_delay=MAX_DELAY, description='resources'):
+    """
+    同時等待多個資源：check_many(pending) 一次查詢所有尚未完成的項目，
+    回傳其中已完成的項目。全部完成時回傳，超過 timeout 秒則拋出 WaitTimeout（含未完成項目）。
+    """
+    pending = set(keys)
+    deadline = time.monotonic() + timeout
+    for delay in poll_delays(first_delay, max_delay):
+        if not pending:
+            return
+        pending -= set(check_many(set(pending)))
+        if not pending:
+            return
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise WaitTimeout(f"Timed out after {timeout}s waiting for {description}: {sorted(pending)}",
+                              pending=sorted(pending))
+        time.sleep(min(delay, remaining))
+
+
+def client_error_matches(error, codes, message=None):
+    if not isinstance(error, ClientError):
+        return False
+    error_info = error.response.get('Error', {})
+    if error_info.get('Code') not in codes:
+        return False
+    return message is None or message in error_info.get('Message', '')
+
+
+def retry_until_ready(call, codes, message=None, timeout=DEFAULT_TIMEOUT, first_delay=FIRST_DELAY,
+                      max_delay=MAX_DELAY, description='call'):
+    """
+    呼叫 call() 並回傳結果；遇到指定錯誤碼（例如 IAM 變更尚未傳遞到其他服務）時等待後重試，
+    取代呼叫前固定 sleep 的寫法：一旦生效就立即成功
+    """
+    deadline = time.monotonic() + timeout
+    for delay in poll_delays(first_delay, max_delay):
+        try:
+            return call()
+        except ClientError as e:
+            remaining = deadline - time.monotonic()
+            if not client_error_matches(e, codes, message) or remaining <= 0:
+                raise
+            print(f"Waiting for {description}: {e.response['Error'].get('Message', '')}")
+            time.sleep(min(delay, remaining))
@@ -0,0 +1 @@
+# 以本機 CloudTrail 日誌驗證情境是否被偵測的分析模組
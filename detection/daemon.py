@@ -0,0 +1,625 @@
+import argparse
+import bisect
+import collections
+import concurrent.futures
+import ctypes
+import ctypes.util
+import datetime
+import json
+import multiprocessing
+import os
+import queue
+import select
+import signal
+import struct
+import time
+import zlib
+
+from detection.reader import LOG_FILE_PATTERN, delivery_time, iter_records, projector
+from detection.rules import RULES, Alert
+
+# CloudTrail 事件最晚約 15 分鐘送達；watermark = 目前最大事件時間 - LATENESS
+LATENESS = 900
+POLL_INTERVAL = 2.0
+STATS_INTERVAL = 60
+
+# 每條規則的狀態上限：分組數、每個分組視窗內保留的事件數、每個 join key 保留的事件數
+MAX_GROUPS = 100000
+MAX_GROUP_EVENTS = 10000
+MAX_KEY_EVENTS = 1000
+
+# inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def _is_log_file(name):
+    return LOG_FILE_PATTERN.search(name) is not None
+
+
+def _load_inotify():
+    """Linux 以外（或 libc 沒有 inotify）回傳 None，改用輪詢"""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        libc.inotify_init1, libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class DirectoryWatcher:
+    """
+    監看 CloudTrail 投放目錄（含子目錄）中寫入完成的日誌檔。
+    以 inotify 的 IN_CLOSE_WRITE / IN_MOVED_TO 判斷檔案完整（同步工具先寫暫存檔再改名）；
+    新建立的子目錄加入監看後立即掃描，避免漏掉加入前寫入的檔案。
+    沒有 inotify 時每 poll_interval 秒掃描一次，只回傳 mtime 早於上一次掃描的檔案
+    """
+
+    def __init__(self, root, poll_interval=POLL_INTERVAL, use_inotify=True):
+        self.root = root
+        self.poll_interval = poll_interval
+        self.seen = set()
+        self.watches = {}
+        self.fd = None
+        self._libc = _load_inotify() if use_inotify else None
+        if self._libc is not None:
+            self.fd = self._libc.inotify_init1(os.O_CLOEXEC)
+            if self.fd < 0:
+                self._libc, self.fd = None, None
+        self._last_scan = 0.0
+
+    @property
+    def mode(self):
+        return 'inotify' if self.fd is not None else 'polling'
+
+    def _watch(self, path):
+        if self.fd is None or path in self.watches.values():
+            return
+        descriptor = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if descriptor >= 0:
+            self.watches[descriptor] = path
+
+    def _scan(self, path, ready_before=None):
+        """列出 path 下尚未看過的日誌檔，並監看所有子目錄"""
+        found = []
+        stack = [path]
+        while stack:
+            directory = stack.pop()
+            self._watch(directory)
+            try:
+                entries = list(os.scandir(directory))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif _is_log_file(entry.name) and entry.path not in self.seen:
+                    if ready_before is not None and entry.stat().st_mtime >= ready_before:
+                        continue
+                    self.seen.add(entry.path)
+                    found.append(entry.path)
+        return sorted(found)
+
+    def existing(self):
+        """啟動時已在目錄中的檔案（同時建立所有監看）"""
+        self._last_scan = time.time()
+        return self._scan(self.root)
+
+    def skip_existing(self):
+        self.existing()
+
+    def wait(self, timeout=None):
+        """等待新的完整日誌檔，回傳路徑清單（逾時回傳空清單）"""
+        if self.fd is None:
+            time.sleep(self.poll_interval if timeout is None else min(timeout, self.poll_interval))
+            scanned_at = time.time()
+            found = self._scan(self.root, ready_before=self._last_scan)
+            self._last_scan = scanned_at
+            return found
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        found = []
+        offset = 0
+        while offset < len(data):
+            descriptor, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+            offset += EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                # 事件佇列溢位：重新掃描整個目錄
+                found.extend(self._scan(self.root))
+                continue
+            directory = self.watches.get(descriptor)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    found.extend(self._scan(path))
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and _is_log_file(path) and path not in self.seen:
+                self.seen.add(path)
+                found.append(path)
+        return found
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def _normalize(value):
+    # 與 detection.rules 從 JSON 字串擷取的值一致：數值與布林以 JSON 表示
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value)
+
+
+def _field_getter(field):
+    project = projector((field,))
+    return lambda record: _normalize(project(record)[0])
+
+
+def _matches(record, conditions):
+    for get, expected in conditions:
+        value = get(record)
+        if expected is None:
+            if value is not None:
+                return False
+        elif isinstance(expected, (list, tuple, set, frozenset)):
+            if value not in expected:
+                return False
+        elif value != expected:
+            return False
+    return True
+
+
+def _conditions(where):
+    return [(_field_getter(field), expected) for field, expected in (where or {}).items()]
+
+
+# 依規則名稱快取編譯結果；工作行程第一次收到檔案時編譯
+_routers = {}
+
+
+def compile_router(rules):
+    """
+    eventName → [(規則索引, 是否為 follows 的另一側, 條件, 分割 key, 分組, 彙總值)]。
+    follows 規則以 join key 分割（兩側事件落在同一個分割），其他規則以分組值分割
+    """
+    names = tuple(rule.name for rule in rules)
+    if names in _routers:
+        return _routers[names]
+    routes = collections.defaultdict(list)
+    for index, rule in enumerate(rules):
+        group = [_field_getter(field) for field in rule.group_by or ()]
+        field = rule.aggregate[1]
+        value = _field_getter(field) if field else None
+        if rule.follows:
+            key = _field_getter(rule.follows.key)
+            other_key = _field_getter(rule.follows.other_key)
+            for name in rule.follows.events:
+                routes[name].append((index, True, _conditions(rule.follows.where), other_key, [], None))
+        else:
+            key = None
+        for name in rule.events:
+            routes[name].append((index, False, _conditions(rule.where), key, group, value))
+    _routers[names] = routes
+    return routes
+
+
+def partition_of(key, partitions):
+    # 各行程一致的雜湊（內建 hash() 每個行程不同）
+    return zlib.crc32(key.encode('utf-8')) % partitions if partitions > 1 else 0
+
+
+def route_file(path, rules, partitions):
+    """
+    工作行程：解析一個日誌檔，只保留規則用得到的事件並依分割 key 分組。
+    回傳 (記錄數, 最大事件時間, 每個分割的訊息清單)；訊息為 (規則索引, 另一側, join key, 時間, 分組, 值)
+    """
+    routes = compile_router(rules)
+    project_time = projector(('eventTime',))
+    messages = [[] for _ in range(partitions)]
+    records = 0
+    latest = None
+    for record in iter_records(path):
+        records += 1
+        when, = project_time(record)
+        if when is None:
+            continue
+        if latest is None or when > latest:
+            latest = when
+        targets = routes.get(record.get('eventName'))
+        if not targets:
+            continue
+        for index, other, conditions, get_key, group_getters, get_value in targets:
+            if not _matches(record, conditions):
+                continue
+            key = get_key(record) if get_key else None
+            group = tuple(get(record) for get in group_getters)
+            if get_key:
+                if key is None:
+                    continue
+                partition = partition_of(key, partitions)
+            else:
+                partition = partition_of('\x1f'.join(str(value) for value in group), partitions)
+            messages[partition].append((index, other, key, when, group,
+                                        get_value(record) if get_value else None))
+    return records, latest, messages
+
+
+class _GroupState:
+    __slots__ = ('times', 'values', 'counts', 'latest', 'firing')
+
+    def __init__(self):
+        self.times = []
+        self.values = []
+        self.counts = collections.Counter()
+        self.latest = None
+        self.firing = False
+
+
+class WindowAggregate:
+    """
+    一條規則的分組滑動視窗：每個分組保留視窗內依時間排序的事件與值的計數。
+    視窗以分組最新的事件時間為結尾；同一分組持續達到門檻時只告警一次，低於門檻後重新啟用。
+    分組以 LRU 排列，advance() 從最久未更新的一端清除已關閉的視窗
+    """
+
+    def __init__(self, rule, max_groups=MAX_GROUPS, max_group_events=MAX_GROUP_EVENTS):
+        self.rule = rule
+        self.window = rule.window
+        self.distinct = rule.aggregate[0] == 'count_distinct'
+        self.max_groups = max_groups
+        self.max_group_events = max_group_events
+        self.groups = collections.OrderedDict()
+        self.late = 0
+
+    def _expire(self, state, before):
+        cut = bisect.bisect_right(state.times, before)
+        if cut:
+            if self.distinct:
+                for value in state.values[:cut]:
+                    state.counts[value] -= 1
+                    if not state.counts[value]:
+                        del state.counts[value]
+            del state.times[:cut]
+            del state.values[:cut]
+
+    def add(self, group, when, value):
+        if self.distinct and value is None:
+            return None
+        state = self.groups.get(group)
+        if state is None:
+            if len(self.groups) >= self.max_groups:
+                self.groups.popitem(last=False)
+            state = self.groups[group] = _GroupState()
+        else:
+            self.groups.move_to_end(group)
+
+        if self.window is not None and state.latest is not None and when <= state.latest - self.window:
+            # 早於此分組目前視窗的事件
+            self.late += 1
+            return None
+        position = bisect.bisect_right(state.times, when)
+        state.times.insert(position, when)
+        state.values.insert(position, value)
+        if self.distinct:
+            state.counts[value] += 1
+        if state.latest is None or when > state.latest:
+            state.latest = when
+        if self.window is not None:
+            self._expire(state, state.latest - self.window)
+        if len(state.times) > self.max_group_events:
+            self._expire(state, state.times[len(state.times) - self.max_group_events - 1])
+
+        level = len(state.counts) if self.distinct else len(state.times)
+        if level < self.rule.threshold:
+            state.firing = False
+            return None
+        if state.firing:
+            return None
+        state.firing = True
+        return Alert(self.rule.name, group, when, state.latest, level)
+
+    def advance(self, watermark):
+        """watermark 之前的視窗不會再有事件加入：清除整個視窗都已關閉的分組"""
+        if self.window is None:
+            return
+        horizon = watermark - self.window
+        while self.groups:
+            group, state = next(iter(self.groups.items()))
+            if state.latest > horizon:
+                break
+            del self.groups[group]
+
+    def __len__(self):
+        return sum(len(state.times) for state in self.groups.values())
+
+
+class FollowsJoin:
+    """
+    Follows 的串流 join：另一側事件（例如 CreateUser）依 join key 保留 within 秒；
+    主事件到達時若 within 秒內已有另一側事件即配對，否則暫存到 watermark 超過其時間
+    （另一側事件可能來自較晚送達的其他區域日誌檔）。兩側都以到達順序的佇列清除過期項目
+    """
+
+    def __init__(self, follows, max_key_events=MAX_KEY_EVENTS):
+        self.within = follows.within
+        self.max_key_events = max_key_events
+        self.others = {}
+        self.pending = {}
+        self._other_expiry = collections.deque()
+        self._pending_expiry = collections.deque()
+        self.watermark = None
+
+    def add_other(self, key, when):
+        times = self.others.setdefault(key, [])
+        bisect.insort(times, when)
+        if len(times) > self.max_key_events:
+            del times[0]
+        self._other_expiry.append((when, key))
+        matched = []
+        waiting = self.pending.get(key)
+        if waiting:
+            keep = []
+            for entry in waiting:
+                (matched if when <= entry[0] <= when + self.within else keep).append(entry)
+            if keep:
+                self.pending[key] = keep
+            else:
+                del self.pending[key]
+        return matched
+
+    def add_main(self, key, when, group, value):
+        times = self.others.get(key)
+        if times:
+            position = bisect.bisect_right(times, when)
+            if position and when - times[position - 1] <= self.within:
+                return [(when, group, value)]
+        if self.watermark is None or when >= self.watermark:
+            waiting = self.pending.setdefault(key, [])
+            if len(waiting) < self.max_key_events:
+                waiting.append((when, group, value))
+                self._pending_expiry.append((when, key))
+        return []
+
+    def advance(self, watermark):
+        self.watermark = watermark
+        horizon = watermark - self.within
+        while self._other_expiry and self._other_expiry[0][0] < horizon:
+            _, key = self._other_expiry.popleft()
+            times = self.others.get(key)
+            if times:
+                del times[:bisect.bisect_left(times, horizon)]
+                if not times:
+                    del self.others[key]
+        while self._pending_expiry and self._pending_expiry[0][0] < watermark:
+            _, key = self._pending_expiry.popleft()
+            waiting = self.pending.get(key)
+            if waiting:
+                waiting = [entry for entry in waiting if entry[0] >= watermark]
+                if waiting:
+                    self.pending[key] = waiting
+                else:
+                    del self.pending[key]
+
+    def __len__(self):
+        return sum(map(len, self.others.values())) + sum(map(len, self.pending.values()))
+
+
+class Partition:
+    """一個分割內所有規則的狀態；以 route_file 產生的訊息更新"""
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.aggregates = [WindowAggregate(rule) for rule in rules]
+        self.joins = [FollowsJoin(rule.follows) if rule.follows else None for rule in rules]
+        self.watermark = None
+
+    def handle(self, messages, watermark=None):
+        alerts = []
+        for index, other, key, when, group, value in messages:
+            join = self.joins[index]
+            if join is None:
+                matched = [(when, group, value)]
+            elif other:
+                matched = join.add_other(key, when)
+            else:
+                matched = join.add_main(key, when, group, value)
+            for matched_when, matched_group, matched_value in matched:
+                alert = self.aggregates[index].add(matched_group, matched_when, matched_value)
+                if alert:
+                    alerts.append(alert)
+        if watermark is not None and (self.watermark is None or watermark > self.watermark):
+            self.watermark = watermark
+            for aggregate, join in zip(self.aggregates, self.joins):
+                aggregate.advance(watermark)
+                if join:
+                    join.advance(watermark)
+        return alerts
+
+    def state_size(self):
+        return sum(map(len, self.aggregates)) + sum(len(join) for join in self.joins if join)
+
+
+def _partition_loop(index, rules, inbox, outbox):
+    """分割行程：依序處理訊息，告警與狀態大小送回主行程"""
+    partition = Partition(rules)
+    while True:
+        item = inbox.get()
+        if item is None:
+            break
+        messages, watermark = item
+        outbox.put((index, partition.handle(messages, watermark), partition.state_size()))
+
+
+class StreamingDetector:
+    """
+    partitions == 1 時在本行程解析與評估；否則以 partitions 個行程平行解析檔案，
+    事件依分割 key 送到 partitions 個各自持有狀態的分割行程
+    """
+
+    def __init__(self, rules=RULES, partitions=1, lateness=LATENESS):
+        self.rules = list(rules)
+        self.partitions = partitions
+        self.lateness = lateness
+        self.latest = None
+        self.records = 0
+        self.routed = 0
+        self.files = 0
+        self.state_sizes = [0] * partitions
+        if partitions == 1:
+            self.local = Partition(self.rules)
+            self.executor = None
+            return
+        self.local = None
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=partitions)
+        self.outbox = multiprocessing.Queue()
+        self.inboxes = [multiprocessing.Queue() for _ in range(partitions)]
+        self.processes = [multiprocessing.Process(target=_partition_loop,
+                                                  args=(index, self.rules, inbox, self.outbox), daemon=True)
+                          for index, inbox in enumerate(self.inboxes)]
+        for process in self.processes:
+            process.start()
+        self._outstanding = 0
+
+    @property
+    def watermark(self):
+        return None if self.latest is None else self.latest - self.lateness
+
+    def _account(self, records, latest, messages):
+        self.files += 1
+        self.records += records
+        self.routed += sum(map(len, messages))
+        if latest is not None and (self.latest is None or latest > self.latest):
+            self.latest = latest
+
+    def _collect(self, block=False):
+        alerts = []
+        while self._outstanding:
+            try:
+                index, partition_alerts, size = self.outbox.get(block=block)
+            except queue.Empty:
+                break
+            self._outstanding -= 1
+            self.state_sizes[index] = size
+            alerts.extend(partition_alerts)
+        return alerts
+
+    def process(self, paths):
+        """解析並評估一批新檔案，回傳新的告警"""
+        if self.executor is None:
+            alerts = []
+            for path in paths:
+                records, latest, messages = route_file(path, self.rules, 1)
+                self._account(records, latest, messages)
+                alerts.extend(self.local.handle(messages[0], self.watermark))
+            self.state_sizes[0] = self.local.state_size()
+            return alerts
+        futures = [self.executor.submit(route_file, path, self.rules, self.partitions) for path in paths]
+        for future in futures:
+            records, latest, messages = future.result()
+            self._account(records, latest, messages)
+            for inbox, partition_messages in zip(self.inboxes, messages):
+                inbox.put((partition_messages, self.watermark))
+                self._outstanding += 1
+        return self._collect()
+
+    def flush(self):
+        """等待分割行程處理完所有已送出的訊息"""
+        if self.executor is None:
+            return []
+        alerts = []
+        while self._outstanding:
+            alerts.extend(self._collect(block=True))
+        return alerts
+
+    def close(self):
+        if self.executor is None:
+            return
+        for inbox in self.inboxes:
+            inbox.put(None)
+        for process in self.processes:
+            process.join()
+        self.executor.shutdown()
+
+
+def _iso(when):
+    return datetime.datetime.fromtimestamp(when, datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def print_alert(alert, delivered=None):
+    delay = f", {delivered - alert.first:.0f}s after the event" if delivered else ''
+    print(f"[{alert.rule}] {json.dumps(alert.group)} at {_iso(alert.first)} "
+          f"(level {alert.peak}{delay})", flush=True)
+
+
+def run(root, rules=RULES, partitions=1, lateness=LATENESS, skip_existing=False, once=False,
+        poll_interval=POLL_INTERVAL, use_inotify=True, on_alert=print_alert):
+    """監看 root 並持續評估規則；once 時只處理目前已有的檔案後結束。回傳 StreamingDetector"""
+    watcher = DirectoryWatcher(root, poll_interval, use_inotify)
+    detector = StreamingDetector(rules, partitions, lateness)
+    started = time.perf_counter()
+    last_stats = started
+    try:
+        if skip_existing:
+            watcher.skip_existing()
+            paths = []
+        else:
+            # 依日誌檔名的送達時間排序，近似 CloudTrail 實際送達順序
+            paths = sorted(watcher.existing(), key=lambda path: (delivery_time(path) or 0, path))
+        while True:
+            for alert in detector.process(paths) + (detector.flush() if once else []):
+                on_alert(alert, time.time() if not once else None)
+            if once:
+                break
+            now = time.perf_counter()
+            if now - last_stats >= STATS_INTERVAL:
+                print(f"{detector.files} files, {detector.records} events "
+                      f"({detector.records / (now - started):.0f}/s), state {sum(detector.state_sizes)} entries, "
+                      f"watermark {_iso(detector.watermark) if detector.watermark else '-'}", flush=True)
+                last_stats = now
+            paths = watcher.wait(timeout=poll_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for alert in detector.flush():
+            on_alert(alert, None)
+        detector.close()
+        watcher.close()
+    detector.elapsed = time.perf_counter() - started
+    return detector
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate detection rules on CloudTrail files as they arrive.")
+    parser.add_argument('root', help="drop directory that receives CloudTrail objects (any layout below it)")
+    parser.add_argument('--rules', nargs='+', choices=[rule.name for rule in RULES])
+    parser.add_argument('--partitions', type=int, default=1, help="processes to parse and evaluate with")
+    parser.add_argument('--lateness', type=int, default=LATENESS, help="seconds of event-time disorder to allow")
+    parser.add_argument('--skip-existing', action='store_true', help="only process files that arrive later")
+    parser.add_argument('--once', action='store_true', help="process the files already present and exit")
+    parser.add_argument('--poll', action='store_true', help="poll the directory instead of using inotify")
+    parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL)
+    args = parser.parse_args()
+
+    rules = [rule for rule in RULES if not args.rules or rule.name in args.rules]
+    # SIGTERM 與 Ctrl-C 相同：處理完已送出的訊息後結束
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    watcher_mode = 'polling' if args.poll or _load_inotify() is None else 'inotify'
+    print(f"Watching {args.root} ({watcher_mode}, {args.partitions} partitions, {len(rules)} rules).", flush=True)
+    detector = run(args.root, rules, args.partitions, args.lateness, args.skip_existing, args.once,
+                   args.poll_interval, use_inotify=not args.poll)
+    print(f"Processed {detector.files} files, {detector.records} events in {detector.elapsed:.2f}s "
+          f"({detector.records / detector.elapsed:.0f} events/s), {detector.routed} routed to rules.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import argparse
+import bisect
+import collections
+import time
+
+from detection.reader import ORDER_LATENESS, parse_date, read_events_in_order
+
+JOIN_EVENTS = ('GetFederationToken', 'ConsoleLogin', 'GetSigninToken')
+
+JOIN_FIELDS = (
+    'eventTime',
+    'eventName',
+    'eventSource',
+    'errorCode',
+    'recipientAccountId',
+    'sourceIPAddress',
+    'userIdentity.arn',
+    'userIdentity.accessKeyId',
+    'requestParameters.name',
+    'requestParameters.durationSeconds',
+    'responseElements.federatedUser.arn',
+    'responseElements.credentials.accessKeyId',
+    'responseElements.ConsoleLogin'
+)
+
+STS = 'sts.amazonaws.com'
+SIGNIN = 'signin.amazonaws.com'
+
+# GetFederationToken 未指定 DurationSeconds 時為 12 小時，上限 36 小時
+DEFAULT_DURATION = 43200
+MAX_DURATION = 129600
+
+# find_pivots 每推進這麼多秒的事件時間呼叫一次 advance()（advance 需走過所有 ARN）
+ADVANCE_INTERVAL = 3600
+
+Token = collections.namedtuple('Token', ['arn', 'issued', 'expires', 'access_key_id', 'issuer', 'source_ip'])
+Login = collections.namedtuple('Login', ['arn', 'time', 'event_name', 'access_key_id', 'source_ip', 'outcome'])
+Pivot = collections.namedtuple('Pivot', ['arn', 'token', 'login', 'delay'])
+
+
+def federated_user_arn(account_id, name):
+    return f"arn:aws:sts::{account_id}:federated-user/{name}"
+
+
+class _Side:
+    """同一個聯合使用者 ARN 下依時間排序的記錄；times 與 entries 平行，以 bisect 查詢區間"""
+
+    __slots__ = ('times', 'entries')
+
+    def __init__(self):
+        self.times = []
+        self.entries = []
+
+    def insert(self, when, entry):
+        position = bisect.bisect_right(self.times, when)
+        self.times.insert(position, when)
+        self.entries.insert(position, entry)
+
+    def between(self, start, end):
+        low = bisect.bisect_left(self.times, start)
+        high = bisect.bisect_right(self.times, end)
+        return self.entries[low:high]
+
+    def expire(self, before):
+        count = bisect.bisect_left(self.times, before)
+        if count:
+            del self.times[:count]
+            del self.entries[:count]
+        return count
+
+
+class FederationJoin:
+    """
+    以聯合使用者 ARN 為鍵、時間為序的對稱 join：
+    GetFederationToken 到達時查詢 [發行, 到期] 內已到達的登入，登入到達時查詢發行時間在
+    [登入 - 最長有效期, 登入] 內的權杖，兩邊都以 bisect 取區間，不需要巢狀迴圈。
+    事件可任意亂序；watermark 之前超過最長有效期的記錄會被清除，記憶體只與未到期的權杖有關。
+    """
+
+    def __init__(self, max_duration=MAX_DURATION):
+        self.max_duration = max_duration
+        self.tokens = collections.defaultdict(_Side)
+        self.logins = collections.defaultdict(_Side)
+        self.watermark = None
+
+    def add_token(self, token):
+        self.tokens[token.arn].insert(token.issued, token)
+        if token.arn not in self.logins:
+            return []
+        return [Pivot(token.arn, token, login, login.time - token.issued)
+                for login in self.logins[token.arn].between(token.issued, token.expires)]
+
+    def add_login(self, login):
+        self.logins[login.arn].insert(login.time, login)
+        if login.arn not in self.tokens:
+            return []
+        return [Pivot(login.arn, token, login, login.time - token.issued)
+                for token in self.tokens[login.arn].between(login.time - self.max_duration, login.time)
+                if token.expires >= login.time]
+
+    def add_event(self, event):
+        """加入一筆以 JOIN_FIELDS 投影的 detection.reader Event，回傳新配對的 Pivot"""
+        if event.errorCode or event.eventTime is None:
+            return []
+        if event.eventName == 'GetFederationToken' and event.eventSource == STS:
+            arn = event.responseElements_federatedUser_arn
+            if not arn and event.requestParameters_name:
+                arn = federated_user_arn(event.recipientAccountId, event.requestParameters_name)
+            if not arn:
+                return []
+            duration = int(event.requestParameters_durationSeconds or DEFAULT_DURATION)
+            return self.add_token(Token(arn, event.eventTime, event.eventTime + duration,
+                                        event.responseElements_credentials_accessKeyId, event.userIdentity_arn,
+                                        event.sourceIPAddress))
+        if event.eventSource == SIGNIN and event.eventName in ('ConsoleLogin', 'GetSigninToken'):
+            arn = event.userIdentity_arn
+            if not arn or ':federated-user/' not in arn:
+                return []
+            return self.add_login(Login(arn, event.eventTime, event.eventName, event.userIdentity_accessKeyId,
+                                        event.sourceIPAddress, event.responseElements_ConsoleLogin))
+        return []
+
+    def advance(self, watermark):
+        """事件時間已推進到 watermark：清除不可能再配對的權杖與登入"""
+        self.watermark = watermark
+        horizon = watermark - self.max_duration
+        for sides in (self.tokens, self.logins):
+            for arn in list(sides):
+                side = sides[arn]
+                side.expire(horizon)
+                if not side.times:
+                    del sides[arn]
+
+    def __len__(self):
+        return sum(len(side.times) for side in self.tokens.values()) + \
+            sum(len(side.times) for side in self.logins.values())
+
+
+def find_pivots(root, join=None, **read_options):
+    """
+    產生 CloudTrail 日誌中「GetFederationToken → 主控台登入」的所有配對。
+    事件依事件時間讀取（read_events_in_order，亂序不超過 ORDER_LATENESS），
+    watermark 取目前最大事件時間 - ORDER_LATENESS，定期清除不可能再配對的記錄
+    """
+    join = FederationJoin() if join is None else join
+    latest = None
+    advanced = None
+    for event in read_events_in_order(root, JOIN_FIELDS, event_names=JOIN_EVENTS, **read_options):
+        yield from join.add_event(event)
+        if latest is None or event.eventTime > latest:
+            latest = event.eventTime
+        if advanced is None or latest - advanced >= ADVANCE_INTERVAL:
+            join.advance(latest - ORDER_LATENESS)
+            advanced = latest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Join GetFederationToken to console sign-ins of the same federated user.")
+    parser.add_argument('root', help="directory containing AWSLogs/ (or any level below it)")
+    parser.add_argument('--regions', nargs='+')
+    parser.add_argument('--start-date', type=parse_date)
+    parser.add_argument('--end-date', type=parse_date)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    count = 0
+    for pivot in find_pivots(args.root, regions=args.regions, start_date=args.start_date, end_date=args.end_date):
+        count += 1
+        print(f"{pivot.arn}: token from {pivot.token.issuer} ({pivot.token.source_ip}), "
+              f"{pivot.login.event_name} from {pivot.login.source_ip} {pivot.delay:.0f}s later")
+    print(f"{count} federation pivots found in {time.perf_counter() - start:.2f}s.")
+
+
+if __name__ == "__main__":
+    main()
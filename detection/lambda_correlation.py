@@ -0,0 +1,219 @@
+import argparse
+import bisect
+import collections
+import time
+
+from detection.reader import parse_date, read_events
+
+LAMBDA = 'lambda.amazonaws.com'
+IAM = 'iam.amazonaws.com'
+STS = 'sts.amazonaws.com'
+
+# 需要歸因的 IAM 寫入操作
+IAM_WRITE_EVENTS = ('CreateUser', 'CreateAccessKey', 'AttachUserPolicy', 'PutUserPolicy', 'CreateLoginProfile',
+                    'UpdateLoginProfile', 'AddUserToGroup', 'CreateRole', 'AttachRolePolicy', 'PutRolePolicy',
+                    'UpdateAssumeRolePolicy', 'AttachGroupPolicy', 'PutGroupPolicy', 'CreatePolicyVersion',
+                    'DeleteAccessKey', 'DeleteUser')
+
+LAMBDA_EVENTS = ('CreateFunction20150331', 'Invoke', 'AssumeRole')
+
+CORRELATION_FIELDS = (
+    'eventTime',
+    'eventName',
+    'eventSource',
+    'awsRegion',
+    'errorCode',
+    'requestID',
+    'userAgent',
+    'userIdentity.arn',
+    'userIdentity.accessKeyId',
+    'userIdentity.invokedBy',
+    'requestParameters.functionName',
+    'requestParameters.role',
+    'requestParameters.roleArn',
+    'requestParameters.roleSessionName',
+    'requestParameters.userName',
+    'requestParameters.roleName',
+    'requestParameters.policyArn',
+    'responseElements.functionArn',
+    'responseElements.credentials.accessKeyId',
+    'responseElements.accessKey.accessKeyId'
+)
+
+# Lambda 執行時間上限；以呼叫者金鑰歸因時只看這段時間內的 Invoke
+MAX_FUNCTION_SECONDS = 900
+
+# Lambda 執行環境的 User-Agent 含有此字串
+LAMBDA_USER_AGENT = 'AWS_Lambda'
+
+Function = collections.namedtuple('Function', ['name', 'arn', 'region', 'role_arn', 'created_at', 'creator'])
+# from_lambda：User-Agent 顯示呼叫來自 Lambda 執行環境
+IamWrite = collections.namedtuple('IamWrite', ['time', 'event_name', 'principal', 'access_key_id', 'target',
+                                               'policy_arn', 'created_key', 'request_id', 'from_lambda'])
+Attribution = collections.namedtuple('Attribution', ['function', 'write', 'via'])
+
+
+def function_name(value):
+    """函數名稱或 ARN（arn:aws:lambda:region:acct:function:name[:qualifier]）轉為名稱"""
+    if value and ':function:' in value:
+        return value.split(':function:', 1)[1].split(':', 1)[0]
+    return value
+
+
+def role_session(arn):
+    """assumed-role ARN 轉為 (角色名稱, 工作階段名稱)；Lambda 的工作階段名稱即函數名稱"""
+    if not arn or ':assumed-role/' not in arn:
+        return None, None
+    parts = arn.split(':assumed-role/', 1)[1].split('/')
+    return parts[0], parts[1] if len(parts) > 1 else None
+
+
+def role_name(arn):
+    return arn.rsplit('/', 1)[-1] if arn else None
+
+
+class LambdaCorrelation:
+    """
+    將 IAM 寫入歸因到執行它的 Lambda 函數。預先建立三種索引：
+    工作階段（assumed-role/<執行角色>/<函數名稱> 與 Lambda AssumeRole 發出的臨時金鑰）、
+    執行角色 → 函數、呼叫者金鑰 → 依時間排序的 Invoke（函數以傳入的金鑰呼叫 IAM 時使用）。
+    build() 後以被建立的實體（user:<名稱>、role:<名稱>、存取金鑰 ID）直接查詢歸因結果。
+    """
+
+    def __init__(self):
+        self.functions = {}
+        self.role_functions = collections.defaultdict(set)
+        self.session_keys = {}
+        self.invocations = collections.defaultdict(lambda: ([], []))
+        self.writes = []
+        self.attributions = {}
+        self.function_writes = collections.defaultdict(list)
+
+    def add_event(self, event):
+        """加入一筆以 CORRELATION_FIELDS 投影的 detection.reader Event；歸因在 build() 時進行"""
+        if event.errorCode or event.eventTime is None:
+            return
+        name = event.eventName
+        if event.eventSource == LAMBDA and name == 'CreateFunction20150331':
+            function = function_name(event.requestParameters_functionName)
+            if function:
+                self.functions[function] = Function(function, event.responseElements_functionArn, event.awsRegion,
+                                                    event.requestParameters_role, event.eventTime,
+                                                    event.userIdentity_arn)
+                if event.requestParameters_role:
+                    self.role_functions[role_name(event.requestParameters_role)].add(function)
+        elif event.eventSource == LAMBDA and name == 'Invoke':
+            function = function_name(event.requestParameters_functionName)
+            if function and event.userIdentity_accessKeyId:
+                times, functions = self.invocations[event.userIdentity_accessKeyId]
+                position = bisect.bisect_right(times, event.eventTime)
+                times.insert(position, event.eventTime)
+                functions.insert(position, function)
+        elif event.eventSource == STS and name == 'AssumeRole':
+            # Lambda 服務承擔執行角色，工作階段名稱為函數名稱
+            if event.userIdentity_invokedBy == LAMBDA and event.responseElements_credentials_accessKeyId:
+                self.session_keys[event.responseElements_credentials_accessKeyId] = (
+                    role_name(event.requestParameters_roleArn), event.requestParameters_roleSessionName)
+        elif event.eventSource == IAM and name in IAM_WRITE_EVENTS:
+            if name in ('CreateRole', 'AttachRolePolicy', 'PutRolePolicy', 'UpdateAssumeRolePolicy'):
+                target = f"role:{event.requestParameters_roleName}"
+            else:
+                target = f"user:{event.requestParameters_userName}" if event.requestParameters_userName else None
+            self.writes.append(IamWrite(event.eventTime, name, event.userIdentity_arn, event.userIdentity_accessKeyId,
+                                        target, event.requestParameters_policyArn,
+                                        event.responseElements_accessKey_accessKeyId, event.requestID,
+                                        LAMBDA_USER_AGENT in (event.userAgent or '')))
+
+    def update(self, events):
+        for event in events:
+            self.add_event(event)
+        return self
+
+    def _function_for(self, write):
+        # 1. 以執行角色的工作階段呼叫
+        role, session = role_session(write.principal)
+        if role and role in self.role_functions:
+            if session in self.role_functions[role]:
+                return session, 'role-session'
+            if len(self.role_functions[role]) == 1:
+                return next(iter(self.role_functions[role])), 'execution-role'
+        # 2. 以 Lambda 承擔角色取得的臨時金鑰呼叫
+        if write.access_key_id in self.session_keys:
+            role, session = self.session_keys[write.access_key_id]
+            if session in self.functions or role in self.role_functions:
+                return session, 'session-key'
+        # 3. 函數以傳入的金鑰呼叫（aksk-loop 的做法）：取同一金鑰在呼叫前最近一次的 Invoke
+        if write.from_lambda and write.access_key_id in self.invocations:
+            times, functions = self.invocations[write.access_key_id]
+            position = bisect.bisect_right(times, write.time) - 1
+            if position >= 0 and write.time - times[position] <= MAX_FUNCTION_SECONDS:
+                return functions[position], 'invoker-key'
+        return None, None
+
+    def build(self):
+        """所有事件加入後建立歸因索引"""
+        self.attributions.clear()
+        self.function_writes.clear()
+        # 事件依行程池完成順序到達，先依時間排序
+        self.writes.sort(key=lambda write: write.time)
+        for write in self.writes:
+            function, via = self._function_for(write)
+            if function is None:
+                continue
+            attribution = Attribution(function, write, via)
+            self.function_writes[function].append(attribution)
+            for entity in (write.target, write.created_key):
+                # 保留最早的歸因（建立實體的那次呼叫）
+                if entity and entity not in self.attributions:
+                    self.attributions[entity] = attribution
+        return self
+
+    def which_function(self, entity):
+        """
+        哪個函數建立（或修改）了 entity：user:<名稱>、role:<名稱> 或存取金鑰 ID；
+        不是由 Lambda 建立的回傳 None
+        """
+        return self.attributions.get(entity)
+
+    def writes_by(self, function):
+        return self.function_writes.get(function, [])
+
+
+def correlate(root, **read_options):
+    """讀取 CloudTrail 日誌並建立歸因索引；read_options 傳給 detection.reader.read_events"""
+    correlation = LambdaCorrelation()
+    events = read_events(root, CORRELATION_FIELDS, event_names=LAMBDA_EVENTS + IAM_WRITE_EVENTS, **read_options)
+    return correlation.update(events).build()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Attribute IAM writes to the Lambda functions that made them.")
+    parser.add_argument('root', help="directory containing AWSLogs/ (or any level below it)")
+    parser.add_argument('entities', nargs='*', help="user:<name>, role:<name> or access key IDs to look up")
+    parser.add_argument('--regions', nargs='+')
+    parser.add_argument('--start-date', type=parse_date)
+    parser.add_argument('--end-date', type=parse_date)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    correlation = correlate(args.root, regions=args.regions, start_date=args.start_date, end_date=args.end_date)
+    print(f"Indexed {len(correlation.functions)} functions and {len(correlation.writes)} IAM writes "
+          f"in {time.perf_counter() - start:.2f}s.")
+    if args.entities:
+        for entity in args.entities:
+            attribution = correlation.which_function(entity)
+            if attribution is None:
+                print(f"{entity}: not created from a Lambda function")
+            else:
+                print(f"{entity}: {attribution.function} ({attribution.write.event_name} via {attribution.via})")
+        return
+    for function in sorted(correlation.function_writes):
+        writes = correlation.writes_by(function)
+        print(f"{function}: {len(writes)} IAM writes")
+        for attribution in writes:
+            write = attribution.write
+            print(f"    {write.event_name} {write.target or ''} {write.policy_arn or ''}".rstrip())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+import argparse
+import collections
+import json
+import urllib.parse
+
+from common.clients import get_client, get_session
+from common.iam_snapshot import load_iam_snapshot
+from detection.reader import parse_date, read_events
+
+ADMIN_POLICY_ARN = 'arn:aws:iam::aws:policy/AdministratorAccess'
+
+# ec2-backdoor-by-assume-role.py 的預設區域
+DEFAULT_REGIONS = ['us-east-2']
+
+# 仍持有執行個體角色憑證的狀態
+ACTIVE_STATES = {'pending', 'running', 'stopping', 'stopped'}
+RUNNING_STATES = {'pending', 'running'}
+
+GRAPH_EVENTS = ('DeleteRole', 'AttachRolePolicy', 'DetachRolePolicy', 'PutRolePolicy', 'DeleteRolePolicy',
+                'CreatePolicyVersion', 'DeleteInstanceProfile', 'AddRoleToInstanceProfile', 'RemoveRoleFromInstanceProfile',
+                'RunInstances', 'TerminateInstances', 'StopInstances', 'StartInstances',
+                'AssociateIamInstanceProfile', 'ReplaceIamInstanceProfileAssociation',
+                'DisassociateIamInstanceProfile')
+
+GRAPH_FIELDS = ('eventTime', 'eventName', 'eventSource', 'awsRegion', 'errorCode', 'requestParameters',
+                'responseElements')
+
+Instance = collections.namedtuple('Instance', ['instance_id', 'region', 'state', 'profile'])
+
+
+def name_from_arn(arn):
+    return arn.rsplit('/', 1)[-1] if arn else None
+
+
+def policy_document(document):
+    """政策文件可能是 dict、JSON 字串或 URL 編碼的 JSON 字串"""
+    if isinstance(document, str):
+        if not document.lstrip().startswith('{'):
+            document = urllib.parse.unquote(document)
+        document = json.loads(document)
+    return document or {}
+
+
+def grants_admin(document):
+    """是否有 Allow "*" on "*" 的敘述（等同 AdministratorAccess）"""
+    statements = policy_document(document).get('Statement', [])
+    if isinstance(statements, dict):
+        statements = [statements]
+    for statement in statements:
+        if statement.get('Effect') != 'Allow' or 'Condition' in statement:
+            continue
+        actions = statement.get('Action', [])
+        resources = statement.get('Resource', [])
+        actions = [actions] if isinstance(actions, str) else actions
+        resources = [resources] if isinstance(resources, str) else resources
+        if '*' in actions and '*' in resources:
+            return True
+    return False
+
+
+class PrivilegeGraph:
+    """
+    角色、Instance Profile 與執行個體之間的權限圖，以集合與字典索引：
+    admin_policies（等同管理員的受管政策）、policy_roles（政策 → 附加的角色）、role_inline_admin、
+    profile_roles / role_profiles、profile_instances。
+    「哪些執行中的執行個體持有管理員角色」只需走訪管理員角色的 profile 與其執行個體。
+    以 CloudTrail 的變更事件增量更新，不需重新抓取快照。
+    """
+
+    def __init__(self):
+        self.admin_policies = {ADMIN_POLICY_ARN}
+        self.policy_roles = collections.defaultdict(set)
+        # 角色的內嵌政策中等同管理員者
+        self.role_inline_admin = collections.defaultdict(set)
+        self.profile_roles = collections.defaultdict(set)
+        self.role_profiles = collections.defaultdict(set)
+        self.instances = {}
+        self.profile_instances = collections.defaultdict(set)
+        self.applied_until = None
+
+    @classmethod
+    def from_snapshot(cls, snapshot, instances=()):
+        graph = cls()
+        for arn, policy in snapshot.policies.items():
+            for version in policy.get('PolicyVersionList', []):
+                if version.get('IsDefaultVersion') and grants_admin(version.get('Document')):
+                    graph.admin_policies.add(arn)
+        for role_name, role in snapshot.roles.items():
+            for policy_arn in snapshot.attached_policy_arns(role):
+                graph.policy_roles[policy_arn].add(role_name)
+            for policy in role.get('RolePolicyList', []):
+                if grants_admin(policy.get('PolicyDocument')):
+                    graph.role_inline_admin[role_name].add(policy['PolicyName'])
+            for profile_name in snapshot.role_instance_profile_names(role):
+                graph.link_profile(profile_name, role_name)
+        for instance in instances:
+            graph.set_instance(instance)
+        graph.applied_until = snapshot.fetched_at
+        return graph
+
+    def link_profile(self, profile_name, role_name):
+        self.profile_roles[profile_name].add(role_name)
+        self.role_profiles[role_name].add(profile_name)
+
+    def unlink_profile(self, profile_name, role_name):
+        self.profile_roles[profile_name].discard(role_name)
+        self.role_profiles[role_name].discard(profile_name)
+
+    def set_instance(self, instance):
+        previous = self.instances.get(instance.instance_id)
+        if previous is not None and previous.profile:
+            self.profile_instances[previous.profile].discard(instance.instance_id)
+        self.instances[instance.instance_id] = instance
+        if instance.profile:
+            self.profile_instances[instance.profile].add(instance.instance_id)
+
+    def admin_roles(self):
+        roles = set()
+        for policy_arn in self.admin_policies:
+            roles |= self.policy_roles.get(policy_arn, set())
+        return roles | {role for role, policies in self.role_inline_admin.items() if policies}
+
+    def is_admin_role(self, role_name):
+        return bool(self.role_inline_admin.get(role_name)) or \
+            any(role_name in self.policy_roles.get(policy_arn, ()) for policy_arn in self.admin_policies)
+
+    def admin_instances(self, states=RUNNING_STATES):
+        """持有等同管理員角色的執行個體"""
+        result = []
+        for role in self.admin_roles():
+            for profile in self.role_profiles.get(role, ()):
+                for instance_id in self.profile_instances.get(profile, ()):
+                    instance = self.instances[instance_id]
+                    if instance.state in states:
+                        result.append((instance, profile, role))
+        return result
+
+    def instance_roles(self, instance_id):
+        instance = self.instances.get(instance_id)
+        if instance is None or not instance.profile:
+            return set()
+        return set(self.profile_roles.get(instance.profile, ()))
+
+    def _set_state(self, instance_ids, state):
+        for instance_id in instance_ids:
+            instance = self.instances.get(instance_id)
+            if instance is not None:
+                self.set_instance(instance._replace(state=state))
+
+    def apply(self, event):
+        """套用一筆以 GRAPH_FIELDS 投影的 CloudTrail 變更事件"""
+        if event.errorCode:
+            return
+        name = event.eventName
+        parameters = json.loads(event.requestParameters) if event.requestParameters else {}
+        response = json.loads(event.responseElements) if event.responseElements else {}
+        role = parameters.get('roleName')
+        profile = parameters.get('instanceProfileName')
+
+        if name in ('AttachRolePolicy', 'DetachRolePolicy'):
+            roles = self.policy_roles[parameters.get('policyArn')]
+            (roles.add if name == 'AttachRolePolicy' else roles.discard)(role)
+        elif name == 'PutRolePolicy':
+            if grants_admin(parameters.get('policyDocument')):
+                self.role_inline_admin[role].add(parameters.get('policyName'))
+            else:
+                self.role_inline_admin[role].discard(parameters.get('policyName'))
+        elif name == 'DeleteRolePolicy':
+            self.role_inline_admin[role].discard(parameters.get('policyName'))
+        elif name == 'DeleteRole':
+            for roles in self.policy_roles.values():
+                roles.discard(role)
+            self.role_inline_admin.pop(role, None)
+            for profile_name in self.role_profiles.pop(role, set()):
+                self.profile_roles[profile_name].discard(role)
+        elif name == 'CreatePolicyVersion' and parameters.get('setAsDefault'):
+            policy_arn = parameters.get('policyArn')
+            if grants_admin(parameters.get('policyDocument')):
+                self.admin_policies.add(policy_arn)
+            elif policy_arn != ADMIN_POLICY_ARN:
+                self.admin_policies.discard(policy_arn)
+        elif name == 'AddRoleToInstanceProfile':
+            self.link_profile(profile, role)
+        elif name == 'RemoveRoleFromInstanceProfile':
+            self.unlink_profile(profile, role)
+        elif name == 'DeleteInstanceProfile':
+            for role_name in self.profile_roles.pop(profile, set()):
+                self.role_profiles[role_name].discard(profile)
+        elif name == 'RunInstances':
+            for item in response.get('instancesSet', {}).get('items', []):
+                profile_arn = (item.get('iamInstanceProfile') or {}).get('arn')
+                state = (item.get('instanceState') or {}).get('name', 'pending')
+                self.set_instance(Instance(item['instanceId'], event.awsRegion, state, name_from_arn(profile_arn)))
+        elif name in ('TerminateInstances', 'StopInstances', 'StartInstances'):
+            state = {'TerminateInstances': 'terminated', 'StopInstances': 'stopped',
+                     'StartInstances': 'running'}[name]
+            items = parameters.get('instancesSet', {}).get('items', [])
+            self._set_state([item.get('instanceId') for item in items], state)
+        elif name in ('AssociateIamInstanceProfile', 'ReplaceIamInstanceProfileAssociation',
+                      'DisassociateIamInstanceProfile'):
+            association = response.get('AssociateIamInstanceProfileResponse', response)
+            association = association.get('iamInstanceProfileAssociation') or {}
+            instance_id = parameters.get('instanceId') or association.get('instanceId')
+            instance = self.instances.get(instance_id)
+            if instance is None:
+                instance = Instance(instance_id, event.awsRegion, 'running', None)
+            if name == 'DisassociateIamInstanceProfile':
+                profile_name = None
+            else:
+                requested = parameters.get('iamInstanceProfile') or {}
+                profile_name = requested.get('name') or name_from_arn(
+                    requested.get('arn') or (association.get('iamInstanceProfile') or {}).get('arn'))
+            self.set_instance(instance._replace(profile=profile_name))
+
+    def update(self, events):
+        """
+        依時間順序套用快照之後的事件；reader 依行程池完成順序產生事件，
+        變更事件數量不多，先收集再排序
+        """
+        changes = sorted((event for event in events
+                          if self.applied_until is None or (event.eventTime or 0) > self.applied_until),
+                         key=lambda event: event.eventTime or 0)
+        for event in changes:
+            self.apply(event)
+            self.applied_until = event.eventTime
+        return len(changes)
+
+
+def fetch_instances(session, regions):
+    """分頁讀取各區域仍存在的執行個體與其 Instance Profile"""
+    instances = []
+    for region in regions:
+        ec2_client = get_client('ec2', region_name=region, session=session, governed=True)
+        paginator = ec2_client.get_paginator('describe_instances')
+        filters = [{'Name': 'instance-state-name', 'Values': sorted(ACTIVE_STATES)}]
+        for page in paginator.paginate(Filters=filters):
+            for reservation in page['Reservations']:
+                for item in reservation['Instances']:
+                    profile_arn = (item.get('IamInstanceProfile') or {}).get('Arn')
+                    instances.append(Instance(item['InstanceId'], region, item['State']['Name'],
+                                              name_from_arn(profile_arn)))
+    return instances
+
+
+def build_privilege_graph(session, regions=DEFAULT_REGIONS, refresh=False):
+    iam_client = get_client('iam', session=session, governed=True)
+    snapshot = load_iam_snapshot(iam_client, filters=('Role', 'LocalManagedPolicy'), refresh=refresh)
+    return PrivilegeGraph.from_snapshot(snapshot, fetch_instances(session, regions))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List instances that hold an admin-equivalent role.")
+    parser.add_argument('--profile', default='harry-redteam')
+    parser.add_argument('--regions', nargs='+', default=DEFAULT_REGIONS)
+    parser.add_argument('--refresh', action='store_true', help="ignore the cached IAM snapshot")
+    parser.add_argument('--cloudtrail', help="apply changes after the snapshot from this CloudTrail export")
+    parser.add_argument('--start-date', type=parse_date)
+    args = parser.parse_args()
+
+    session = get_session(profile_name=args.profile)
+    graph = build_privilege_graph(session, args.regions, args.refresh)
+    if args.cloudtrail:
+        events = read_events(args.cloudtrail, GRAPH_FIELDS, event_names=GRAPH_EVENTS, start_date=args.start_date)
+        print(f"Applied {graph.update(events)} CloudTrail changes after the snapshot.")
+
+    found = graph.admin_instances()
+    for instance, profile, role in sorted(found):
+        print(f"{instance.instance_id} ({instance.region}, {instance.state}): profile {profile} -> role {role}")
+    print(f"{len(found)} running instances hold an admin-equivalent role.")
+
+
+if __name__ == "__main__":
+    main()
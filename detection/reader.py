@@ -0,0 +1,348 @@
+import argparse
+import collections
+import concurrent.futures
+import datetime
+import gzip
+import heapq
+import itertools
+import json
+import os
+import re
+import time
+
+# 預設投影的欄位；以 "." 表示巢狀欄位，namedtuple 欄位名稱以 "_" 取代 "."
+DEFAULT_FIELDS = (
+    'eventTime',
+    'eventSource',
+    'eventName',
+    'awsRegion',
+    'userIdentity.type',
+    'userIdentity.arn',
+    'userIdentity.accessKeyId',
+    'sourceIPAddress',
+    'userAgent',
+    'errorCode',
+    'requestID',
+    'eventID'
+)
+
+# 轉換型別的欄位：eventTime 轉為 epoch 秒
+TIME_FIELDS = {'eventTime'}
+
+# <acct>_CloudTrail_<region>_<YYYYMMDDTHHmmZ>_<unique>.json.gz
+LOG_FILE_PATTERN = re.compile(r'_CloudTrail_([a-z0-9-]+)_(\d{8}T\d{4}Z)_[^/]*\.json(\.gz)?$')
+
+READ_CHUNK_SIZE = 1 << 20
+# 每個工作單元合併的檔案大小上限（壓縮後），小檔案合併以減少行程間往返
+BATCH_BYTES = 4 << 20
+BATCH_FILES = 8
+
+# 依事件時間排序時，日界附近的事件可能在下一天的目錄（依送達時間存放），保留到下一天再輸出
+ORDER_LATENESS = 3600
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r'[\s,]*')
+_event_types = {}
+
+
+def event_type(fields):
+    """依投影欄位建立（並快取）namedtuple 型別；deliveryTime 為檔案送達時間"""
+    fields = tuple(fields)
+    if fields not in _event_types:
+        names = [field.replace('.', '_') for field in fields] + ['deliveryTime']
+        _event_types[fields] = collections.namedtuple('Event', names)
+    return _event_types[fields]
+
+
+def parse_event_time(value):
+    # '2024-05-01T12:34:56Z'；fromisoformat 比 strptime 快一個數量級
+    if not value:
+        return None
+    return datetime.datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+
+def delivery_time(path):
+    match = LOG_FILE_PATTERN.search(os.path.basename(path))
+    if not match:
+        return None
+    return datetime.datetime.strptime(match.group(2), '%Y%m%dT%H%MZ').replace(
+        tzinfo=datetime.timezone.utc).timestamp()
+
+
+def _date_dirs(region_dir, start_date, end_date):
+    """依 YYYY/MM/DD 目錄剪枝，不進入範圍外的年份、月份與日期"""
+    for year in sorted(os.listdir(region_dir)):
+        if not year.isdigit():
+            continue
+        if (start_date and int(year) < start_date.year) or (end_date and int(year) > end_date.year):
+            continue
+        year_dir = os.path.join(region_dir, year)
+        for month in sorted(os.listdir(year_dir)):
+            if not month.isdigit():
+                continue
+            month_key = (int(year), int(month))
+            if ((start_date and month_key < (start_date.year, start_date.month))
+                    or (end_date and month_key > (end_date.year, end_date.month))):
+                continue
+            month_dir = os.path.join(year_dir, month)
+            for day in sorted(os.listdir(month_dir)):
+                if not day.isdigit():
+                    continue
+                date = datetime.date(int(year), int(month), int(day))
+                if (start_date and date < start_date) or (end_date and date > end_date):
+                    continue
+                yield os.path.join(month_dir, day)
+
+
+def _cloudtrail_dirs(root):
+    """
+    找出 AWSLogs/<acct>/CloudTrail 目錄；組織追蹤為 AWSLogs/<org-id>/<acct>/CloudTrail。
+    root 可以是 AWSLogs 的上層、AWSLogs 本身或單一帳號目錄
+    """
+    if os.path.isdir(os.path.join(root, 'AWSLogs')):
+        root = os.path.join(root, 'AWSLogs')
+    if os.path.basename(os.path.normpath(root)) == 'CloudTrail':
+        yield root
+        return
+    if os.path.isdir(os.path.join(root, 'CloudTrail')):
+        yield os.path.join(root, 'CloudTrail')
+        return
+    for name in sorted(os.listdir(root)):
+        path = os.path.join(root, name)
+        if os.path.isdir(os.path.join(path, 'CloudTrail')):
+            yield os.path.join(path, 'CloudTrail')
+        elif os.path.isdir(path):
+            for account in sorted(os.listdir(path)):
+                if os.path.isdir(os.path.join(path, account, 'CloudTrail')):
+                    yield os.path.join(path, account, 'CloudTrail')
+
+
+def iter_log_files(root, regions=None, start_date=None, end_date=None):
+    """依 CloudTrail 目錄結構列出日誌檔，區域與日期範圍在目錄層級即剪枝"""
+    if os.path.isfile(root):
+        yield root
+        return
+    regions = set(regions) if regions else None
+    for cloudtrail_dir in _cloudtrail_dirs(root):
+        for region in sorted(os.listdir(cloudtrail_dir)):
+            if regions and region not in regions:
+                continue
+            region_dir = os.path.join(cloudtrail_dir, region)
+            if not os.path.isdir(region_dir):
+                continue
+            for day_dir in _date_dirs(region_dir, start_date, end_date):
+                for entry in sorted(os.scandir(day_dir), key=lambda e: e.name):
+                    if entry.is_file() and (entry.name.endswith('.json.gz') or entry.name.endswith('.json')):
+                        yield entry.path
+
+
+def iter_log_dates(root, regions=None, start_date=None, end_date=None):
+    """日誌目錄中出現的日期（遞增），只列出目錄，不開啟檔案"""
+    regions = set(regions) if regions else None
+    dates = set()
+    for cloudtrail_dir in _cloudtrail_dirs(root):
+        for region in os.listdir(cloudtrail_dir):
+            region_dir = os.path.join(cloudtrail_dir, region)
+            if (regions and region not in regions) or not os.path.isdir(region_dir):
+                continue
+            for day_dir in _date_dirs(region_dir, start_date, end_date):
+                year, month, day = day_dir.split(os.sep)[-3:]
+                dates.add(datetime.date(int(year), int(month), int(day)))
+    return sorted(dates)
+
+
+def iter_records(path):
+    """
+    逐筆解析 {"Records": [...]}，不將整個檔案載入記憶體：
+    解壓後以固定大小讀取，對緩衝區反覆 raw_decode 單筆記錄
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as file:
+        buffer = ''
+        position = 0
+        # 找到 "Records" 陣列的開頭
+        while True:
+            chunk = file.read(READ_CHUNK_SIZE)
+            if not chunk:
+                return
+            buffer += chunk
+            match = re.search(r'"Records"\s*:\s*\[', buffer)
+            if match:
+                position = match.end()
+                break
+            # 保留結尾，避免 "Records" 被切斷
+            buffer = buffer[-32:]
+
+        eof = False
+        while True:
+            position = _whitespace.match(buffer, position).end()
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            try:
+                record, end = _decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # 緩衝區內的記錄不完整，丟棄已處理部分後再讀一段
+                buffer = buffer[position:]
+                position = 0
+                chunk = file.read(READ_CHUNK_SIZE)
+                eof = not chunk
+                buffer += chunk
+                continue
+            yield record
+            position = end
+            if position > READ_CHUNK_SIZE:
+                buffer = buffer[position:]
+                position = 0
+
+
+def _getter(field):
+    if field in TIME_FIELDS:
+        return lambda record: parse_event_time(record.get(field))
+    parts = field.split('.')
+
+    def get(record):
+        value = record
+        for part in parts:
+            if not isinstance(value, dict):
+                return None
+            value = value.get(part)
+        # 巢狀物件（例如 requestParameters）以 JSON 字串保留，維持欄位為純量
+        if isinstance(value, (dict, list)):
+            return json.dumps(value, separators=(',', ':'), sort_keys=True)
+        return value
+
+    return get
+
+
+def projector(fields):
+    """回傳將原始記錄投影成 tuple 的函數（不含 deliveryTime）"""
+    getters = [_getter(field) for field in fields]
+    return lambda record: tuple(getter(record) for getter in getters)
+
+
+def parse_log_files(paths, fields, event_names=None, event_sources=None):
+    """
+    工作行程執行的單元：解析一批檔案，只回傳投影後的 tuple（傳回主行程的資料量最小）。
+    event_names / event_sources 在工作行程內先行篩選
+    """
+    project = projector(fields)
+    event_names = set(event_names) if event_names else None
+    event_sources = set(event_sources) if event_sources else None
+    rows = []
+    for path in paths:
+        delivered = delivery_time(path)
+        for record in iter_records(path):
+            if event_names and record.get('eventName') not in event_names:
+                continue
+            if event_sources and record.get('eventSource') not in event_sources:
+                continue
+            rows.append(project(record) + (delivered,))
+    return rows
+
+
+def _batches(paths):
+    batch, batch_bytes = [], 0
+    for path in paths:
+        batch.append(path)
+        batch_bytes += os.path.getsize(path)
+        if batch_bytes >= BATCH_BYTES or len(batch) >= BATCH_FILES:
+            yield batch
+            batch, batch_bytes = [], 0
+    if batch:
+        yield batch
+
+
+def read_events(root, fields=DEFAULT_FIELDS, regions=None, start_date=None, end_date=None,
+                event_names=None, event_sources=None, max_workers=None, window=None):
+    """
+    以行程池平行解析 CloudTrail 日誌，依完成順序逐筆產生 Event（namedtuple）。
+    同時進行中的工作單元不超過 window 個（預設為行程數的兩倍），記憶體用量與日誌總量無關。
+    """
+    fields = tuple(fields)
+    Event = event_type(fields)
+    max_workers = max_workers or os.cpu_count() or 1
+    window = window or max_workers * 2
+    batches = _batches(iter_log_files(root, regions, start_date, end_date))
+
+    if max_workers == 1:
+        for batch in batches:
+            for row in parse_log_files(batch, fields, event_names, event_sources):
+                yield Event._make(row)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        for batch in batches:
+            pending.add(executor.submit(parse_log_files, batch, fields, event_names, event_sources))
+            if len(pending) < window:
+                continue
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                for row in future.result():
+                    yield Event._make(row)
+        for future in concurrent.futures.as_completed(pending):
+            for row in future.result():
+                yield Event._make(row)
+
+
+def read_events_in_order(root, fields=DEFAULT_FIELDS, regions=None, start_date=None, end_date=None,
+                         lateness=ORDER_LATENESS, **read_options):
+    """
+    依事件時間排序產生 Event。read_events 逐區域走完整個日期範圍，依事件時間維護視窗的偵測器
+    會把後面區域的事件全部視為過期；這裡逐日讀取所有區域，放入以事件時間排序的堆積，
+    事件時間早於「當天結束 - lateness」的事件才輸出，其餘留到下一天一起排序。
+    記憶體約為一天份（篩選後）的事件；沒有 eventTime 的事件略過
+    """
+    fields = tuple(fields)
+    time_index = fields.index('eventTime')
+    if os.path.isfile(root):
+        events = [event for event in read_events(root, fields, **read_options) if event[time_index] is not None]
+        yield from sorted(events, key=lambda event: event[time_index])
+        return
+    heap = []
+    sequence = itertools.count()
+    for day in iter_log_dates(root, regions, start_date, end_date):
+        for event in read_events(root, fields, regions, day, day, **read_options):
+            if event[time_index] is not None:
+                heapq.heappush(heap, (event[time_index], next(sequence), event))
+        next_day = datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time(),
+                                             datetime.timezone.utc)
+        watermark = next_day.timestamp() - lateness
+        while heap and heap[0][0] < watermark:
+            yield heapq.heappop(heap)[2]
+    while heap:
+        yield heapq.heappop(heap)[2]
+
+
+def parse_date(value):
+    return datetime.date.fromisoformat(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream events from a local CloudTrail log export.")
+    parser.add_argument('root', help="directory containing AWSLogs/ (or any level below it)")
+    parser.add_argument('--fields', nargs='+', default=list(DEFAULT_FIELDS))
+    parser.add_argument('--regions', nargs='+')
+    parser.add_argument('--start-date', type=parse_date)
+    parser.add_argument('--end-date', type=parse_date)
+    parser.add_argument('--event-names', nargs='+')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--count', action='store_true', help="only print the number of events and throughput")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    count = 0
+    for event in read_events(args.root, args.fields, args.regions, args.start_date, args.end_date,
+                             args.event_names, max_workers=args.workers):
+        count += 1
+        if not args.count:
+            print(json.dumps(event._asdict(), default=str))
+    elapsed = time.perf_counter() - start
+    if args.count:
+        print(f"{count} events in {elapsed:.2f}s ({count / elapsed if elapsed else 0:.0f} events/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+import argparse
+import collections
+import json
+import os
+import re
+import tempfile
+import time
+
+try:
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+except ImportError:
+    np = None
+
+from detection.reader import parse_date
+from detection.store import query
+
+ADMIN_POLICY_ARN = 'arn:aws:iam::aws:policy/AdministratorAccess'
+
+# 規則格式：
+#   events     先以 eventName 分割裁剪，只讀取這些事件
+#   where      {欄位: 值}；值為字串比對相等、None 比對空值、list / tuple / set 比對其中之一
+#   follows    Follows：同一個 key 在 within 秒內先發生過另一種事件（例如「附加政策前剛建立該使用者」）
+#   group_by   分組欄位；window 秒內的 aggregate（('count', None) 或 ('count_distinct', 欄位)）
+#              達到 threshold 時告警，window 為 None 時不限時間
+# 欄位為 store 的欄位（'userIdentity.arn'）或 requestParameters 內的路徑（'requestParameters.policyArn'）
+Rule = collections.namedtuple('Rule', ['name', 'events', 'where', 'follows', 'group_by', 'window', 'aggregate',
+                                       'threshold'],
+                              defaults=(None, None, ('userIdentity.arn',), None, ('count', None), 1))
+Follows = collections.namedtuple('Follows', ['events', 'key', 'other_key', 'within', 'where'], defaults=(None,))
+# first / last：達到門檻的第一個與最後一個事件時間；peak：期間內 aggregate 的最大值
+Alert = collections.namedtuple('Alert', ['rule', 'group', 'first', 'last', 'peak'])
+
+RULES = [
+    # aksk-loop.py、federation-token.py：新建立的使用者立即被附加 AdministratorAccess
+    Rule('admin-policy-on-new-user', ('AttachUserPolicy',),
+         where={'requestParameters.policyArn': ADMIN_POLICY_ARN, 'errorCode': None},
+         follows=Follows(('CreateUser',), 'requestParameters.userName', 'requestParameters.userName', 600),
+         group_by=('requestParameters.userName',)),
+    # ec2-backdoor-by-assume-role.py：新建立的角色被附加 AdministratorAccess
+    Rule('admin-policy-on-new-role', ('AttachRolePolicy',),
+         where={'requestParameters.policyArn': ADMIN_POLICY_ARN, 'errorCode': None},
+         follows=Follows(('CreateRole',), 'requestParameters.roleName', 'requestParameters.roleName', 600),
+         group_by=('requestParameters.roleName',)),
+    # 以剛建立的 Instance Profile 啟動執行個體
+    Rule('instance-with-new-profile', ('RunInstances',),
+         where={'errorCode': None},
+         follows=Follows(('CreateInstanceProfile',), 'requestParameters.iamInstanceProfile.name',
+                         'requestParameters.instanceProfileName', 3600),
+         group_by=('requestParameters.iamInstanceProfile.name',)),
+    # muti-get-secrets.py：10 分鐘內在 5 個以上區域讀取秘密（正常的應用程式很少跨這麼多區域）
+    Rule('secrets-multi-region', ('GetSecretValue',), where={'errorCode': None},
+         group_by=('userIdentity.arn',), window=600, aggregate=('count_distinct', 'awsRegion'), threshold=5),
+    # federation-token.py：剛建立的使用者取得聯合權杖
+    Rule('federation-token-from-new-user', ('GetFederationToken',), where={'errorCode': None},
+         follows=Follows(('CreateUser',), 'requestParameters.name', 'requestParameters.userName', 600),
+         group_by=('requestParameters.name',)),
+    # cred-2-link.py：聯合使用者登入主控台
+    Rule('federated-console-login', ('ConsoleLogin',),
+         where={'userIdentity.type': 'FederatedUser', 'errorCode': None})
+]
+
+# 各情境重播時應該觸發的規則
+SCENARIO_RULES = {
+    'ec2-backdoor-by-assume-role': ('admin-policy-on-new-role', 'instance-with-new-profile'),
+    'aksk-loop': ('admin-policy-on-new-user',),
+    'muti-get-secrets': ('secrets-multi-region',),
+    'federation-token': ('admin-policy-on-new-user', 'federation-token-from-new-user', 'federated-console-login')
+}
+
+REQUEST_PARAMETERS = 'requestParameters.'
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("detection.rules needs numpy and pyarrow: pip install numpy pyarrow")
+
+
+def _is_nested(field):
+    return field.startswith(REQUEST_PARAMETERS)
+
+
+def _store_column(field):
+    return 'requestParameters' if _is_nested(field) else field.replace('.', '_')
+
+
+def _json_pattern(path):
+    """
+    requestParameters 以 sort_keys 的精簡 JSON 字串存放（detection.reader），巢狀欄位以 RE2 正規表示式整欄擷取。
+    中間層物件內最多再容許一層巢狀物件；同名的鍵出現在其他物件中時可能誤配對，規則應使用不會混淆的路徑
+    """
+    keys = path.split('.')
+    prefix = ''.join(r'"%s":\s*\{(?:[^{}]|\{[^{}]*\})*?' % re.escape(key) for key in keys[:-1])
+    return prefix + r'"%s":\s*(?:"(?P<string>(?:[^"\\]|\\.)*)"|(?P<number>[-+.0-9eE]+|true|false))' % \
+        re.escape(keys[-1])
+
+
+def extract_field(values, path):
+    """從 JSON 字串欄擷取 path 的值（字串），沒有此欄位的列為空值"""
+    matched = pc.extract_regex(values, _json_pattern(path))
+    string, number = pc.struct_field(matched, 'string'), pc.struct_field(matched, 'number')
+    value = pc.if_else(pc.equal(number, ''), string, number)
+    return pc.if_else(pc.is_valid(matched), value, pa.scalar(None, pa.string()))
+
+
+def _condition(values, expected):
+    if expected is None:
+        return pc.is_null(values)
+    if isinstance(expected, (list, tuple, set, frozenset)):
+        return pc.is_in(values, value_set=pa.array(sorted(expected), pa.string()))
+    return pc.fill_null(pc.equal(values, expected), False)
+
+
+def _pushdown(where):
+    """store 欄位上的條件交給 pyarrow.dataset，在讀取時過濾"""
+    expression = None
+    for field, expected in (where or {}).items():
+        if _is_nested(field):
+            continue
+        column = ds.field(_store_column(field))
+        if expected is None:
+            condition = column.is_null()
+        elif isinstance(expected, (list, tuple, set, frozenset)):
+            condition = column.isin(sorted(expected))
+        else:
+            condition = column == expected
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def load_columns(store_path, events, fields, where=None, **query_options):
+    """
+    讀取 events 中符合 where 的事件，回傳 ({欄位: pyarrow.Array}, 讀取的事件數)，欄位一定包含 eventTime。
+    字典編碼的欄位統一字典後轉為字串；巢狀欄位只對通過 store 欄位條件的列擷取
+    """
+    fields = set(fields) | set(where or ()) | {'eventTime'}
+    columns = sorted({_store_column(field) for field in fields})
+    table = query(store_path, columns, event_names=list(events), filter=_pushdown(where), **query_options)
+    table = table.unify_dictionaries().combine_chunks()
+    arrays = {}
+    for field in fields:
+        if _is_nested(field):
+            arrays[field] = extract_field(table['requestParameters'], field[len(REQUEST_PARAMETERS):])
+        else:
+            values = table[_store_column(field)].chunk(0) if table.num_rows else \
+                pa.array([], table.schema.field(_store_column(field)).type)
+            if pa.types.is_dictionary(values.type):
+                values = values.dictionary_decode()
+            arrays[field] = values
+    mask = None
+    for field, expected in (where or {}).items():
+        if _is_nested(field):
+            condition = _condition(arrays[field], expected)
+            mask = condition if mask is None else pc.and_(mask, condition)
+    if mask is not None:
+        arrays = {field: pc.filter(values, mask) for field, values in arrays.items()}
+    return arrays, table.num_rows
+
+
+def encode(*arrays):
+    """多個字串欄共用一份字典編碼；回傳 (每欄的整數碼, 字典)，空值為 -1"""
+    encoded = pc.dictionary_encode(pa.chunked_array(arrays, pa.string())).combine_chunks()
+    codes = np.asarray(pc.fill_null(encoded.indices, -1), dtype=np.int64)
+    result, offset = [], 0
+    for values in arrays:
+        result.append(codes[offset:offset + len(values)])
+        offset += len(values)
+    return result, encoded.dictionary
+
+
+def group_codes(arrays, fields):
+    """
+    將多個分組欄位以混合進位合併為一個整數碼（空值為各欄的 0）；
+    回傳 (碼, 碼 → 分組值 tuple 的函數)
+    """
+    count = len(arrays['eventTime'])
+    if not fields:
+        return np.zeros(count, dtype=np.int64), lambda code: ()
+    combined = np.zeros(count, dtype=np.int64)
+    dictionaries = []
+    for field in fields:
+        (field_codes,), dictionary = encode(pc.cast(arrays[field], pa.string()))
+        combined = combined * (len(dictionary) + 1) + field_codes + 1
+        dictionaries.append(dictionary)
+    compacted = None
+    if count and int(combined.max()) >= 1 << 40:
+        # 分組碼還要與時間組成 int64，範圍過大時壓縮為連續的整數
+        compacted, combined = np.unique(combined, return_inverse=True)
+        combined = combined.reshape(-1)
+
+    def describe(code):
+        code = int(code if compacted is None else compacted[code])
+        values = []
+        for dictionary in reversed(dictionaries):
+            code, field_code = divmod(code, len(dictionary) + 1)
+            values.append(dictionary[field_code - 1].as_py() if field_code else None)
+        return tuple(reversed(values))
+
+    return combined, describe
+
+
+def follows_mask(times, keys, other_times, other_keys, within):
+    """
+    每列是否在 within 秒內（含）先有同 key 的另一種事件。
+    另一側依 (key, 時間) 組成單一 int64 排序後，每列以一次 searchsorted 找到同 key 最近的前一筆
+    """
+    if not len(times) or not len(other_times):
+        return np.zeros(len(times), dtype=bool)
+    base = min(times.min(), other_times.min())
+    stride = int(max(times.max(), other_times.max()) - base) + within + 2
+    other = np.sort(other_keys * stride + (other_times - base))
+    mine = keys * stride + (times - base)
+    position = np.searchsorted(other, mine, side='right') - 1
+    found = position >= 0
+    previous = other[np.maximum(position, 0)]
+    return found & (keys >= 0) & (previous // stride == keys) & (mine - previous <= within)
+
+
+def windowed_aggregate(groups, times, window, values=None):
+    """
+    每個分組以 window 秒的滑動視窗計數（values 為 None）或計算不重複值個數。
+    每筆事件（count_distinct 時為每個 (分組, 值) 連續出現的區段）轉成 +1（時間 t）與 -1（視窗結束或同值下次出現）
+    兩個差分，編碼為 ((分組, 時間) << 1 | 正負) 的 int64 後排序一次，累加即為各時間點的視窗值；
+    每個分組的差分總和為 0，不需要在分組之間重設。
+    回傳排序後的 (分組, 時間, 視窗值)，只含 +1 的位置
+    """
+    base = int(times.min())
+    offsets = times - base
+    stride = int(times.max()) - base + window + 2
+    if values is None:
+        starts = groups * stride + offsets
+        ends = starts + window
+    else:
+        # (分組, 值) 與時間組成 int64，超出範圍時才先壓縮為連續的整數碼；同一秒只計一次，下一次出現前都算在視窗內
+        cardinality = int(values.max()) + 1
+        pairs = groups * cardinality + values
+        compacted = None
+        if (int(pairs.max()) + 1) * stride >= 1 << 62:
+            compacted, pairs = np.unique(pairs, return_inverse=True)
+            pairs = pairs.reshape(-1)
+        runs = np.sort(pairs * stride + offsets)
+        runs = runs[np.append(True, runs[1:] != runs[:-1])]
+        run_pairs, run_offsets = np.divmod(runs, stride)
+        same_value = np.append(run_pairs[1:] == run_pairs[:-1], False)
+        next_offsets = np.append(run_offsets[1:], 0)
+        run_groups = (run_pairs if compacted is None else compacted[run_pairs]) // cardinality
+        starts = run_groups * stride + run_offsets
+        ends = starts + np.where(same_value, np.minimum(next_offsets - run_offsets, window), window)
+    # 同一秒先處理 -1 再處理 +1
+    deltas = np.sort(np.concatenate([(starts << 1) | 1, ends << 1]))
+    running = np.cumsum((deltas & 1) * 2 - 1)
+    added = (deltas & 1).astype(bool)
+    keys = deltas[added] >> 1
+    return keys // stride, keys % stride + base, running[added]
+
+
+def threshold_alerts(rule, groups, times, levels, describe):
+    """視窗值達到門檻的連續區段，每段一筆 Alert"""
+    above = levels >= rule.threshold
+    if not above.any():
+        return []
+    # 區段：同一分組內連續達到門檻的位置
+    boundary = np.ones(len(above), dtype=bool)
+    boundary[1:] = ~above[:-1] | (groups[1:] != groups[:-1])
+    starts = np.flatnonzero(above & boundary)
+    ends = np.flatnonzero(above & np.append(~above[1:] | (groups[1:] != groups[:-1]), True))
+    peaks = np.maximum.reduceat(np.where(above, levels, 0), starts)
+    return [Alert(rule.name, describe(int(groups[start])), float(times[start]), float(times[end]), int(peak))
+            for start, end, peak in zip(starts, ends, peaks)]
+
+
+def evaluate(store_path, rule, **query_options):
+    """以欄為單位評估一條規則，回傳 (Alert 清單, 讀取的事件數)"""
+    _require_numpy()
+    kind, field = rule.aggregate
+    fields = set(rule.group_by or ()) | ({field} if field else set())
+    if rule.follows:
+        fields.add(rule.follows.key)
+    arrays, scanned = load_columns(store_path, rule.events, fields, rule.where, **query_options)
+    if rule.follows and len(arrays['eventTime']):
+        follows = rule.follows
+        other, other_scanned = load_columns(store_path, follows.events, {follows.other_key}, follows.where, **query_options)
+        (keys, other_keys), _ = encode(pc.cast(arrays[follows.key], pa.string()),
+                                       pc.cast(other[follows.other_key], pa.string()))
+        mask = follows_mask(np.asarray(arrays['eventTime'], dtype=np.int64), keys,
+                            np.asarray(other['eventTime'], dtype=np.int64), other_keys, follows.within)
+        arrays = {name: values.filter(pa.array(mask)) for name, values in arrays.items()}
+        scanned += other_scanned
+    if not len(arrays['eventTime']):
+        return [], scanned
+
+    groups, describe = group_codes(arrays, rule.group_by)
+    times = np.asarray(arrays['eventTime'], dtype=np.int64)
+    values = None
+    if kind == 'count_distinct':
+        (values,), _ = encode(pc.cast(arrays[field], pa.string()))
+        keep = values >= 0
+        groups, times, values = groups[keep], times[keep], values[keep]
+        if not len(times):
+            return [], scanned
+    elif kind != 'count':
+        raise ValueError(f"unsupported aggregate {kind!r}")
+    window = rule.window if rule.window is not None else int(times.max() - times.min()) + 1
+    groups, times, levels = windowed_aggregate(groups, times, window, values)
+    return threshold_alerts(rule, groups, times, levels, describe), scanned
+
+
+def run_rules(store_path, rules=RULES, **query_options):
+    """依序評估每條規則，回傳 {規則名稱: (Alert 清單, 讀取的事件數, 秒數)}"""
+    results = {}
+    for rule in rules:
+        start = time.perf_counter()
+        alerts, scanned = evaluate(store_path, rule, **query_options)
+        results[rule.name] = (alerts, scanned, time.perf_counter() - start)
+    return results
+
+
+def benchmark(events, seed=0, workers=None, hours=24):
+    """
+    以 detection.synth 產生混入每個情境的 Parquet store，評估所有規則，
+    檢查每次情境重播是否在其時間範圍內觸發 SCENARIO_RULES 中的規則
+    """
+    from detection.synth import SYNTH_START, generate
+
+    with tempfile.TemporaryDirectory() as output:
+        start = time.perf_counter()
+        written, runs = generate(output, events, SYNTH_START, hours * 3600, seed,
+                                 output_format='parquet', events_per_file=100000, max_workers=workers)
+        print(f"Generated {written} events in {time.perf_counter() - start:.2f}s.")
+        store_path = os.path.join(output, 'store')
+        results = run_rules(store_path)
+        total = 0
+        for name, (alerts, scanned, elapsed) in results.items():
+            total += elapsed
+            print(f"{name}: {len(alerts)} alerts, {scanned} events scanned in {elapsed:.3f}s "
+                  f"({scanned / elapsed if elapsed else 0:.0f} events/s)")
+        print(f"All rules: {total:.3f}s for {written} events in the store ({written / total:.0f} events/s).")
+        missed = 0
+        for run in runs:
+            for name in SCENARIO_RULES.get(run['scenario'], ()):
+                # 視窗型規則可能在情境結束後才達到門檻
+                hit = any(run['start'] - 1 <= alert.first <= run['end'] + 600 for alert in results[name][0])
+                missed += not hit
+                print(f"    {run['scenario']} ({run['run_id']}): {name} {'detected' if hit else 'MISSED'}")
+        return missed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate detection rules column-at-a-time over a detection.store.")
+    parser.add_argument('store', nargs='?', help="Parquet store written by detection.store or detection.synth")
+    parser.add_argument('--rules', nargs='+', choices=[rule.name for rule in RULES])
+    parser.add_argument('--start-date', type=parse_date)
+    parser.add_argument('--end-date', type=parse_date)
+    parser.add_argument('--benchmark', type=int, metavar='EVENTS',
+                        help="generate a synthetic store with every scenario replayed and time each rule")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        raise SystemExit(1 if benchmark(args.benchmark, args.seed, args.workers) else 0)
+    if not args.store:
+        parser.error("store is required unless --benchmark is given")
+    rules = [rule for rule in RULES if not args.rules or rule.name in args.rules]
+    results = run_rules(args.store, rules, start_date=args.start_date, end_date=args.end_date)
+    for name, (alerts, scanned, elapsed) in results.items():
+        print(f"{name}: {len(alerts)} alerts from {scanned} events in {elapsed:.3f}s")
+        for alert in alerts:
+            print(f"    {json.dumps(alert.group)} {alert.first:.0f}-{alert.last:.0f} peak {alert.peak}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+import argparse
+import array
+import collections
+import hashlib
+import math
+import random
+import tempfile
+import time
+
+from detection.reader import parse_date, read_events_in_order
+
+SECRETS_FIELDS = ('eventTime', 'eventName', 'awsRegion', 'userIdentity.arn', 'requestParameters.secretId',
+                  'errorCode')
+
+# 預設門檻：視窗內的讀取次數、不重複的秘密數與區域數都超過才告警
+DEFAULT_MIN_READS = 50
+DEFAULT_MIN_SECRETS = 20
+DEFAULT_MIN_REGIONS = 3
+
+BUCKET_SECONDS = 60
+WINDOW_BUCKETS = 10
+
+# count-min sketch 的大小應遠大於一個視窗內的活躍主體數
+SKETCH_WIDTH = 1 << 15
+SKETCH_DEPTH = 4
+HLL_PRECISION = 6
+
+# 計數超過 min_reads 的一半時，主體成為候選，開始以 HyperLogLog 追蹤秘密與區域
+MAX_CANDIDATES = 1024
+
+# 告警抑制表的大小上限，超過時清除視窗外的項目
+MAX_ALERTED = 4096
+
+# 區域以位元表示；AWS 區域不超過 64 個，超過時取餘數
+REGION_BITS = 64
+
+# muti-get-secrets.py 掃描的區域
+SWEEP_REGIONS = ('us-east-1', 'us-east-2', 'us-west-1', 'us-west-2', 'ap-east-1', 'ap-south-1', 'ap-northeast-3',
+                 'ap-northeast-2', 'ap-southeast-1', 'ap-southeast-2', 'ap-northeast-1', 'ca-central-1',
+                 'eu-central-1', 'eu-west-1', 'eu-west-2', 'eu-west-3', 'eu-north-1', 'sa-east-1')
+
+Alert = collections.namedtuple('Alert', ['principal', 'time', 'reads', 'secrets', 'regions'])
+
+
+def hash64(value):
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def hll_estimate(registers):
+    """HyperLogLog 基數估計，小範圍以線性計數修正"""
+    m = len(registers)
+    alpha = 0.673 if m == 16 else 0.697 if m == 32 else 0.709 if m == 64 else 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / sum(2.0 ** -register for register in registers)
+    zeros = registers.count(0)
+    if estimate <= 2.5 * m and zeros:
+        return m * math.log(m / zeros)
+    return estimate
+
+
+class _Candidate:
+    """候選主體在每個時間桶的 HyperLogLog 暫存器與區域位元"""
+
+    def __init__(self, window_buckets, registers):
+        self.indexes = [None] * window_buckets
+        self.registers = [bytearray(registers) for _ in range(window_buckets)]
+        self.regions = [0] * window_buckets
+        self.last_seen = None
+
+    def slot(self, index):
+        slot = index % len(self.indexes)
+        if self.indexes[slot] != index:
+            self.indexes[slot] = index
+            self.registers[slot] = bytearray(len(self.registers[slot]))
+            self.regions[slot] = 0
+        return slot
+
+    def estimate(self, oldest):
+        merged = bytearray(len(self.registers[0]))
+        regions = 0
+        for index, registers, region_bits in zip(self.indexes, self.registers, self.regions):
+            if index is not None and index >= oldest:
+                merged = bytearray(map(max, merged, registers))
+                regions |= region_bits
+        return round(hll_estimate(merged)), bin(regions).count('1')
+
+
+class SecretsReadDetector:
+    """
+    以滑動視窗偵測大量讀取 Secrets Manager。
+    所有主體共用一個 count-min sketch 計數（每個時間桶一份，另維護整個視窗的總和）；
+    計數達到門檻一半的主體才成為候選，以 HyperLogLog 估計不重複的秘密數並記錄區域位元。
+    候選數量有上限，記憶體與主體數量無關。
+    """
+
+    def __init__(self, min_reads=DEFAULT_MIN_READS, min_secrets=DEFAULT_MIN_SECRETS,
+                 min_regions=DEFAULT_MIN_REGIONS, bucket_seconds=BUCKET_SECONDS, window_buckets=WINDOW_BUCKETS,
+                 width=SKETCH_WIDTH, depth=SKETCH_DEPTH, precision=HLL_PRECISION, max_candidates=MAX_CANDIDATES):
+        self.min_reads = min_reads
+        self.min_secrets = min_secrets
+        self.min_regions = min_regions
+        self.bucket_seconds = bucket_seconds
+        self.window_buckets = window_buckets
+        self.width = width
+        self.depth = depth
+        self.precision = precision
+        self.max_candidates = max_candidates
+        self.bucket_indexes = [None] * window_buckets
+        self.bucket_counts = [array.array('i', bytes(4 * width * depth)) for _ in range(window_buckets)]
+        self.window_counts = array.array('i', bytes(4 * width * depth))
+        self.candidates = collections.OrderedDict()
+        self.region_bits = {}
+        # 同一主體在一個視窗內只告警一次
+        self.alerted = {}
+        self.events = 0
+        self.late_events = 0
+        self.latest_index = None
+
+    @property
+    def window_seconds(self):
+        return self.bucket_seconds * self.window_buckets
+
+    def _cells(self, principal):
+        # 以兩個 32 位元雜湊組合出 depth 個欄位（Kirsch-Mitzenmacher）
+        principal_hash = hash64(principal)
+        first, second = principal_hash & 0xffffffff, principal_hash >> 32
+        return [row * self.width + (first + row * second) % self.width for row in range(self.depth)]
+
+    def _advance(self, index):
+        """
+        視窗結尾推進到 index：所有不晚於 index - window_buckets 的時間桶過期，
+        從視窗總和中扣除並清空（包括推進時跳過、之後不會再被重複使用的時間桶）
+        """
+        oldest = index - self.window_buckets
+        window_counts = self.window_counts
+        for slot, bucket_index in enumerate(self.bucket_indexes):
+            if bucket_index is None or bucket_index > oldest:
+                continue
+            counts = self.bucket_counts[slot]
+            for cell, count in enumerate(counts):
+                if count:
+                    window_counts[cell] -= count
+            self.bucket_indexes[slot] = None
+            self.bucket_counts[slot] = array.array('i', bytes(len(counts) * counts.itemsize))
+        self.latest_index = index
+
+    def _bucket_counts(self, index):
+        # 視窗內的時間桶與槽位一一對應，槽位中較舊的時間桶已由 _advance 清空
+        slot = index % self.window_buckets
+        self.bucket_indexes[slot] = index
+        return self.bucket_counts[slot]
+
+    def _region_bit(self, region):
+        bit = self.region_bits.get(region)
+        if bit is None:
+            bit = self.region_bits[region] = len(self.region_bits) % REGION_BITS
+        return 1 << bit
+
+    def _candidate(self, principal):
+        candidate = self.candidates.get(principal)
+        if candidate is None:
+            if len(self.candidates) >= self.max_candidates:
+                # 淘汰最久沒有讀取的候選
+                self.candidates.popitem(last=False)
+            candidate = self.candidates[principal] = _Candidate(self.window_buckets, 1 << self.precision)
+        else:
+            self.candidates.move_to_end(principal)
+        return candidate
+
+    def add(self, principal, secret, region, when):
+        """加入一次 GetSecretValue；超過門檻時回傳 Alert"""
+        self.events += 1
+        index = int(when // self.bucket_seconds)
+        if self.latest_index is None or index > self.latest_index:
+            self._advance(index)
+        elif index <= self.latest_index - self.window_buckets:
+            # 早於視窗的事件無法再計入
+            self.late_events += 1
+            return None
+
+        counts = self._bucket_counts(index)
+        window_counts = self.window_counts
+        reads = None
+        for cell in self._cells(principal):
+            counts[cell] += 1
+            window_counts[cell] += 1
+            if reads is None or window_counts[cell] < reads:
+                reads = window_counts[cell]
+        if principal not in self.candidates and reads < self.min_reads // 2:
+            return None
+
+        candidate = self._candidate(principal)
+        slot = candidate.slot(index)
+        # 同名秘密在不同區域是不同的秘密
+        secret_hash = hash64(f"{region}/{secret or ''}")
+        register = secret_hash & ((1 << self.precision) - 1)
+        remaining = secret_hash >> self.precision
+        rank = 1
+        while remaining & 1 == 0 and rank <= 64 - self.precision:
+            rank += 1
+            remaining >>= 1
+        if candidate.registers[slot][register] < rank:
+            candidate.registers[slot][register] = rank
+        candidate.regions[slot] |= self._region_bit(region)
+        candidate.last_seen = when
+        return self._check(principal, candidate, reads, when)
+
+    def _check(self, principal, candidate, reads, when):
+        if reads < self.min_reads:
+            return None
+        last = self.alerted.get(principal)
+        if last is not None and when - last < self.window_seconds:
+            return None
+        secrets, regions = candidate.estimate(self.latest_index - self.window_buckets + 1)
+        if secrets < self.min_secrets or regions < self.min_regions:
+            return None
+        if len(self.alerted) >= MAX_ALERTED:
+            self.alerted = {key: value for key, value in self.alerted.items()
+                            if when - value < self.window_seconds}
+        self.alerted[principal] = when
+        return Alert(principal, when, reads, secrets, regions)
+
+    def estimate(self, principal):
+        """視窗內 (讀取次數, 不重複秘密數, 區域數) 的估計值；非候選主體只有讀取次數"""
+        reads = min(self.window_counts[cell] for cell in self._cells(principal))
+        candidate = self.candidates.get(principal)
+        if candidate is None:
+            return reads, None, None
+        return (reads,) + candidate.estimate(self.latest_index - self.window_buckets + 1)
+
+    def add_event(self, event):
+        """加入一筆以 SECRETS_FIELDS 投影的 detection.reader Event"""
+        if event.eventName != 'GetSecretValue' or event.errorCode or event.eventTime is None:
+            return None
+        return self.add(event.userIdentity_arn or '', event.requestParameters_secretId, event.awsRegion,
+                        event.eventTime)
+
+    def memory_usage(self):
+        sketch = (len(self.bucket_counts) + 1) * len(self.window_counts) * self.window_counts.itemsize
+        candidates = len(self.candidates) * self.window_buckets * ((1 << self.precision) + 16)
+        return sketch + candidates
+
+
+def detect(root, detector=None, **read_options):
+    """
+    依序產生 CloudTrail 日誌中的 Alert。偵測器的視窗只接受晚於目前視窗開頭的事件，
+    事件以 read_events_in_order 依事件時間（逐日合併所有區域）送入
+    """
+    detector = detector or SecretsReadDetector()
+    for event in read_events_in_order(root, SECRETS_FIELDS, event_names=['GetSecretValue'], **read_options):
+        alert = detector.add_event(event)
+        if alert:
+            yield alert
+
+
+def mixed_traffic(events, principals, attack_start, regions, seed=0):
+    """
+    記憶體內的混合流量：大量正常主體各自少量讀取固定的幾個秘密，
+    並在 attack_start 插入與 muti-get-secrets.py 相同模式的掃描（每個區域讀取所有秘密）
+    """
+    generator = random.Random(seed)
+    attacker = 'arn:aws:iam::111122223333:user/attacker'
+    attack = [(region, f"arn:aws:secretsmanager:{region}:111122223333:secret:app-{i}")
+              for region in regions for i in range(10)]
+    for i in range(events):
+        when = i * 0.01
+        if attack and when >= attack_start:
+            region, secret = attack.pop()
+            yield attacker, secret, region, when
+            continue
+        principal = f"arn:aws:sts::111122223333:assumed-role/app-{generator.randrange(principals)}/session"
+        region = generator.choice(regions)
+        yield principal, f"arn:aws:secretsmanager:{region}:111122223333:secret:db-{generator.randrange(3)}", region, when
+
+
+def benchmark(events, principals, regions):
+    detector = SecretsReadDetector()
+    start = time.perf_counter()
+    alerts = [alert for alert in (detector.add(*event) for event in
+                                  mixed_traffic(events, principals, events * 0.005, regions)) if alert]
+    elapsed = time.perf_counter() - start
+    print(f"{events} events from {principals} principals in {elapsed:.2f}s ({events / elapsed:.0f} events/s), "
+          f"sketch memory {detector.memory_usage() / 1024:.0f} KiB")
+    for alert in alerts:
+        print(f"Alert: {alert.principal} read {alert.reads} times, ~{alert.secrets} secrets in {alert.regions} regions")
+    return alerts
+
+
+def synth_benchmark(events, seed=0, hours=24, workers=None):
+    """
+    以 detection.synth 產生混入 muti-get-secrets 掃描的 CloudTrail 目錄，經由 detect() 讀取，
+    檢查掃描期間是否告警；回傳未偵測到的掃描次數
+    """
+    from detection.synth import SYNTH_START, generate
+
+    with tempfile.TemporaryDirectory() as output:
+        start = time.perf_counter()
+        written, runs = generate(output, events, SYNTH_START, hours * 3600, seed, scenarios=['muti-get-secrets'],
+                                 max_workers=workers)
+        print(f"Generated {written} events in {time.perf_counter() - start:.2f}s.")
+        detector = SecretsReadDetector()
+        start = time.perf_counter()
+        alerts = list(detect(output, detector, max_workers=workers))
+        elapsed = time.perf_counter() - start
+        print(f"{detector.events} GetSecretValue events in {elapsed:.2f}s, {detector.late_events} outside the window.")
+        missed = 0
+        for run in runs:
+            hits = [alert for alert in alerts if run['start'] - 1 <= alert.time <= run['end'] + detector.window_seconds]
+            missed += not hits
+            for alert in hits:
+                print(f"    {run['scenario']} ({run['run_id']}): {alert.principal} read {alert.reads} times, "
+                      f"~{alert.secrets} secrets in {alert.regions} regions")
+            if not hits:
+                print(f"    {run['scenario']} ({run['run_id']}): MISSED")
+        print(f"{len(alerts)} alerts in total.")
+        return missed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detect high-volume Secrets Manager reads in a CloudTrail export.")
+    parser.add_argument('root', nargs='?', help="directory containing AWSLogs/ (or any level below it)")
+    parser.add_argument('--regions', nargs='+')
+    parser.add_argument('--start-date', type=parse_date)
+    parser.add_argument('--end-date', type=parse_date)
+    parser.add_argument('--min-reads', type=int, default=DEFAULT_MIN_READS)
+    parser.add_argument('--min-secrets', type=int, default=DEFAULT_MIN_SECRETS)
+    parser.add_argument('--min-regions', type=int, default=DEFAULT_MIN_REGIONS)
+    parser.add_argument('--benchmark', type=int, metavar='EVENTS',
+                        help="run on in-memory traffic with the secrets sweep mixed into it instead of a corpus")
+    parser.add_argument('--principals', type=int, default=100000, help="benign principals for --benchmark")
+    parser.add_argument('--synth', type=int, metavar='EVENTS',
+                        help="generate a detection.synth corpus with the secrets sweep and run the CLI path on it")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.synth:
+        raise SystemExit(1 if synth_benchmark(args.synth, args.seed) else 0)
+    if args.benchmark:
+        benchmark(args.benchmark, args.principals, SWEEP_REGIONS)
+        return
+    if not args.root:
+        parser.error("a CloudTrail directory is required unless --benchmark is given")
+
+    detector = SecretsReadDetector(args.min_reads, args.min_secrets, args.min_regions)
+    start = time.perf_counter()
+    for alert in detect(args.root, detector, regions=args.regions, start_date=args.start_date,
+                        end_date=args.end_date):
+        print(f"Alert: {alert.principal} read {alert.reads} times, ~{alert.secrets} secrets "
+              f"in {alert.regions} regions (at {alert.time:.0f})")
+    elapsed = time.perf_counter() - start
+    print(f"{detector.events} GetSecretValue events in {elapsed:.2f}s, {detector.late_events} outside the window.")
+
+
+if __name__ == "__main__":
+    main()
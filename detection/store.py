@@ -0,0 +1,177 @@
+import argparse
+import datetime
+import os
+import time
+import uuid
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.fs
+except ImportError:
+    pa = None
+
+from detection.reader import DEFAULT_FIELDS, parse_date, read_events
+
+# 存放 requestParameters 以便查詢例如 CreateAccessKey 的 userName
+STORE_FIELDS = DEFAULT_FIELDS + ('recipientAccountId', 'requestParameters')
+
+# 重複值極多的欄位以字典編碼（整數索引 + 一份字串表）
+DICTIONARY_COLUMNS = {'eventSource', 'awsRegion', 'userIdentity_type', 'userIdentity_arn',
+                      'userIdentity_accessKeyId', 'sourceIPAddress', 'userAgent', 'errorCode',
+                      'recipientAccountId'}
+FLOAT_COLUMNS = {'eventTime', 'deliveryTime'}
+
+# 分割欄位：目錄為 date=YYYY-MM-DD/eventName=XXX/
+PARTITION_COLUMNS = ('date', 'eventName')
+
+BATCH_ROWS = 64 * 1024
+MAX_ROWS_PER_FILE = 1024 * 1024
+MAX_PARTITIONS = 16 * 1024
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("detection.store needs pyarrow: pip install pyarrow")
+
+
+def column_names(fields):
+    return [field.replace('.', '_') for field in fields] + ['deliveryTime']
+
+
+def store_schema(fields=STORE_FIELDS):
+    _require_pyarrow()
+    columns = []
+    for name in column_names(fields):
+        if name in FLOAT_COLUMNS:
+            columns.append((name, pa.float64()))
+        elif name in DICTIONARY_COLUMNS:
+            columns.append((name, pa.dictionary(pa.int32(), pa.string())))
+        else:
+            columns.append((name, pa.string()))
+    columns.append(('date', pa.string()))
+    return pa.schema(columns)
+
+
+def _partitioning():
+    return ds.partitioning(pa.schema([(name, pa.string()) for name in PARTITION_COLUMNS]), flavor='hive')
+
+
+def _record_batches(events, schema, batch_rows):
+    """將 Event 串流切成固定列數的 RecordBatch，轉換過程只保留一批的資料"""
+    names = schema.names
+    event_time = names.index('eventTime')
+    columns = [[] for _ in names]
+    for event in events:
+        for column, value in zip(columns, event):
+            column.append(value)
+        when = event[event_time]
+        columns[-1].append(
+            datetime.datetime.fromtimestamp(when, datetime.timezone.utc).date().isoformat() if when else 'unknown')
+        if len(columns[0]) >= batch_rows:
+            yield pa.RecordBatch.from_arrays(
+                [pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema)
+            columns = [[] for _ in names]
+    if columns[0]:
+        yield pa.RecordBatch.from_arrays(
+            [pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema)
+
+
+def convert(root, store_path, fields=STORE_FIELDS, batch_rows=BATCH_ROWS, **read_options):
+    """
+    將 CloudTrail 日誌一次轉成以 date、eventName 分割的 Parquet。
+    新檔名帶唯一識別，重複執行會附加（以 start_date / end_date 只轉換新的日期）。
+    read_options 傳給 detection.reader.read_events
+    """
+    fields = tuple(fields)
+    write_events(read_events(root, fields, **read_options), store_path, fields, batch_rows)
+
+
+def write_events(events, store_path, fields=STORE_FIELDS, batch_rows=BATCH_ROWS, basename=None):
+    """
+    將 Event（或欄位順序相同、最後為 deliveryTime 的 tuple）串流附加到 store；
+    basename 為檔名前綴，未指定時隨機產生，多個行程可同時附加
+    """
+    _require_pyarrow()
+    schema = store_schema(fields)
+    batches = _record_batches(events, schema, batch_rows)
+    ds.write_dataset(
+        batches,
+        store_path,
+        schema=schema,
+        format='parquet',
+        partitioning=_partitioning(),
+        basename_template=f"{basename or 'part-' + uuid.uuid4().hex[:12]}-{{i}}.parquet",
+        existing_data_behavior='overwrite_or_ignore',
+        max_partitions=MAX_PARTITIONS,
+        max_rows_per_file=MAX_ROWS_PER_FILE,
+        max_rows_per_group=batch_rows
+    )
+
+
+def open_store(store_path):
+    """以記憶體映射開啟，讀取時只對需要的欄位與分割做 I/O"""
+    _require_pyarrow()
+    return ds.dataset(store_path, format='parquet', partitioning=_partitioning(),
+                      filesystem=pyarrow.fs.LocalFileSystem(use_mmap=True))
+
+
+def partition_filter(event_names=None, start_date=None, end_date=None):
+    """date / eventName 條件只比對目錄名稱，不符合的分割不會被開啟"""
+    expression = None
+    conditions = []
+    if event_names:
+        conditions.append(ds.field('eventName').isin(list(event_names)))
+    if start_date:
+        conditions.append(ds.field('date') >= start_date.isoformat())
+    if end_date:
+        conditions.append(ds.field('date') <= end_date.isoformat())
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def query(store_path, columns=None, event_names=None, start_date=None, end_date=None, filter=None):
+    """
+    回傳 pyarrow.Table；columns 限定讀取的欄位，filter 為額外的 pyarrow.dataset 運算式
+    （例如 ds.field('userIdentity_arn') == arn）
+    """
+    expression = partition_filter(event_names, start_date, end_date)
+    if filter is not None:
+        expression = filter if expression is None else expression & filter
+    return open_store(store_path).to_table(columns=columns, filter=expression)
+
+
+def count_by(store_path, keys, event_names=None, start_date=None, end_date=None, filter=None):
+    """依 keys 分組計數（例如每個 principal、每個區域的 GetSecretValue 次數），只讀取 keys 欄位"""
+    table = query(store_path, list(keys), event_names, start_date, end_date, filter)
+    # 字典編碼欄位分組前先解碼
+    table = pa.table({
+        name: pc.cast(table[name], pa.string()) if pa.types.is_dictionary(table[name].type) else table[name]
+        for name in keys
+    })
+    return table.group_by(list(keys)).aggregate([([], 'count_all')]).rename_columns(list(keys) + ['count'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a local CloudTrail export into a partitioned Parquet store.")
+    parser.add_argument('root', help="directory containing AWSLogs/ (or any level below it)")
+    parser.add_argument('store', help="output directory of the Parquet store")
+    parser.add_argument('--regions', nargs='+')
+    parser.add_argument('--start-date', type=parse_date)
+    parser.add_argument('--end-date', type=parse_date)
+    parser.add_argument('--workers', type=int)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    convert(args.root, args.store, regions=args.regions, start_date=args.start_date, end_date=args.end_date,
+            max_workers=args.workers)
+    rows = open_store(args.store).count_rows()
+    size = sum(os.path.getsize(os.path.join(path, name))
+               for path, _, names in os.walk(args.store) for name in names)
+    print(f"{rows} events in store, {size / 1024 / 1024:.1f} MiB, took {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
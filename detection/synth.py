@@ -0,0 +1,474 @@
+import argparse
+import concurrent.futures
+import datetime
+import functools
+import gzip
+import json
+import math
+import os
+import random
+import time
+import uuid
+
+from common.journal import ResourceJournal
+from common.manifest import manifest_path
+from detection.reader import projector
+from detection.secrets_detector import SWEEP_REGIONS
+
+ACCOUNT_ID = '111122223333'
+OPERATOR = 'harry-redteam'
+OPERATOR_ARN = f"arn:aws:iam::{ACCOUNT_ID}:user/{OPERATOR}"
+ADMIN_POLICY_ARN = 'arn:aws:iam::aws:policy/AdministratorAccess'
+
+# CloudTrail 約每 5 分鐘送出一個檔案，送達延遲在 SLICE_SECONDS 之後再加上 DELIVERY_DELAY 秒
+SLICE_SECONDS = 300
+DELIVERY_DELAY = (60, 600)
+EVENTS_PER_FILE = 5000
+# 預設的起始時間 2024-05-01T00:00:00Z，--benchmark 與 --synth 產生的資料也從此開始
+SYNTH_START = 1714521600
+# --format parquet 時 detection.store 的目錄
+STORE_DIRECTORY = 'store'
+BACKGROUND_PRINCIPALS = 2000
+
+# 各區域的背景流量比例；IAM、STS 與主控台登入等全域事件記錄在 us-east-1
+REGION_WEIGHTS = dict({region: 0.3 / (len(SWEEP_REGIONS) - 3) for region in SWEEP_REGIONS},
+                      **{'us-east-1': 0.4, 'us-east-2': 0.15, 'us-west-2': 0.15})
+GLOBAL_REGION = 'us-east-1'
+
+OPERATOR_AGENT = 'Boto3/1.34.0 md/Botocore#1.34.0 ua/2.0 os/linux lang/python#3.11'
+BROWSER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36'
+
+# (權重, eventSource, eventName, readOnly)；背景流量依權重抽樣
+BACKGROUND_EVENTS = [
+    (30, 'ec2.amazonaws.com', 'DescribeInstances', True),
+    (10, 'ec2.amazonaws.com', 'DescribeSecurityGroups', True),
+    (15, 'sts.amazonaws.com', 'GetCallerIdentity', True),
+    (8, 'sts.amazonaws.com', 'AssumeRole', False),
+    (10, 'kms.amazonaws.com', 'Decrypt', True),
+    (8, 's3.amazonaws.com', 'ListBuckets', True),
+    (8, 'secretsmanager.amazonaws.com', 'GetSecretValue', True),
+    (1, 'secretsmanager.amazonaws.com', 'ListSecrets', True),
+    (4, 'logs.amazonaws.com', 'DescribeLogStreams', True),
+    (3, 'iam.amazonaws.com', 'ListUsers', True),
+    (3, 'iam.amazonaws.com', 'GetRole', True),
+    (2, 'lambda.amazonaws.com', 'ListFunctions20150331', True),
+    (0.2, 'iam.amazonaws.com', 'CreateAccessKey', False),
+    (0.1, 'iam.amazonaws.com', 'AttachUserPolicy', False),
+    (0.2, 'signin.amazonaws.com', 'ConsoleLogin', False)
+]
+GLOBAL_SOURCES = {'iam.amazonaws.com', 'sts.amazonaws.com', 'signin.amazonaws.com'}
+
+# 偶爾失敗的背景呼叫
+ERROR_RATE = 0.01
+
+
+def key_id(prefix, rng):
+    return prefix + ''.join(rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ234567') for _ in range(16))
+
+
+def iso_time(when):
+    return datetime.datetime.fromtimestamp(when, datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def user_identity(arn, access_key_id):
+    if ':assumed-role/' in arn:
+        return {'type': 'AssumedRole', 'arn': arn, 'accountId': ACCOUNT_ID, 'accessKeyId': access_key_id,
+                'principalId': f"AROA{access_key_id[4:]}:{arn.rsplit('/', 1)[-1]}"}
+    if ':federated-user/' in arn:
+        return {'type': 'FederatedUser', 'arn': arn, 'accountId': ACCOUNT_ID, 'accessKeyId': access_key_id,
+                'principalId': f"{ACCOUNT_ID}:{arn.rsplit('/', 1)[-1]}"}
+    return {'type': 'IAMUser', 'arn': arn, 'accountId': ACCOUNT_ID, 'accessKeyId': access_key_id,
+            'principalId': f"AIDA{access_key_id[4:]}", 'userName': arn.rsplit('/', 1)[-1]}
+
+
+def make_record(rng, when, source, name, region, arn, access_key_id, parameters=None, response=None,
+                error=None, read_only=False, source_ip='203.0.113.10', user_agent=OPERATOR_AGENT):
+    record = {
+        'eventVersion': '1.09',
+        'userIdentity': user_identity(arn, access_key_id),
+        'eventTime': iso_time(when),
+        'eventSource': source,
+        'eventName': name,
+        'awsRegion': GLOBAL_REGION if source in GLOBAL_SOURCES else region,
+        'sourceIPAddress': source_ip,
+        'userAgent': user_agent,
+        'requestParameters': parameters,
+        'responseElements': response,
+        'requestID': str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+        'eventID': str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+        'readOnly': read_only,
+        'eventType': 'AwsConsoleSignIn' if source == 'signin.amazonaws.com' else 'AwsApiCall',
+        'managementEvent': True,
+        'recipientAccountId': ACCOUNT_ID,
+        'eventCategory': 'Management'
+    }
+    if error:
+        record['errorCode'] = error
+        record['errorMessage'] = f"{error} (synthetic)"
+    return record
+
+
+@functools.lru_cache(maxsize=BACKGROUND_PRINCIPALS)
+def background_principal(seed, index):
+    """背景主體由 (seed, index) 決定，不需要在記憶體中保存主體清單"""
+    rng = random.Random(f"{seed}:principal:{index}")
+    if index % 3 == 0:
+        return f"arn:aws:iam::{ACCOUNT_ID}:user/dev-{index}", key_id('AKIA', rng)
+    return f"arn:aws:sts::{ACCOUNT_ID}:assumed-role/app-{index % 97}/session-{index}", key_id('ASIA', rng)
+
+
+def background_record(rng, seed, when, region, principals, choices, weights):
+    source, name, read_only = rng.choices(choices, weights)[0]
+    arn, access_key_id = background_principal(seed, rng.randrange(principals))
+    parameters = response = None
+    if name == 'GetSecretValue':
+        parameters = {'secretId': f"app/{arn.rsplit('/', 2)[-2]}/db-{rng.randrange(3)}"}
+    elif name == 'AssumeRole':
+        role = f"app-{rng.randrange(97)}"
+        parameters = {'roleArn': f"arn:aws:iam::{ACCOUNT_ID}:role/{role}", 'roleSessionName': f"s-{rng.randrange(10**6)}"}
+        response = {'credentials': {'accessKeyId': key_id('ASIA', rng)}}
+    elif name in ('CreateAccessKey', 'AttachUserPolicy'):
+        # 正常的金鑰輪替與唯讀授權
+        user = f"dev-{rng.randrange(principals)}"
+        parameters = {'userName': user}
+        if name == 'CreateAccessKey':
+            response = {'accessKey': {'accessKeyId': key_id('AKIA', rng), 'userName': user, 'status': 'Active'}}
+        else:
+            parameters['policyArn'] = 'arn:aws:iam::aws:policy/ReadOnlyAccess'
+    elif name == 'ConsoleLogin':
+        response = {'ConsoleLogin': 'Success'}
+    error = 'AccessDenied' if rng.random() < ERROR_RATE else None
+    return make_record(rng, when, source, name, region, arn, access_key_id, parameters, response, error, read_only,
+                       source_ip=f"198.51.100.{rng.randrange(1, 255)}")
+
+
+class Footprint:
+    """一次情境執行的事件；local 呼叫（由本機 boto3 發出）同時寫入 API 清單"""
+
+    def __init__(self, scenario, run_id, start, rng):
+        self.scenario = scenario
+        self.run_id = run_id
+        self.start = start
+        self.now = start
+        self.rng = rng
+        self.records = []
+        self.calls = []
+
+    def call(self, source, name, arn, access_key_id, parameters=None, response=None, region=GLOBAL_REGION,
+             delay=(0.2, 1.5), local=True, **kwargs):
+        self.now += self.rng.uniform(*delay)
+        record = make_record(self.rng, self.now, source, name, region, arn, access_key_id, parameters, response,
+                             **kwargs)
+        self.records.append(record)
+        if local:
+            self.calls.append({
+                'ts': round(self.now - self.rng.uniform(0.05, 0.3), 3),
+                'op': f"{source.split('.')[0]}:{name}",
+                'region': record['awsRegion'],
+                'principal': access_key_id,
+                'rid': record['requestID'],
+                'ms': round(self.rng.uniform(40, 400), 1),
+                'status': 200,
+                'outcome': 'ok'
+            })
+        return record
+
+
+def backdoor_footprint(footprint, operator_key):
+    """ec2-backdoor-by-assume-role.py"""
+    run_id = footprint.run_id
+    role = f"EC2TestRole-{run_id}"
+    profile = f"EC2TestProfile-{run_id}"
+    profile_arn = f"arn:aws:iam::{ACCOUNT_ID}:instance-profile/{profile}"
+    iam = 'iam.amazonaws.com'
+    footprint.call(iam, 'GetRole', OPERATOR_ARN, operator_key, {'roleName': role}, error='NoSuchEntity')
+    footprint.call(iam, 'CreateRole', OPERATOR_ARN, operator_key, {'roleName': role, 'path': '/'},
+                   {'role': {'roleName': role, 'arn': f"arn:aws:iam::{ACCOUNT_ID}:role/{role}"}})
+    footprint.call(iam, 'AttachRolePolicy', OPERATOR_ARN, operator_key, {'roleName': role, 'policyArn': ADMIN_POLICY_ARN})
+    footprint.call(iam, 'GetInstanceProfile', OPERATOR_ARN, operator_key, {'instanceProfileName': profile},
+                   error='NoSuchEntity')
+    footprint.call(iam, 'CreateInstanceProfile', OPERATOR_ARN, operator_key, {'instanceProfileName': profile},
+                   {'instanceProfile': {'instanceProfileName': profile, 'arn': profile_arn}})
+    footprint.call(iam, 'AddRoleToInstanceProfile', OPERATOR_ARN, operator_key,
+                   {'instanceProfileName': profile, 'roleName': role})
+    ec2 = 'ec2.amazonaws.com'
+    footprint.call(ec2, 'CreateKeyPair', OPERATOR_ARN, operator_key, {'keyName': f"my-key-pair-{run_id}"},
+                   region='us-east-2')
+    instance_id = 'i-' + ''.join(footprint.rng.choice('0123456789abcdef') for _ in range(17))
+    footprint.call(ec2, 'RunInstances', OPERATOR_ARN, operator_key,
+                   {'instanceType': 't2.micro', 'iamInstanceProfile': {'name': profile}},
+                   {'instancesSet': {'items': [{'instanceId': instance_id, 'instanceState': {'name': 'pending'},
+                                                'iamInstanceProfile': {'arn': profile_arn}}]}},
+                   region='us-east-2', delay=(4, 10))
+
+
+def aksk_loop_footprint(footprint, operator_key, hops=3):
+    """aksk-loop.py：每一層以上一層的金鑰建立使用者與金鑰"""
+    run_id = footprint.run_id
+    iam = 'iam.amazonaws.com'
+    arn, current_key = OPERATOR_ARN, operator_key
+    for hop in range(1, hops + 1):
+        user = f"nested_user_{run_id}_{hop}"
+        user_arn = f"arn:aws:iam::{ACCOUNT_ID}:user/cloud-attack/{run_id}/{user}"
+        new_key = key_id('AKIA', footprint.rng)
+        footprint.call(iam, 'CreateUser', arn, current_key, {'userName': user, 'path': f"/cloud-attack/{run_id}/"},
+                       {'user': {'userName': user, 'arn': user_arn}})
+        footprint.call(iam, 'CreateAccessKey', arn, current_key, {'userName': user},
+                       {'accessKey': {'accessKeyId': new_key, 'userName': user, 'status': 'Active'}})
+        footprint.call(iam, 'AttachUserPolicy', arn, current_key, {'userName': user, 'policyArn': ADMIN_POLICY_ARN})
+        # 新金鑰生效前的 ListUsers 會失敗
+        footprint.call(iam, 'ListUsers', user_arn, new_key, delay=(2, 5), error='InvalidClientTokenId')
+        footprint.call(iam, 'ListUsers', user_arn, new_key, delay=(2, 8), read_only=True)
+        arn, current_key = user_arn, new_key
+
+
+def secrets_sweep_footprint(footprint, operator_key, secrets_per_region=20):
+    """muti-get-secrets.py：每個區域 ListSecrets 後讀取所有秘密"""
+    sm = 'secretsmanager.amazonaws.com'
+    for region in SWEEP_REGIONS:
+        footprint.call(sm, 'ListSecrets', OPERATOR_ARN, operator_key, region=region, read_only=True)
+        for index in range(secrets_per_region):
+            footprint.call(sm, 'GetSecretValue', OPERATOR_ARN, operator_key, {'secretId': f"prod/service-{index}"},
+                           region=region, delay=(0.05, 0.3), read_only=True)
+
+
+def federation_footprint(footprint, operator_key, hops=3):
+    """federation-token.py 的串鏈，最後以 cred-2-link.py 產生的連結登入主控台"""
+    run_id = footprint.run_id
+    iam = 'iam.amazonaws.com'
+    arn, current_key = OPERATOR_ARN, operator_key
+    for hop in range(1, hops + 1):
+        user = f"ft_nested_user_{run_id}_{hop}"
+        user_arn = f"arn:aws:iam::{ACCOUNT_ID}:user/cloud-attack/{run_id}/{user}"
+        new_key = key_id('AKIA', footprint.rng)
+        federated_arn = f"arn:aws:sts::{ACCOUNT_ID}:federated-user/{user}"
+        session_key = key_id('ASIA', footprint.rng)
+        footprint.call(iam, 'CreateUser', arn, current_key, {'userName': user, 'path': f"/cloud-attack/{run_id}/"},
+                       {'user': {'userName': user, 'arn': user_arn}})
+        footprint.call(iam, 'CreateAccessKey', arn, current_key, {'userName': user},
+                       {'accessKey': {'accessKeyId': new_key, 'userName': user, 'status': 'Active'}})
+        footprint.call(iam, 'AttachUserPolicy', arn, current_key, {'userName': user, 'policyArn': ADMIN_POLICY_ARN})
+        footprint.call('sts.amazonaws.com', 'GetFederationToken', user_arn, new_key,
+                       {'name': user, 'durationSeconds': 3600},
+                       {'federatedUser': {'arn': federated_arn},
+                        'credentials': {'accessKeyId': session_key}}, delay=(3, 8))
+        footprint.call(iam, 'DeleteAccessKey', arn, current_key, {'userName': user, 'accessKeyId': new_key})
+        footprint.call('ec2.amazonaws.com', 'DescribeInstances', federated_arn, session_key, delay=(1, 4),
+                       read_only=True)
+        arn, current_key = federated_arn, session_key
+    footprint.call('signin.amazonaws.com', 'ConsoleLogin', arn, current_key, response={'ConsoleLogin': 'Success'},
+                   delay=(30, 120), local=False, source_ip='192.0.2.44', user_agent=BROWSER_AGENT)
+
+
+FOOTPRINTS = {
+    'ec2-backdoor-by-assume-role': backdoor_footprint,
+    'aksk-loop': aksk_loop_footprint,
+    'muti-get-secrets': secrets_sweep_footprint,
+    'federation-token': federation_footprint
+}
+
+
+def build_footprints(seed, start, duration, scenarios):
+    """情境平均分散在時間範圍內；執行 ID 與事件都由 seed 決定"""
+    footprints = []
+    for index, scenario in enumerate(scenarios):
+        rng = random.Random(f"{seed}:footprint:{index}:{scenario}")
+        run_id = '%012x' % rng.getrandbits(48)
+        offset = duration * (index + 1) / (len(scenarios) + 1)
+        footprint = Footprint(scenario, run_id, start + offset, rng)
+        FOOTPRINTS[scenario](footprint, key_id('AKIA', random.Random(f"{seed}:operator")))
+        footprints.append(footprint)
+    return footprints
+
+
+def log_file_path(output, region, delivered, rng):
+    stamp = datetime.datetime.fromtimestamp(delivered, datetime.timezone.utc)
+    directory = os.path.join(output, 'AWSLogs', ACCOUNT_ID, 'CloudTrail', region,
+                             f"{stamp:%Y}", f"{stamp:%m}", f"{stamp:%d}")
+    unique = '%016x' % rng.getrandbits(64)
+    return os.path.join(directory, f"{ACCOUNT_ID}_CloudTrail_{region}_{stamp:%Y%m%dT%H%MZ}_{unique}.json.gz")
+
+
+def write_log_file(output, region, records, delivered, rng):
+    """
+    寫出一個 CloudTrail 日誌檔，mtime 設為送達時間（與 S3 物件的 LastModified 相同）。
+    json.dumps 使用 C 編碼器（json.dump 逐段寫入會退回純 Python 實作）；gzip 標頭的 mtime 固定為 0，
+    同一個 seed 產生的檔案逐位元組相同
+    """
+    path = log_file_path(output, region, delivered, rng)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    data = json.dumps({'Records': records}, separators=(',', ':')).encode('utf-8')
+    with open(path, 'wb') as file:
+        file.write(gzip.compress(data, compresslevel=5, mtime=0))
+    os.utime(path, (delivered, delivered))
+    return path
+
+
+def slice_records(seed, region, principals, delivery_delay, slice_start, part, parts, count, injected):
+    """
+    一個 (區域, 時間片, 分段) 的事件，依時間排序；
+    亂數種子只由 seed 與座標決定，結果與工作行程數量、執行順序無關
+    """
+    rng = random.Random(f"{seed}:{region}:{slice_start}:{part}")
+    choices = [(source, name, read_only) for _, source, name, read_only in BACKGROUND_EVENTS]
+    weights = [weight for weight, _, _, _ in BACKGROUND_EVENTS]
+    part_seconds = SLICE_SECONDS / parts
+    part_start = slice_start + part * part_seconds
+    records = [background_record(rng, seed, part_start + rng.random() * part_seconds, region, principals, choices,
+                                 weights) for _ in range(count)]
+    records.extend(injected)
+    records.sort(key=lambda record: record['eventTime'])
+    delivered = slice_start + SLICE_SECONDS + rng.uniform(*delivery_delay)
+    return records, delivered, rng
+
+
+def write_part(task):
+    """
+    工作行程產生同一區域的連續幾個分段並寫出：gzip 每個分段一個日誌檔，
+    parquet 將所有分段串流寫入同一組檔案（避免大量小檔案）
+    """
+    seed, output, output_format, region, principals, delivery_delay, pieces = task
+    if output_format == 'parquet':
+        from detection.store import STORE_FIELDS, write_events
+        project = projector(STORE_FIELDS)
+
+        def rows():
+            for piece in pieces:
+                records, delivered, _ = slice_records(seed, region, principals, delivery_delay, *piece)
+                # 送達時間取到分鐘，與日誌檔名一致
+                delivered = delivered // 60 * 60
+                for record in records:
+                    yield project(record) + (delivered,)
+
+        slice_start, part = pieces[0][:2]
+        write_events(rows(), os.path.join(output, STORE_DIRECTORY),
+                     basename=f"synth-{region}-{slice_start:.0f}-{part}")
+        return sum(piece[3] + len(piece[4]) for piece in pieces)
+
+    written = 0
+    for piece in pieces:
+        records, delivered, rng = slice_records(seed, region, principals, delivery_delay, *piece)
+        write_log_file(output, region, records, delivered, rng)
+        written += len(records)
+    return written
+
+
+def plan_tasks(seed, output, output_format, events, start, duration, events_per_file, principals, footprints,
+               delivery_delay=DELIVERY_DELAY):
+    """
+    依區域比例與時間片切分：每個分段最多 events_per_file 筆，同一區域的連續分段
+    合併成約 events_per_file 筆的工作；情境事件放入其發生時間所在時間片的第一個分段
+    """
+    slices = max(1, math.ceil(duration / SLICE_SECONDS))
+    injected = {}
+    for footprint in footprints:
+        for record in footprint.records:
+            when = datetime.datetime.fromisoformat(record['eventTime'].replace('Z', '+00:00')).timestamp()
+            key = (record['awsRegion'], min(int((when - start) // SLICE_SECONDS), slices - 1))
+            injected.setdefault(key, []).append(record)
+
+    total_weight = sum(REGION_WEIGHTS.values())
+    for region, weight in REGION_WEIGHTS.items():
+        region_events = round(events * weight / total_weight)
+        pieces, pending = [], 0
+        for index in range(slices):
+            count = region_events // slices + (1 if index < region_events % slices else 0)
+            extra = injected.get((region, index), [])
+            if not count and not extra:
+                continue
+            parts = max(1, math.ceil(count / events_per_file))
+            for part in range(parts):
+                part_count = count // parts + (1 if part < count % parts else 0)
+                pieces.append((start + index * SLICE_SECONDS, part, parts, part_count, extra if part == 0 else []))
+                pending += part_count
+                if pending >= events_per_file:
+                    yield seed, output, output_format, region, principals, delivery_delay, pieces
+                    pieces, pending = [], 0
+        if pieces:
+            yield seed, output, output_format, region, principals, delivery_delay, pieces
+
+
+def write_manifests(output, footprints):
+    """每次情境執行的 API 清單（common.manifest 格式）與 synth_runs.json"""
+    directory = os.path.join(output, 'manifests')
+    os.makedirs(directory, exist_ok=True)
+    runs = []
+    for footprint in footprints:
+        path = os.path.join(directory, manifest_path(footprint.run_id))
+        # ResourceJournal 以附加模式開啟；同一個 seed 重新產生時覆寫
+        if os.path.exists(path):
+            os.remove(path)
+        with ResourceJournal(path) as journal:
+            journal.append({'type': 'manifest', 'run_id': footprint.run_id, 'scenario': footprint.scenario,
+                            'ts': footprint.start})
+            for call in footprint.calls:
+                journal.append(call)
+        runs.append({'scenario': footprint.scenario, 'run_id': footprint.run_id, 'start': footprint.start,
+                     'end': footprint.now, 'events': len(footprint.records), 'manifest': path})
+    with open(os.path.join(output, 'synth_runs.json'), 'w') as file:
+        json.dump(runs, file, indent=2)
+    return runs
+
+
+def generate(output, events, start, duration=86400, seed=0, scenarios=tuple(FOOTPRINTS), output_format='gzip',
+             events_per_file=EVENTS_PER_FILE, principals=BACKGROUND_PRINCIPALS, max_workers=None, window=None,
+             delivery_delay=DELIVERY_DELAY, footprints=None):
+    """
+    產生 events 筆背景流量並混入各情境的事件；每個工作最多 events_per_file 筆，
+    同時進行中的工作不超過 window 個，記憶體用量固定。回傳寫出的事件數與情境執行清單。
+    footprints 為已建立的 Footprint（例如從實際 CloudTrail 擷取的一次執行），指定時忽略 scenarios
+    """
+    if footprints is None:
+        footprints = build_footprints(seed, start, duration, scenarios)
+    tasks = plan_tasks(seed, output, output_format, events, start, duration, events_per_file, principals, footprints,
+                       delivery_delay)
+    max_workers = max_workers or os.cpu_count() or 1
+    window = window or max_workers * 2
+    written = 0
+    if max_workers == 1:
+        written = sum(write_part(task) for task in tasks)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+            pending = set()
+            for task in tasks:
+                pending.add(executor.submit(write_part, task))
+                if len(pending) >= window:
+                    done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    written += sum(future.result() for future in done)
+            written += sum(future.result() for future in concurrent.futures.as_completed(pending))
+    return written, write_manifests(output, footprints)
+
+
+def parse_time(value):
+    return datetime.datetime.fromisoformat(value.replace('Z', '+00:00')).replace(
+        tzinfo=datetime.timezone.utc).timestamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic CloudTrail corpus with scenario footprints.")
+    parser.add_argument('output', help="output directory (AWSLogs/ or store/, plus manifests/ and synth_runs.json)")
+    parser.add_argument('--events', type=int, default=1000000, help="number of background events")
+    parser.add_argument('--start', type=parse_time, default=SYNTH_START)
+    parser.add_argument('--hours', type=float, default=24)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scenarios', nargs='*', default=list(FOOTPRINTS), choices=sorted(FOOTPRINTS))
+    parser.add_argument('--format', choices=['gzip', 'parquet'], default='gzip')
+    parser.add_argument('--events-per-file', type=int, default=EVENTS_PER_FILE)
+    parser.add_argument('--principals', type=int, default=BACKGROUND_PRINCIPALS)
+    parser.add_argument('--delivery-delay', type=float, nargs=2, default=DELIVERY_DELAY, metavar=('MIN', 'MAX'),
+                        help="seconds after the end of each 5-minute slice that its log file is delivered")
+    parser.add_argument('--workers', type=int)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    written, runs = generate(args.output, args.events, args.start, args.hours * 3600, args.seed, args.scenarios,
+                             args.format, args.events_per_file, args.principals, args.workers,
+                             delivery_delay=tuple(args.delivery_delay))
+    elapsed = time.perf_counter() - started
+    print(f"Wrote {written} events in {elapsed:.2f}s ({written / elapsed:.0f} events/s).")
+    for run in runs:
+        print(f"{run['scenario']}: run {run['run_id']}, {run['events']} events from {iso_time(run['start'])}")
+
+
+if __name__ == "__main__":
+    main()
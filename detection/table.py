@@ -0,0 +1,217 @@
+import array
+import collections
+import fnmatch
+import json
+import sys
+
+from detection.reader import parse_event_time
+
+# 以整數代碼儲存的欄位（重複值多，透過 Interner 共用同一份字串）
+CODED_COLUMNS = ('eventName', 'eventSource', 'awsRegion', 'principal', 'accessKeyId',
+                 'sourceIPAddress', 'errorCode')
+
+# 預設保留為 JSON 字串的少見欄位；只有非空值才會佔用記憶體
+DEFAULT_EXTRA_FIELDS = ('requestParameters', 'responseElements', 'errorMessage')
+
+# detection.reader.Event 的欄位名稱與表格欄位的對應
+EVENT_COLUMNS = {
+    'userIdentity_arn': 'principal',
+    'userIdentity_accessKeyId': 'accessKeyId'
+}
+
+
+def principal_of(record):
+    """事件的主體：優先使用 ARN，AWS 服務呼叫使用 invokedBy，其餘以 principalId 或類型代替"""
+    identity = record.get('userIdentity') or {}
+    return (identity.get('arn') or identity.get('invokedBy') or identity.get('principalId')
+            or identity.get('type'))
+
+
+class Interner:
+    """字串與連續整數代碼的雙向對照；代碼 0 保留給 None"""
+
+    def __init__(self):
+        self.values = [None]
+        self.codes = {None: 0}
+
+    def intern(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def code(self, value):
+        # 不存在的值回傳 -1，篩選時不會符合任何列
+        return self.codes.get(value, -1)
+
+    def matching(self, pattern):
+        """符合萬用字元樣式的所有代碼；只掃描不重複的值"""
+        return {code for code, value in enumerate(self.values)
+                if value is not None and fnmatch.fnmatchcase(value, pattern)}
+
+    def __len__(self):
+        return len(self.values)
+
+
+class EventTable:
+    """
+    精簡的事件表：時間以 array('d') 儲存，CODED_COLUMNS 以 array('i') 儲存 Interner 代碼，
+    requestID 以 list 儲存，少見欄位以 {列號: JSON 字串} 稀疏保存。
+    每列約一百多位元組，相較巢狀 dict 的數 KB 可容納十倍以上的事件。
+    """
+
+    def __init__(self, extra_fields=DEFAULT_EXTRA_FIELDS, interners=None):
+        self.extra_fields = tuple(extra_fields)
+        # 子表與原表共用 Interner，代碼可直接比較
+        self.interners = interners or {column: Interner() for column in CODED_COLUMNS}
+        self.times = array.array('d')
+        self.columns = {column: array.array('i') for column in CODED_COLUMNS}
+        self.request_ids = []
+        self.extras = {field: {} for field in self.extra_fields}
+
+    @classmethod
+    def from_records(cls, records, **kwargs):
+        table = cls(**kwargs)
+        for record in records:
+            table.add_record(record)
+        return table
+
+    @classmethod
+    def from_events(cls, events, **kwargs):
+        table = cls(**kwargs)
+        for event in events:
+            table.add_event(event)
+        return table
+
+    def __len__(self):
+        return len(self.times)
+
+    def _append(self, when, values, request_id, extras):
+        row = len(self.times)
+        self.times.append(when if when is not None else 0.0)
+        for column in CODED_COLUMNS:
+            self.columns[column].append(self.interners[column].intern(values.get(column)))
+        self.request_ids.append(request_id)
+        for field, value in extras:
+            if value:
+                self.extras[field][row] = value if isinstance(value, str) else json.dumps(value, separators=(',', ':'))
+        return row
+
+    def add_record(self, record):
+        """加入一筆原始 CloudTrail 記錄（detection.reader.iter_records 產生的 dict）"""
+        identity = record.get('userIdentity') or {}
+        values = {
+            'eventName': record.get('eventName'),
+            'eventSource': record.get('eventSource'),
+            'awsRegion': record.get('awsRegion'),
+            'principal': principal_of(record),
+            'accessKeyId': identity.get('accessKeyId'),
+            'sourceIPAddress': record.get('sourceIPAddress'),
+            'errorCode': record.get('errorCode')
+        }
+        extras = [(field, record.get(field)) for field in self.extra_fields]
+        return self._append(parse_event_time(record.get('eventTime')), values, record.get('requestID'), extras)
+
+    def add_event(self, event):
+        """加入一筆 detection.reader 投影後的 Event；未投影的欄位視為 None"""
+        fields = event._asdict()
+        values = {EVENT_COLUMNS.get(name, name): value for name, value in fields.items()}
+        extras = [(field, fields.get(field)) for field in self.extra_fields]
+        return self._append(fields.get('eventTime'), values, fields.get('requestID'), extras)
+
+    def value(self, column, row):
+        if column == 'eventTime':
+            return self.times[row]
+        if column == 'requestID':
+            return self.request_ids[row]
+        if column in self.extras:
+            raw = self.extras[column].get(row)
+            return json.loads(raw) if raw else None
+        return self.interners[column].values[self.columns[column][row]]
+
+    def row(self, row):
+        """解碼單列為 dict"""
+        result = {'eventTime': self.times[row], 'requestID': self.request_ids[row]}
+        for column in CODED_COLUMNS:
+            result[column] = self.interners[column].values[self.columns[column][row]]
+        for field in self.extra_fields:
+            result[field] = self.value(field, row)
+        return result
+
+    def _codes(self, column, condition):
+        interner = self.interners[column]
+        if isinstance(condition, str):
+            if any(char in condition for char in '*?['):
+                return interner.matching(condition)
+            return {interner.code(condition)}
+        if condition is None:
+            return {0}
+        return {interner.code(value) for value in condition}
+
+    def select(self, rows=None, start=None, end=None, **conditions):
+        """
+        回傳符合條件的列號 array('l')。條件為欄位=值、值的集合或萬用字元樣式
+        （例如 principal='*nested_user_*'）；start / end 為 eventTime 範圍（epoch 秒，含 start 不含 end）。
+        條件先轉成代碼集合，逐列只比較整數
+        """
+        checks = [(self.columns[column], self._codes(column, condition))
+                  for column, condition in conditions.items()]
+        # 先比對最可能排除最多列的條件
+        checks.sort(key=lambda check: len(check[1]))
+        times = self.times
+        candidates = range(len(self)) if rows is None else rows
+        selected = array.array('l')
+        for row in candidates:
+            if start is not None and times[row] < start:
+                continue
+            if end is not None and times[row] >= end:
+                continue
+            if all(codes[row] in allowed for codes, allowed in checks):
+                selected.append(row)
+        return selected
+
+    def take(self, rows):
+        """以列號建立子表（共用 Interner）"""
+        table = EventTable(self.extra_fields, self.interners)
+        for row in rows:
+            table.times.append(self.times[row])
+            for column in CODED_COLUMNS:
+                table.columns[column].append(self.columns[column][row])
+            table.request_ids.append(self.request_ids[row])
+            for field in self.extra_fields:
+                if row in self.extras[field]:
+                    table.extras[field][len(table) - 1] = self.extras[field][row]
+        return table
+
+    def group_count(self, *columns, rows=None):
+        """依欄位分組計數，回傳 Counter{(值, ...): 次數}；計數時只用代碼，最後才解碼"""
+        arrays = [self.columns[column] for column in columns]
+        candidates = range(len(self)) if rows is None else rows
+        counts = collections.Counter(tuple(codes[row] for codes in arrays) for row in candidates)
+        interners = [self.interners[column].values for column in columns]
+        return collections.Counter({
+            tuple(values[code] for values, code in zip(interners, key)): count
+            for key, count in counts.items()
+        })
+
+    def group_rows(self, column, rows=None):
+        """依單一欄位分組，回傳 {值: array('l') 列號}"""
+        codes = self.columns[column]
+        groups = collections.defaultdict(lambda: array.array('l'))
+        for row in (range(len(self)) if rows is None else rows):
+            groups[codes[row]].append(row)
+        values = self.interners[column].values
+        return {values[code]: group for code, group in groups.items()}
+
+    def memory_usage(self):
+        """估計使用的位元組數（字串表與稀疏欄位一併計入）"""
+        total = self.times.buffer_info()[1] * self.times.itemsize
+        total += sum(codes.buffer_info()[1] * codes.itemsize for codes in self.columns.values())
+        total += sys.getsizeof(self.request_ids) + sum(sys.getsizeof(value) for value in self.request_ids)
+        for interner in self.interners.values():
+            total += sys.getsizeof(interner.values) + sys.getsizeof(interner.codes)
+            total += sum(sys.getsizeof(value) for value in interner.values)
+        for extras in self.extras.values():
+            total += sys.getsizeof(extras) + sum(sys.getsizeof(value) for value in extras.values())
+        return total
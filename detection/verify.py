@@ -0,0 +1,254 @@
+import argparse
+import collections
+import datetime
+import fnmatch
+import json
+import statistics
+import sys
+
+from common.manifest import load_manifest_index
+from detection.reader import parse_date, read_events
+
+# 驗證需要的欄位
+VERIFY_FIELDS = ('eventTime', 'eventSource', 'eventName', 'awsRegion', 'userIdentity.arn', 'requestID',
+                 'errorCode', 'requestParameters')
+
+IAM = 'iam.amazonaws.com'
+EC2 = 'ec2.amazonaws.com'
+LAMBDA = 'lambda.amazonaws.com'
+STS = 'sts.amazonaws.com'
+SECRETS_MANAGER = 'secretsmanager.amazonaws.com'
+
+ADMIN_POLICY = '*AdministratorAccess'
+
+# source / name 為 CloudTrail 的 eventSource / eventName；
+# parameters 比對 requestParameters 的值（支援萬用字元，{run_id} 會被替換）；
+# min_regions 要求事件出現在至少幾個區域
+Expectation = collections.namedtuple('Expectation', ['source', 'name', 'min_count', 'parameters', 'min_regions'],
+                                     defaults=(1, None, 1))
+
+NESTED_USER_EXPECTATIONS = [
+    Expectation(IAM, 'CreateUser', parameters={'userName': 'nested_user_{run_id}_*'}),
+    Expectation(IAM, 'CreateAccessKey', parameters={'userName': 'nested_user_{run_id}_*'}),
+    Expectation(IAM, 'AttachUserPolicy', parameters={'userName': 'nested_user_{run_id}_*', 'policyArn': ADMIN_POLICY})
+]
+
+LAMBDA_EXPECTATIONS = [
+    Expectation(IAM, 'CreateRole', parameters={'roleName': 'MyLambdaExecutionRole-{run_id}'}),
+    Expectation(IAM, 'AttachRolePolicy', parameters={'roleName': 'MyLambdaExecutionRole-{run_id}',
+                                                     'policyArn': ADMIN_POLICY}),
+    Expectation(LAMBDA, 'CreateFunction20150331', parameters={'functionName': 'MyLambdaFunctionLoop*-{run_id}'})
+]
+
+FEDERATION_EXPECTATIONS = [
+    Expectation(STS, 'GetFederationToken', parameters={'name': 'ft_nested_user_{run_id}_*'}),
+    Expectation(IAM, 'CreateUser', parameters={'userName': 'ft_nested_user_{run_id}_*'}),
+    Expectation(IAM, 'CreateAccessKey', parameters={'userName': 'ft_nested_user_{run_id}_*'}),
+    Expectation(IAM, 'AttachUserPolicy', parameters={'userName': 'ft_nested_user_{run_id}_*', 'policyArn': ADMIN_POLICY})
+]
+
+# 各情境的預期事件與允許出現（不列為異常）的其他事件
+SCENARIOS = {
+    'ec2-backdoor-by-assume-role': {
+        'expect': [
+            Expectation(IAM, 'CreateRole', parameters={'roleName': 'EC2TestRole-{run_id}'}),
+            Expectation(IAM, 'AttachRolePolicy', parameters={'roleName': 'EC2TestRole-{run_id}',
+                                                             'policyArn': ADMIN_POLICY}),
+            Expectation(IAM, 'CreateInstanceProfile', parameters={'instanceProfileName': 'EC2TestProfile-{run_id}'}),
+            Expectation(IAM, 'AddRoleToInstanceProfile', parameters={'roleName': 'EC2TestRole-{run_id}'}),
+            Expectation(EC2, 'CreateKeyPair'),
+            Expectation(EC2, 'RunInstances')
+        ],
+        'allow': {(IAM, 'GetRole'), (IAM, 'GetInstanceProfile'), (EC2, 'DescribeInstances'), (EC2, 'CreateTags')}
+    },
+    'aksk-loop': {
+        'expect': NESTED_USER_EXPECTATIONS,
+        'allow': {(IAM, 'ListUsers'), (IAM, 'DeleteAccessKey'), (IAM, 'DeleteUser')}
+    },
+    'aksk-loop-muti-lambda': {
+        'expect': LAMBDA_EXPECTATIONS + NESTED_USER_EXPECTATIONS,
+        'allow': {(IAM, 'ListUsers'), (IAM, 'DeleteAccessKey'), (IAM, 'DeleteUser'), (STS, 'AssumeRole'),
+                  (LAMBDA, 'GetFunction20150331v2'), (LAMBDA, 'Invoke')}
+    },
+    'aksk-loop-one-lambda': {
+        'expect': LAMBDA_EXPECTATIONS + NESTED_USER_EXPECTATIONS,
+        'allow': {(IAM, 'ListUsers'), (IAM, 'DeleteAccessKey'), (IAM, 'DeleteUser'), (STS, 'AssumeRole'),
+                  (LAMBDA, 'GetFunction20150331v2'), (LAMBDA, 'Invoke')}
+    },
+    'muti-get-secrets': {
+        'expect': [
+            Expectation(SECRETS_MANAGER, 'ListSecrets', min_regions=2),
+            Expectation(SECRETS_MANAGER, 'GetSecretValue', min_regions=2)
+        ],
+        'allow': set()
+    },
+    'federation-token': {
+        'expect': FEDERATION_EXPECTATIONS,
+        'allow': {(IAM, 'DeleteAccessKey')}
+    },
+    'federation-token-v2': {
+        'expect': FEDERATION_EXPECTATIONS,
+        'allow': set()
+    }
+}
+
+# CloudTrail 送達延遲通常在 15 分鐘內，執行當天之後多讀一天
+DELIVERY_SLACK_DAYS = 1
+
+
+def _format_parameters(parameters, run_id):
+    if not parameters:
+        return None
+    return {key: pattern.format(run_id=run_id) for key, pattern in parameters.items()}
+
+
+def _parameters_match(expected, request_parameters):
+    if not expected:
+        return True
+    if not request_parameters:
+        return False
+    parameters = json.loads(request_parameters)
+    return all(fnmatch.fnmatchcase(str(parameters.get(key, '')), pattern) for key, pattern in expected.items())
+
+
+def _latency_summary(latencies):
+    if not latencies:
+        return None
+    return {'p50': round(statistics.median(latencies), 1), 'max': round(max(latencies), 1)}
+
+
+def verify_run(root, scenario, run_id, manifest=None, **read_options):
+    """
+    以單次串流比對 CloudTrail 與情境的預期事件。
+    屬於這次執行的事件：requestID 出現在 API 清單（common.manifest）中，或主體 / 請求參數含有 run_id
+    （Lambda 內建立的巢狀使用者等不經過本機的呼叫）。
+    每筆事件只做兩次雜湊查詢：(eventSource, eventName) 找預期項目、requestID 找 API 清單。
+    read_options 傳給 detection.reader.read_events；未指定日期時依 API 清單的開始時間決定範圍
+    """
+    spec = SCENARIOS[scenario]
+    expectations = list(spec['expect'])
+    by_key = collections.defaultdict(list)
+    for index, expectation in enumerate(expectations):
+        by_key[(expectation.source, expectation.name)].append(
+            (index, _format_parameters(expectation.parameters, run_id)))
+    allowed = spec['allow']
+
+    by_request_id = {}
+    if manifest:
+        header, by_request_id, _ = load_manifest_index(manifest)
+        if header and 'start_date' not in read_options:
+            started = datetime.datetime.fromtimestamp(header['ts'], datetime.timezone.utc).date()
+            read_options['start_date'] = started
+            read_options.setdefault('end_date', started + datetime.timedelta(days=DELIVERY_SLACK_DAYS))
+
+    counts = [0] * len(expectations)
+    failures = [0] * len(expectations)
+    regions = [set() for _ in expectations]
+    log_latencies = [[] for _ in expectations]
+    call_latencies = [[] for _ in expectations]
+    first_seen = [None] * len(expectations)
+    unexpected = collections.Counter()
+    seen_request_ids = set()
+
+    for event in read_events(root, VERIFY_FIELDS, **read_options):
+        call = by_request_id.get(event.requestID)
+        if call is None and run_id not in (event.userIdentity_arn or '') \
+                and run_id not in (event.requestParameters or ''):
+            continue
+        if call is not None:
+            seen_request_ids.add(event.requestID)
+
+        key = (event.eventSource, event.eventName)
+        matched = False
+        for index, parameters in by_key.get(key, ()):
+            if not _parameters_match(parameters, event.requestParameters):
+                continue
+            matched = True
+            if event.errorCode:
+                failures[index] += 1
+                continue
+            counts[index] += 1
+            regions[index].add(event.awsRegion)
+            if first_seen[index] is None or event.eventTime < first_seen[index]:
+                first_seen[index] = event.eventTime
+            if event.deliveryTime and event.eventTime:
+                log_latencies[index].append(max(event.deliveryTime - event.eventTime, 0.0))
+            if event.deliveryTime and call is not None:
+                call_latencies[index].append(max(event.deliveryTime - call['ts'], 0.0))
+        if not matched and key not in allowed:
+            unexpected[key] += 1
+
+    results = []
+    for index, expectation in enumerate(expectations):
+        satisfied = counts[index] >= expectation.min_count and len(regions[index]) >= expectation.min_regions
+        results.append({
+            'source': expectation.source,
+            'name': expectation.name,
+            'satisfied': satisfied,
+            'count': counts[index],
+            'failed': failures[index],
+            'regions': sorted(regions[index]),
+            'first_seen': first_seen[index],
+            'log_latency': _latency_summary(log_latencies[index]),
+            'call_to_log_latency': _latency_summary(call_latencies[index])
+        })
+
+    # API 清單中有請求 ID、但 CloudTrail 沒有的呼叫（資料事件或遺漏的日誌）
+    unlogged = collections.Counter(record['op'] for request_id, record in by_request_id.items()
+                                   if request_id not in seen_request_ids)
+    return {
+        'scenario': scenario,
+        'run_id': run_id,
+        'passed': all(result['satisfied'] for result in results),
+        'expectations': results,
+        'unexpected': [{'source': source, 'name': name, 'count': count}
+                       for (source, name), count in unexpected.most_common()],
+        'unlogged_calls': dict(unlogged.most_common())
+    }
+
+
+def print_verification_report(report):
+    for result in report['expectations']:
+        status = 'ok' if result['satisfied'] else 'missing'
+        latency = result['log_latency']
+        latency_text = f", log latency p50 {latency['p50']}s max {latency['max']}s" if latency else ''
+        print(f"[{status}] {result['source']} {result['name']}: {result['count']} events "
+              f"in {len(result['regions'])} region(s){latency_text}")
+        if result['failed']:
+            print(f"    {result['failed']} matching calls failed")
+    for entry in report['unexpected']:
+        print(f"[unexpected] {entry['source']} {entry['name']}: {entry['count']} events")
+    for op, count in report['unlogged_calls'].items():
+        print(f"[unlogged] {op}: {count} calls not found in CloudTrail")
+    print(f"Verification {'passed' if report['passed'] else 'failed'} for {report['scenario']} run {report['run_id']}.")
+    return report['passed']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check a scenario run against its expected CloudTrail events.")
+    parser.add_argument('root', help="directory containing AWSLogs/ (or any level below it)")
+    parser.add_argument('--scenario', required=True, choices=sorted(SCENARIOS))
+    parser.add_argument('--run-id', required=True)
+    parser.add_argument('--manifest', help="API call manifest of the run (api_manifest_<run_id>.jsonl)")
+    parser.add_argument('--regions', nargs='+')
+    parser.add_argument('--start-date', type=parse_date)
+    parser.add_argument('--end-date', type=parse_date)
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    args = parser.parse_args()
+
+    read_options = {'regions': args.regions}
+    if args.start_date:
+        read_options['start_date'] = args.start_date
+    if args.end_date:
+        read_options['end_date'] = args.end_date
+    report = verify_run(args.root, args.scenario, args.run_id, args.manifest, **read_options)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        passed = report['passed']
+    else:
+        passed = print_verification_report(report)
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
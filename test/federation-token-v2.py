@@ -1,9 +1,20 @@
 from datetime import datetime
+import os
+import sys
 import json
 import boto3
 import time
 import botocore.exceptions
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.clients import get_client, get_session
+from common.governor import backoff_delay
+from common.manifest import start_manifest
+from common.tagging import new_run_id, run_path, run_tags
+from common.waiters import WaitTimeout, wait_for
+
+SCENARIO = 'federation-token-v2'
+
 def json_serial(obj):
     """JSON serializer for objects not serializable by default json code"""
     if isinstance(obj, datetime):
@@ -34,11 +45,11 @@ def get_federation_token_with_wait(sts_client, user_name, duration_seconds=3600)
         print(f"Error getting federation token: {error}")
         return None
     
-def create_user_with_retry(iam_client, user_name, max_attempts=6, delay=10):
+def create_user_with_retry(iam_client, user_name, run_id, max_attempts=6, delay=10):
     attempts = 0
     while attempts < max_attempts:
         try:
-            iam_client.create_user(UserName=user_name)
+            iam_client.create_user(UserName=user_name, Path=run_path(run_id), Tags=run_tags(run_id, SCENARIO))
             print(f"User {user_name} created successfully.")
             return True
         except botocore.exceptions.ClientError as error:
@@ -48,14 +59,16 @@ def create_user_with_retry(iam_client, user_name, max_attempts=6, delay=10):
             else:
                 print(f"Error creating user {user_name}: {error}")
                 attempts += 1
-                time.sleep(delay)
+                # 指數退避加抖動，delay 為單次等待上限
+                time.sleep(backoff_delay(attempts, cap=delay))
     print(f"Failed to create user {user_name} after {max_attempts} attempts.")
     return False
 
-def create_account_and_keys(session):
-    iam_client = session.client('iam')
-    user_name = f"ft_nested_user_{int(time.time())}"
-    if create_user_with_retry(iam_client, user_name):
+def create_account_and_keys(session, run_id, hop):
+    iam_client = get_client('iam', session=session)
+    # 名稱含執行 ID 與層數；GetFederationToken 的 Name 上限為 32 字元
+    user_name = f"ft_nested_user_{run_id}_{hop}"
+    if create_user_with_retry(iam_client, user_name, run_id):
         access_key_response = iam_client.create_access_key(UserName=user_name)
         iam_client.attach_user_policy(
             UserName=user_name,
@@ -65,7 +78,7 @@ def create_account_and_keys(session):
     return None, None, None
 
 def test_access_key(access_key_id, secret_access_key,session_token):
-    client = boto3.client(
+    client = get_client(
         'ec2',
         region_name='us-east-1',
         aws_access_key_id=access_key_id,
@@ -83,23 +96,28 @@ def test_access_key(access_key_id, secret_access_key,session_token):
             print(f'query_last_station_tdx: {e}')
             return False
     
-def wait_for_key_activation(access_key_id, secret_access_key, session_token, max_attempts=6, delay=10):
-    for _ in range(max_attempts):
-        if test_access_key(access_key_id, secret_access_key,session_token):
-            return True
-        time.sleep(delay)  # 等待一段時間後重試
-    return False
+def wait_for_key_activation(access_key_id, secret_access_key, session_token, timeout=60):
+    # 從短間隔開始指數退避輪詢，金鑰生效後立即繼續
+    try:
+        return wait_for(lambda: test_access_key(access_key_id, secret_access_key, session_token),
+                        timeout=timeout, description=f"access key {access_key_id}")
+    except WaitTimeout:
+        return False
 
 def main():
-    session = boto3.Session(profile_name='harry-redteam')
+    session = get_session(profile_name='harry-redteam')
+    run_id = new_run_id()
+    print(f"Run ID: {run_id}")
+    start_manifest(run_id, SCENARIO)
     for i in range(3):
         print(f"Creating user {i+1}")
-        user_name, new_ak, new_sk, session_token = create_account_and_keys(session)
+        # 新使用者的存取金鑰是長期金鑰，沒有 session token
+        user_name, new_ak, new_sk = create_account_and_keys(session, run_id, i+1)
         if user_name and new_ak and new_sk:
             print(f"Waiting for new keys to activate for user {user_name}")
             if wait_for_key_activation(new_ak, new_sk, None):
                 print(f"Keys activated for user {user_name}")
-                sts_client = boto3.client('sts', aws_access_key_id=new_ak, aws_secret_access_key=new_sk,aws_session_token=session_token)
+                sts_client = get_client('sts', aws_access_key_id=new_ak, aws_secret_access_key=new_sk)
                 federation_token = get_federation_token_with_wait(sts_client, user_name)
                 if federation_token:
                     print("Federation token obtained successfully.")
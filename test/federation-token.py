@@ -1,8 +1,18 @@
+import os
+import sys
 import json
-import boto3
 import time
 import botocore.exceptions
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.clients import get_client, get_session
+from common.governor import backoff_delay
+from common.manifest import start_manifest
+from common.tagging import new_run_id, run_path, run_tags
+from common.waiters import WaitTimeout, wait_for
+
+SCENARIO = 'federation-token'
+
 def get_federation_token_with_wait(sts_client, user_name, duration_seconds=3600):
     # 定義一個更廣泛的政策
     admin_policy = {
@@ -27,11 +37,11 @@ def get_federation_token_with_wait(sts_client, user_name, duration_seconds=3600)
         print(f"Error getting federation token: {error}")
         return None
     
-def create_user_with_retry(iam_client, user_name, max_attempts=6, delay=10):
+def create_user_with_retry(iam_client, user_name, run_id, max_attempts=6, delay=10):
     attempts = 0
     while attempts < max_attempts:
         try:
-            iam_client.create_user(UserName=user_name)
+            iam_client.create_user(UserName=user_name, Path=run_path(run_id), Tags=run_tags(run_id, SCENARIO))
             print(f"User {user_name} created successfully.")
             return True
         except botocore.exceptions.ClientError as error:
@@ -41,30 +51,30 @@ def create_user_with_retry(iam_client, user_name, max_attempts=6, delay=10):
             else:
                 print(f"Error creating user {user_name}: {error}")
                 attempts += 1
-                time.sleep(delay)
+                # 指數退避加抖動，delay 為單次等待上限
+                time.sleep(backoff_delay(attempts, cap=delay))
     print(f"Failed to create user {user_name} after {max_attempts} attempts.")
     return False
 
-def create_account_and_keys(parent_access_key_id, parent_secret_access_key, session_token=None):
+def create_account_and_keys(parent_access_key_id, parent_secret_access_key, run_id, hop, session_token=None):
     print("Creating account and keys")
     print(f"parent_access_key_id: {parent_access_key_id}")
     print(f"parent_secret_access_key: {parent_secret_access_key}")
     print(f"session_token: {session_token}")
 
-    session = boto3.Session(
+    iam_client = get_client(
+        'iam',
         aws_access_key_id=parent_access_key_id,
         aws_secret_access_key=parent_secret_access_key,
         aws_session_token=session_token
         )
-    iam_resource = session.resource('iam')
-    iam_client = iam_resource.meta.client
 
 
-    # 創建用戶
-    user_name = f"ft_nested_user_{int(time.time())}"
+    # 創建用戶（名稱含執行 ID 與層數；GetFederationToken 的 Name 上限為 32 字元）
+    user_name = f"ft_nested_user_{run_id}_{hop}"
 
     # iam_client.create_user(UserName=user_name)
-    create_user_with_retry(iam_client, user_name)
+    create_user_with_retry(iam_client, user_name, run_id)
 
     # 創建存取金鑰和安全金鑰
     access_key_response = iam_client.create_access_key(UserName=user_name)
@@ -78,7 +88,7 @@ def create_account_and_keys(parent_access_key_id, parent_secret_access_key, sess
     )
 
     # 使用創建的存取金鑰產生聯盟令牌
-    sts_client = boto3.client(
+    sts_client = get_client(
         'sts',
         aws_access_key_id=access_key_id,
         aws_secret_access_key=secret_access_key
@@ -100,7 +110,7 @@ def create_account_and_keys(parent_access_key_id, parent_secret_access_key, sess
     # return user_name, access_key_id, secret_access_key
 
 def test_access_key(access_key_id, secret_access_key,session_token):
-    client = boto3.client(
+    client = get_client(
         'ec2',
         region_name='us-east-1',
         aws_access_key_id=access_key_id,
@@ -118,24 +128,29 @@ def test_access_key(access_key_id, secret_access_key,session_token):
             print(f'query_last_station_tdx: {e}')
             return False
     
-def wait_for_key_activation(access_key_id, secret_access_key, session_token, max_attempts=6, delay=10):
-    for _ in range(max_attempts):
-        if test_access_key(access_key_id, secret_access_key,session_token):
-            return True
-        time.sleep(delay)  # 等待一段時間後重試
-    return False
+def wait_for_key_activation(access_key_id, secret_access_key, session_token, timeout=60):
+    # 從短間隔開始指數退避輪詢，金鑰生效後立即繼續
+    try:
+        return wait_for(lambda: test_access_key(access_key_id, secret_access_key, session_token),
+                        timeout=timeout, description=f"access key {access_key_id}")
+    except WaitTimeout:
+        return False
 
 def main():
-    session = boto3.Session(profile_name='harry-redteam')
+    session = get_session(profile_name='harry-redteam')
     initial_access_key_id=session.get_credentials().access_key
     initial_secret_access_key=session.get_credentials().secret_key
     current_ak = initial_access_key_id
     current_sk = initial_secret_access_key
     session_token = None
 
+    run_id = new_run_id()
+    print(f"Run ID: {run_id}")
+    start_manifest(run_id, SCENARIO)
+
     for i in range(3):
         print(f"Creating user {i+1}")
-        user_name, new_ak, new_sk, session_token = create_account_and_keys(current_ak, current_sk, session_token)
+        user_name, new_ak, new_sk, session_token = create_account_and_keys(current_ak, current_sk, run_id, i+1, session_token)
         print(f"Waiting for new keys to activate for user {user_name}")
         print(f"new_ak: {new_ak}")
         print(f"new_sk: {new_sk}")
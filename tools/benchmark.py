@@ -0,0 +1,449 @@
+import argparse
+import collections
+import json
+import logging
+import os
+import platform
+import resource
+import runpy
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(ROOT)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from fault_proxy import FAULT_PROFILES, FaultProxy, load_fault_profile
+
+# fixture 建立的 Lambda 函數數量；seed-canary-secrets.py 建立的誘餌秘密數量與區域
+SEED_FUNCTIONS = 16
+SEED_SECRETS = 60
+SEED_SECRET_REGIONS = ['us-east-1', 'us-east-2', 'ap-southeast-1']
+
+# 每組情境依序執行的階段：script 為相對於專案根目錄的腳本，fixture 為本檔中的資料準備函數。
+# 同一組的所有階段在同一個工作目錄執行，情境腳本寫下的日誌可直接由復原腳本讀取。
+# aksk-loop-muti-lambda.py / aksk-loop-one-lambda.py 需要實際執行 Lambda，離線時改以 fixture
+# 建立相同的資源與日誌，只量測復原腳本。
+PAIRS = collections.OrderedDict([
+    ('ec2-backdoor-by-assume-role', [
+        {'phase': 'setup', 'script': 'Backdoor-an-IAM-Role/ec2-backdoor-by-assume-role.py'},
+        {'phase': 'recover', 'script': 'Backdoor-an-IAM-Role/ec2-backdoor-by-assume-role-recover.py'}
+    ]),
+    ('aksk-loop', [
+        {'phase': 'setup', 'script': 'Create-an-Access-Key-on-an-IAM-User/aksk-loop.py'},
+        {'phase': 'seed-muti-lambda', 'fixture': 'seed_muti_lambda'},
+        {'phase': 'recover', 'script': 'Create-an-Access-Key-on-an-IAM-User/aksk-loop-muti-lambda-recover.py'},
+        {'phase': 'sweep', 'script': 'tools/sweep-orphans.py', 'args': ['--execute', '--refresh']}
+    ]),
+    ('muti-get-secrets', [
+        {'phase': 'seed', 'script': 'Retrieve-a-High-Number-of-Secrets-Manager-secrets/seed-canary-secrets.py',
+         'args': ['--count', str(SEED_SECRETS), '--regions'] + SEED_SECRET_REGIONS},
+        {'phase': 'setup', 'script': 'Retrieve-a-High-Number-of-Secrets-Manager-secrets/muti-get-secrets.py'},
+        {'phase': 'recover', 'script': 'Retrieve-a-High-Number-of-Secrets-Manager-secrets/muti-get-secrets-recover.py'},
+        {'phase': 'teardown', 'script': 'Retrieve-a-High-Number-of-Secrets-Manager-secrets/seed-canary-secrets.py',
+         'args': ['--teardown']}
+    ]),
+    ('federation-token', [
+        {'phase': 'setup', 'script': 'test/federation-token.py'},
+        {'phase': 'setup-v2', 'script': 'test/federation-token-v2.py'},
+        {'phase': 'recover', 'script': 'tools/sweep-orphans.py', 'args': ['--execute', '--refresh']}
+    ])
+])
+
+PROFILES = ['harry-redteam', 'peace-key']
+
+PHASE_TIMEOUT = 900
+
+
+# ---- 子行程：執行單一階段 ----
+
+def count_api_calls(counter):
+    """包裝 BaseClient._make_api_call，依 service:Operation 計算呼叫與錯誤次數"""
+    import botocore.client
+
+    make_api_call = botocore.client.BaseClient._make_api_call
+
+    def counting_make_api_call(self, operation_name, api_params):
+        key = f"{self.meta.service_model.service_name}:{operation_name}"
+        counter['calls'][key] += 1
+        try:
+            return make_api_call(self, operation_name, api_params)
+        except Exception:
+            counter['errors'][key] += 1
+            raise
+
+    botocore.client.BaseClient._make_api_call = counting_make_api_call
+
+
+def seed_muti_lambda():
+    """建立 aksk-loop-muti-lambda.py 執行完成時會留下的角色、Lambda 函數、用戶與資源日誌"""
+    from common.clients import get_client
+    from common.journal import ResourceJournal
+    from common.tagging import new_run_id, run_path, run_tags, run_tag_dict
+    from common.waiters import retry_until_ready
+
+    scenario = 'aksk-loop-muti-lambda'
+    region = 'ap-southeast-1'
+    run_id = new_run_id()
+    iam_client = get_client('iam', profile_name='peace-key', governed=True)
+    lambda_client = get_client('lambda', region_name=region, profile_name='peace-key', governed=True)
+
+    with ResourceJournal('generated_resources.jsonl') as journal:
+        journal.record('run', run_id=run_id, scenario=scenario, region=region)
+        role_name = f"MyLambdaExecutionRole-{run_id}"
+        role_arn = iam_client.create_role(
+            RoleName=role_name,
+            Path=run_path(run_id),
+            AssumeRolePolicyDocument=json.dumps({
+                "Version": "2012-10-17",
+                "Statement": [{"Effect": "Allow", "Principal": {"Service": "lambda.amazonaws.com"},
+                               "Action": "sts:AssumeRole"}]
+            }),
+            Tags=run_tags(run_id, scenario)
+        )['Role']['Arn']
+        iam_client.attach_role_policy(RoleName=role_name, PolicyArn='arn:aws:iam::aws:policy/AdministratorAccess')
+        journal.record('role', role_name=role_name, role_arn=role_arn)
+
+        for hop in range(1, SEED_FUNCTIONS + 1):
+            function_name = f"MyLambdaFunctionLoop{hop}-{run_id}"
+            # 與情境腳本相同：角色傳遞完成前重試（使用 --faults 時會發生）
+            function_arn = retry_until_ready(
+                lambda: lambda_client.create_function(
+                    FunctionName=function_name,
+                    Runtime='python3.8',
+                    Role=role_arn,
+                    Handler='lambda_function.lambda_handler',
+                    Code={'ZipFile': seed_zip()},
+                    Tags=run_tag_dict(run_id, scenario)
+                ),
+                ['InvalidParameterValueException'], message='cannot be assumed', description=f"role {role_arn}"
+            )['FunctionArn']
+            journal.record('lambda_function', function_name=function_name, function_arn=function_arn)
+
+            # 實際情境中由 Lambda 建立的用戶，此處直接以 IAM 建立
+            user_name = f"nested_user_{run_id}_{hop}"
+            iam_client.create_user(UserName=user_name, Path=run_path(run_id), Tags=run_tags(run_id, scenario))
+            key = iam_client.create_access_key(UserName=user_name)['AccessKey']
+            iam_client.attach_user_policy(UserName=user_name, PolicyArn='arn:aws:iam::aws:policy/AdministratorAccess')
+            journal.record('iam_user', user_name=user_name, access_key_id=key['AccessKeyId'],
+                           secret_access_key=key['SecretAccessKey'])
+
+
+def seed_zip():
+    import io
+    import zipfile
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as zf:
+        zf.writestr('lambda_function.py', "def lambda_handler(event, context):\n    return event\n")
+    return buffer.getvalue()
+
+
+FIXTURES = {
+    'seed_muti_lambda': seed_muti_lambda
+}
+
+
+def peak_rss_kb():
+    """
+    本行程的記憶體峰值。子行程由 fork 建立時 ru_maxrss 會沿用主行程（含 moto）的峰值，
+    Linux 上改讀 exec 後重新計算的 VmHWM
+    """
+    try:
+        with open('/proc/self/status', 'r') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_phase(phase):
+    counter = {'calls': collections.Counter(), 'errors': collections.Counter()}
+    count_api_calls(counter)
+    baseline_rss_kb = peak_rss_kb()
+
+    status, error = 'ok', None
+    start = time.perf_counter()
+    try:
+        if 'fixture' in phase:
+            FIXTURES[phase['fixture']]()
+        else:
+            script = os.path.join(ROOT, phase['script'])
+            sys.argv = [script] + phase.get('args', [])
+            runpy.run_path(script, run_name='__main__')
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            status, error = 'error', f"SystemExit({e.code})"
+    except BaseException as e:
+        status, error = 'error', f"{type(e).__name__}: {e}"
+    wall_time = time.perf_counter() - start
+
+    return {
+        'status': status,
+        'error': error,
+        'wall_time': wall_time,
+        'api_calls': sum(counter['calls'].values()),
+        'api_errors': sum(counter['errors'].values()),
+        'calls_by_operation': dict(sorted(counter['calls'].items())),
+        'errors_by_operation': dict(sorted(counter['errors'].items())),
+        'baseline_rss_kb': baseline_rss_kb,
+        'peak_rss_kb': peak_rss_kb()
+    }
+
+
+def worker_main(phase_json, result_path):
+    result = run_phase(json.loads(phase_json))
+    # 腳本的輸出已導向記錄檔，結果另寫入檔案
+    with open(result_path, 'w') as file:
+        json.dump(result, file)
+
+
+# ---- 主行程：啟動本機替身、依序執行各階段 ----
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def patch_moto_filters():
+    """
+    moto 尚未實作 DescribeInstances 的 iam-instance-profile.arn 篩選（復原腳本以此找出後門執行個體），
+    在本機替身中補上含萬用字元的比對；moto 版本不相容時略過
+    """
+    try:
+        import fnmatch
+        import moto.ec2.utils as ec2_utils
+        from moto.ec2.models.instances import Instance
+    except ImportError:
+        return
+
+    def profile_arn(instance):
+        association = instance.ec2_backend.iam_instance_profile_associations.get(instance.id)
+        return association.iam_instance_profile.arn if association else None
+
+    if not hasattr(ec2_utils, 'filter_dict_attribute_mapping'):
+        return
+    Instance.benchmark_profile_arn = property(profile_arn)
+    ec2_utils.filter_dict_attribute_mapping.setdefault('iam-instance-profile.arn', 'benchmark_profile_arn')
+
+    value_in_filter_values = ec2_utils.instance_value_in_filter_values
+
+    def wildcard_value_in_filter_values(value, values):
+        if isinstance(value, str) and any('*' in v for v in values):
+            return any(fnmatch.fnmatchcase(value, v) for v in values)
+        return value_in_filter_values(value, values)
+
+    ec2_utils.instance_value_in_filter_values = wildcard_value_in_filter_values
+
+
+def start_stand_in():
+    try:
+        from moto.server import ThreadedMotoServer
+    except ImportError:
+        sys.exit("The benchmark needs moto with server support: pip install 'moto[server]'")
+
+    # 不輸出每個請求的存取記錄
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    # 情境腳本附加 AdministratorAccess，需要 AWS 受管政策
+    os.environ['MOTO_IAM_LOAD_MANAGED_POLICIES'] = 'true'
+    patch_moto_filters()
+    port = free_port()
+    server = ThreadedMotoServer(ip_address='127.0.0.1', port=port, verbose=False)
+    server.start()
+    return server, f"http://127.0.0.1:{port}"
+
+
+def reset_stand_in(endpoint):
+    import urllib.request
+
+    urllib.request.urlopen(urllib.request.Request(f"{endpoint}/moto-api/reset", method='POST')).read()
+
+
+def child_environment(endpoint, work_root):
+    config_path = os.path.join(work_root, 'aws-config')
+    with open(config_path, 'w') as file:
+        for profile in PROFILES:
+            file.write(f"[profile {profile}]\naws_access_key_id = testing\naws_secret_access_key = testing\n"
+                       f"region = us-east-1\n")
+    env = dict(os.environ)
+    for name in ('AWS_PROFILE', 'AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SESSION_TOKEN'):
+        env.pop(name, None)
+    env.update({
+        'AWS_ENDPOINT_URL': endpoint,
+        'AWS_CONFIG_FILE': config_path,
+        'AWS_SHARED_CREDENTIALS_FILE': os.path.join(work_root, 'aws-credentials'),
+        'AWS_DEFAULT_REGION': 'us-east-1',
+        'AWS_ACCESS_KEY_ID': 'testing',
+        'AWS_SECRET_ACCESS_KEY': 'testing',
+        'AWS_EC2_METADATA_DISABLED': 'true'
+    })
+    return env
+
+
+def run_phase_process(phase, work_dir, env):
+    result_path = os.path.join(work_dir, f".{phase['phase']}.result.json")
+    log_path = os.path.join(work_dir, f"{phase['phase']}.log")
+    start = time.perf_counter()
+    with open(log_path, 'w') as log:
+        try:
+            subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', json.dumps(phase), result_path],
+                           cwd=work_dir, env=env, stdout=log, stderr=subprocess.STDOUT, timeout=PHASE_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            pass
+    if not os.path.exists(result_path):
+        return {'status': 'error', 'error': f"worker did not finish, see {log_path}",
+                'wall_time': time.perf_counter() - start}
+    with open(result_path, 'r') as file:
+        result = json.load(file)
+    os.remove(result_path)
+    result['log'] = log_path
+    return result
+
+
+def summarize_samples(samples):
+    """每個階段保留所有樣本，wall_time 取最小值（最不受雜訊影響），其餘取最後一次"""
+    summary = dict(samples[-1])
+    # 任一次重複失敗，整個階段即視為失敗
+    errors = [sample for sample in samples if sample['status'] == 'error']
+    if errors:
+        summary['status'], summary['error'] = 'error', errors[-1]['error']
+    summary['wall_time'] = min(sample['wall_time'] for sample in samples)
+    summary['wall_time_samples'] = [sample['wall_time'] for sample in samples]
+    summary['peak_rss_kb'] = max(sample.get('peak_rss_kb', 0) for sample in samples)
+    return summary
+
+
+def fault_delta(before, after):
+    return {key: after[key] - before.get(key, 0) for key in after}
+
+
+def run_benchmark(pair_names, repeat, work_root, keep, faults=None):
+    server, endpoint = start_stand_in()
+    # 指定故障設定時，腳本經由故障注入代理連線（延遲、節流與最終一致性）
+    proxy = None
+    if faults:
+        proxy = FaultProxy(endpoint, load_fault_profile(faults)).start()
+    env = child_environment(proxy.endpoint if proxy else endpoint, work_root)
+    results = collections.OrderedDict()
+    try:
+        for pair_name in pair_names:
+            samples = collections.defaultdict(list)
+            for iteration in range(repeat):
+                # 每次重複前清空替身狀態，各組互不影響
+                reset_stand_in(endpoint)
+                work_dir = os.path.join(work_root, f"{pair_name}-{iteration}")
+                os.makedirs(work_dir)
+                for phase in PAIRS[pair_name]:
+                    before = proxy.state.snapshot() if proxy else None
+                    result = run_phase_process(phase, work_dir, env)
+                    if proxy:
+                        result['faults'] = fault_delta(before, proxy.state.snapshot())
+                    samples[phase['phase']].append(result)
+                    print(f"{pair_name:<30} {phase['phase']:<18} {result['status']:<6} "
+                          f"{result['wall_time']:8.3f}s {result.get('api_calls', 0):6d} calls "
+                          f"{result.get('peak_rss_kb', 0) / 1024:7.1f} MiB")
+                if not keep:
+                    shutil.rmtree(work_dir)
+            results[pair_name] = collections.OrderedDict(
+                (phase['phase'], summarize_samples(samples[phase['phase']])) for phase in PAIRS[pair_name])
+    finally:
+        if proxy:
+            proxy.stop()
+        server.stop()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment_info():
+    import boto3
+    import botocore
+    import moto
+
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'boto3': boto3.__version__,
+        'botocore': botocore.__version__,
+        'moto': moto.__version__
+    }
+
+
+def compare(baseline_path, results):
+    with open(baseline_path, 'r') as file:
+        baseline = json.load(file)
+    print(f"\nCompared with {baseline_path} ({(baseline.get('commit') or 'unknown')[:12]}):")
+    for pair_name, phases in results.items():
+        for phase_name, current in phases.items():
+            previous = baseline.get('pairs', {}).get(pair_name, {}).get(phase_name)
+            if previous is None:
+                print(f"{pair_name:<30} {phase_name:<18} (new)")
+                continue
+            time_delta = current['wall_time'] - previous['wall_time']
+            time_ratio = current['wall_time'] / previous['wall_time'] if previous['wall_time'] else float('inf')
+            calls_delta = current.get('api_calls', 0) - previous.get('api_calls', 0)
+            rss_delta = (current.get('peak_rss_kb', 0) - previous.get('peak_rss_kb', 0)) / 1024
+            print(f"{pair_name:<30} {phase_name:<18} {time_delta:+8.3f}s ({time_ratio:5.2f}x) "
+                  f"{calls_delta:+6d} calls {rss_delta:+7.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run each scenario/recover pair end to end against a local moto server and record "
+                    "wall time, API call counts and peak memory per phase.")
+    parser.add_argument('--pairs', nargs='+', choices=list(PAIRS), default=list(PAIRS))
+    parser.add_argument('--repeat', type=int, default=1, help="run each pair N times and keep the fastest")
+    parser.add_argument('--output', default='benchmark.json', help="where to write the JSON results")
+    parser.add_argument('--compare', help="previous results file to compare against")
+    parser.add_argument('--keep', action='store_true', help="keep the per-pair work directories and logs")
+    parser.add_argument('--faults', help="inject faults through tools/fault_proxy.py: a built-in profile "
+                                         f"({', '.join(FAULT_PROFILES)}) or a JSON profile path")
+    args = parser.parse_args()
+
+    work_root = tempfile.mkdtemp(prefix='cloud-attack-benchmark-')
+    started_at = time.time()
+    try:
+        results = run_benchmark(args.pairs, args.repeat, work_root, args.keep, args.faults)
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_root, ignore_errors=True)
+
+    report = {
+        'commit': git_commit(),
+        'started_at': started_at,
+        'repeat': args.repeat,
+        'faults': args.faults,
+        'environment': environment_info(),
+        'pairs': results
+    }
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {args.output}" + (f" (work directory {work_root})" if args.keep else ""))
+
+    if args.compare:
+        compare(args.compare, results)
+
+    failed = [f"{pair_name}/{phase_name}" for pair_name, phases in results.items()
+              for phase_name, summary in phases.items() if summary['status'] == 'error']
+    if failed:
+        print(f"{len(failed)} phases failed: {', '.join(failed)}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == '--worker':
+        worker_main(sys.argv[2], sys.argv[3])
+    else:
+        main()
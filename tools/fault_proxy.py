@@ -0,0 +1,427 @@
+import argparse
+import http.client
+import http.server
+import json
+import random
+import re
+import select
+import threading
+import time
+import urllib.parse
+import uuid
+
+# 內建的故障設定：
+#   latency     依 "服務:操作"、"服務"、"default" 順序查找延遲分佈
+#   throttle    同樣的查找順序，值為回傳節流錯誤的機率
+#   propagation 最終一致性的傳遞延遲（秒）：
+#     access_key       新存取金鑰建立後無法使用的時間（wait_for_key_activation 等待的情況）
+#     role             新角色無法被 Lambda 承擔的時間
+#     instance_profile 新 Instance Profile 無法用於 RunInstances 的時間
+#     lambda_pending   新 Lambda 函數維持 Pending 的時間
+FAULT_PROFILES = {
+    'clean': {},
+    'realistic': {
+        'seed': 0,
+        'latency': {
+            'default': {'distribution': 'lognormal', 'median_ms': 40, 'sigma': 0.5},
+            'iam': {'distribution': 'lognormal', 'median_ms': 120, 'sigma': 0.6},
+            'lambda:CreateFunction': {'distribution': 'lognormal', 'median_ms': 400, 'sigma': 0.4},
+            'ec2:RunInstances': {'distribution': 'lognormal', 'median_ms': 800, 'sigma': 0.3}
+        },
+        'throttle': {
+            'iam': 0.05,
+            'lambda': 0.02,
+            'ec2': 0.01
+        },
+        'propagation': {
+            'access_key': 6,
+            'role': 8,
+            'instance_profile': 8,
+            'lambda_pending': 4
+        }
+    }
+}
+
+# 以 Query 協定（Action=...）呼叫的服務；其餘以 X-Amz-Target（JSON）或 REST 路徑判斷操作
+QUERY_SERVICES = {'iam', 'sts', 'ec2'}
+
+# Lambda 為 REST 協定，依方法與路徑判斷操作
+LAMBDA_ROUTES = [
+    ('POST', re.compile(r'^/[\d-]+/functions/?$'), 'CreateFunction'),
+    ('GET', re.compile(r'^/[\d-]+/functions/?$'), 'ListFunctions'),
+    ('GET', re.compile(r'^/[\d-]+/functions/([^/]+)/configuration$'), 'GetFunctionConfiguration'),
+    ('PUT', re.compile(r'^/[\d-]+/functions/([^/]+)/configuration$'), 'UpdateFunctionConfiguration'),
+    ('PUT', re.compile(r'^/[\d-]+/functions/([^/]+)/code$'), 'UpdateFunctionCode'),
+    ('POST', re.compile(r'^/[\d-]+/functions/([^/]+)/invocations$'), 'Invoke'),
+    ('GET', re.compile(r'^/[\d-]+/functions/([^/]+)$'), 'GetFunction'),
+    ('DELETE', re.compile(r'^/[\d-]+/functions/([^/]+)$'), 'DeleteFunction')
+]
+
+THROTTLE_ERRORS = {
+    'iam': (400, 'Throttling'),
+    'sts': (400, 'Throttling'),
+    'ec2': (503, 'RequestLimitExceeded'),
+    'lambda': (429, 'TooManyRequestsException')
+}
+DEFAULT_THROTTLE_ERROR = (400, 'ThrottlingException')
+
+HOP_BY_HOP_HEADERS = {'connection', 'keep-alive', 'transfer-encoding', 'te', 'trailer', 'upgrade',
+                      'proxy-authorization', 'proxy-authenticate', 'content-length'}
+
+CREDENTIAL_PATTERN = re.compile(r'Credential=([^/,\s]+)/[^/]+/([^/]+)/([^/]+)/')
+
+
+def load_fault_profile(name_or_path):
+    if name_or_path in FAULT_PROFILES:
+        return FAULT_PROFILES[name_or_path]
+    with open(name_or_path, 'r') as file:
+        return json.load(file)
+
+
+class ParsedRequest:
+    """從簽章與內容判斷服務、操作、區域與呼叫者（存取金鑰 ID）"""
+
+    def __init__(self, method, path, headers, body):
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.body = body
+        self.access_key_id, self.region, self.service = None, None, None
+        match = CREDENTIAL_PATTERN.search(headers.get('Authorization', ''))
+        if match:
+            self.access_key_id, self.region, self.service = match.groups()
+        self.params = {}
+        self.operation = self._operation()
+
+    def _operation(self):
+        target = self.headers.get('X-Amz-Target')
+        if target:
+            return target.rsplit('.', 1)[-1]
+        if self.service in QUERY_SERVICES or self.headers.get('Content-Type', '').startswith(
+                'application/x-www-form-urlencoded'):
+            query = urllib.parse.urlsplit(self.path).query
+            self.params = dict(urllib.parse.parse_qsl(query))
+            self.params.update(urllib.parse.parse_qsl(self.body.decode('utf-8', 'replace')))
+            if 'Action' in self.params:
+                return self.params['Action']
+        if self.service == 'lambda':
+            path = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+            for method, pattern, operation in LAMBDA_ROUTES:
+                match = pattern.match(path)
+                if method == self.method and match:
+                    if match.groups():
+                        self.params['FunctionName'] = match.group(1)
+                    return operation
+        return self.method
+
+    def json_body(self):
+        try:
+            return json.loads(self.body or b'{}')
+        except ValueError:
+            return {}
+
+
+class FaultState:
+    """注入故障的設定、亂數與最終一致性狀態，可跨處理執行緒共用"""
+
+    def __init__(self, profile):
+        self.latency = profile.get('latency', {})
+        self.throttle = profile.get('throttle', {})
+        self.propagation = profile.get('propagation', {})
+        self._random = random.Random(profile.get('seed'))
+        self._lock = threading.Lock()
+        # 名稱/金鑰 -> 可用的時間（time.monotonic）
+        self._ready_at = {'access_key': {}, 'role': {}, 'instance_profile': {}, 'lambda_pending': {}}
+        self.stats = {'requests': 0, 'throttled': 0, 'propagation_errors': 0, 'pending_rewrites': 0,
+                      'injected_latency': 0.0}
+
+    def _lookup(self, table, request):
+        for key in (f"{request.service}:{request.operation}", request.service, 'default'):
+            if key in table:
+                return table[key]
+        return None
+
+    def sample_latency(self, request):
+        spec = self._lookup(self.latency, request)
+        if not spec:
+            return 0.0
+        with self._lock:
+            distribution = spec.get('distribution', 'fixed')
+            if distribution == 'lognormal':
+                delay_ms = self._random.lognormvariate(0, spec.get('sigma', 0.5)) * spec['median_ms']
+            elif distribution == 'uniform':
+                delay_ms = self._random.uniform(spec['min_ms'], spec['max_ms'])
+            elif distribution == 'exponential':
+                delay_ms = self._random.expovariate(1.0 / spec['mean_ms'])
+            else:
+                delay_ms = spec.get('ms', 0)
+            self.stats['injected_latency'] += delay_ms / 1000.0
+        return delay_ms / 1000.0
+
+    def should_throttle(self, request):
+        rate = self._lookup(self.throttle, request) or 0.0
+        with self._lock:
+            throttled = self._random.random() < rate
+            if throttled:
+                self.stats['throttled'] += 1
+        return throttled
+
+    def mark_created(self, kind, name):
+        delay = self.propagation.get(kind)
+        if delay and name:
+            with self._lock:
+                self._ready_at[kind][name] = time.monotonic() + delay
+
+    def not_ready(self, kind, name):
+        with self._lock:
+            ready_at = self._ready_at[kind].get(name)
+            if ready_at is None:
+                return False
+            if time.monotonic() >= ready_at:
+                del self._ready_at[kind][name]
+                return False
+            return True
+
+    def count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats)
+
+
+def error_response(request, status, code, message):
+    """依服務協定組出 botocore 能解析的錯誤回應"""
+    request_id = str(uuid.uuid4())
+    if request.service == 'ec2':
+        body = (f"<Response><Errors><Error><Code>{code}</Code><Message>{message}</Message></Error></Errors>"
+                f"<RequestID>{request_id}</RequestID></Response>")
+        return status, {'Content-Type': 'text/xml'}, body.encode()
+    if request.service in QUERY_SERVICES:
+        body = (f"<ErrorResponse><Error><Type>Sender</Type><Code>{code}</Code><Message>{message}</Message>"
+                f"</Error><RequestId>{request_id}</RequestId></ErrorResponse>")
+        return status, {'Content-Type': 'text/xml'}, body.encode()
+    headers = {'Content-Type': 'application/json', 'x-amzn-RequestId': request_id, 'x-amzn-ErrorType': code}
+    body = {'__type': code, 'message': message} if request.headers.get('X-Amz-Target') else {
+        'Type': 'User', 'message': message}
+    return status, headers, json.dumps(body).encode()
+
+
+def check_propagation(state, request):
+    """最終一致性：資源建立後、傳遞完成前使用它的請求回傳與 AWS 相同的錯誤"""
+    if request.access_key_id and state.not_ready('access_key', request.access_key_id):
+        state.count('propagation_errors')
+        if request.service == 'ec2':
+            return error_response(request, 401, 'AuthFailure',
+                                  "AWS was not able to validate the provided access credentials")
+        code = 'InvalidClientTokenId' if request.service in QUERY_SERVICES else 'UnrecognizedClientException'
+        return error_response(request, 403, code, "The security token included in the request is invalid.")
+
+    if request.service == 'lambda' and request.operation == 'CreateFunction':
+        role_name = request.json_body().get('Role', '').rsplit('/', 1)[-1]
+        if state.not_ready('role', role_name):
+            state.count('propagation_errors')
+            return error_response(request, 400, 'InvalidParameterValueException',
+                                  "The role defined for the function cannot be assumed by Lambda.")
+
+    if request.service == 'lambda' and request.operation in ('Invoke', 'UpdateFunctionCode',
+                                                            'UpdateFunctionConfiguration'):
+        function_name = request.params.get('FunctionName')
+        if state.not_ready('lambda_pending', function_name):
+            state.count('propagation_errors')
+            return error_response(request, 409, 'ResourceConflictException',
+                                  "The operation cannot be performed at this time. "
+                                  "The function is currently in the following state: Pending")
+
+    if request.service == 'ec2' and request.operation == 'RunInstances':
+        profile_name = request.params.get('IamInstanceProfile.Name')
+        if state.not_ready('instance_profile', profile_name):
+            state.count('propagation_errors')
+            return error_response(request, 400, 'InvalidParameterValue',
+                                  f"Value ({profile_name}) for parameter iamInstanceProfile.name is invalid. "
+                                  f"Invalid IAM Instance Profile name")
+    return None
+
+
+def record_creation(state, request, status, body):
+    """成功建立資源時開始計算傳遞延遲；Pending 中的 Lambda 函數改寫回應中的 State"""
+    if status >= 300:
+        return body
+    if request.service == 'iam':
+        if request.operation == 'CreateAccessKey':
+            match = re.search(rb'<AccessKeyId>([^<]+)</AccessKeyId>', body)
+            if match:
+                state.mark_created('access_key', match.group(1).decode())
+        elif request.operation == 'CreateRole':
+            state.mark_created('role', request.params.get('RoleName'))
+        elif request.operation in ('CreateInstanceProfile', 'AddRoleToInstanceProfile'):
+            state.mark_created('instance_profile', request.params.get('InstanceProfileName'))
+    elif request.service == 'lambda':
+        if request.operation == 'CreateFunction':
+            function_name = request.json_body().get('FunctionName')
+            state.mark_created('lambda_pending', function_name)
+            return rewrite_pending(state, body, top_level=True)
+        if request.operation in ('GetFunction', 'GetFunctionConfiguration'):
+            function_name = request.params.get('FunctionName')
+            if state.not_ready('lambda_pending', function_name):
+                return rewrite_pending(state, body, top_level=request.operation == 'GetFunctionConfiguration')
+    return body
+
+
+def rewrite_pending(state, body, top_level):
+    try:
+        document = json.loads(body)
+    except ValueError:
+        return body
+    configuration = document if top_level else document.get('Configuration', {})
+    configuration.update({'State': 'Pending', 'StateReason': 'The function is being created.',
+                          'StateReasonCode': 'Creating'})
+    state.count('pending_rewrites')
+    return json.dumps(document).encode()
+
+
+class FaultProxyHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _upstream_connection(self):
+        """
+        每個處理執行緒保留一條到上游的連線，回傳 (連線, 是否為重複使用的連線)。
+        閒置的連線若已可讀取（上游已關閉），先重新連線，避免把請求送到已關閉的連線
+        """
+        local = self.server.local
+        connection = getattr(local, 'connection', None)
+        if connection is not None and connection.sock is not None:
+            readable, _, _ = select.select([connection.sock], [], [], 0)
+            if readable:
+                connection.close()
+                connection = None
+        if connection is None or connection.sock is None:
+            if connection is not None:
+                connection.close()
+            local.connection = http.client.HTTPConnection(self.server.upstream.hostname,
+                                                         self.server.upstream.port, timeout=300)
+            return local.connection, False
+        return connection, True
+
+    def _forward(self, body):
+        """
+        轉送請求。只有重複使用的連線在送出請求時就失敗（上游尚未收到完整請求）才重送一次；
+        請求已送出後的錯誤（例如 getresponse() 的 RemoteDisconnected）可能發生在上游處理之後，
+        重送會讓 CreateUser 等非冪等的呼叫執行兩次，因此與真實端點一樣直接中斷連線
+        """
+        headers = {key: value for key, value in self.headers.items() if key.lower() not in HOP_BY_HOP_HEADERS}
+        while True:
+            connection, reused = self._upstream_connection()
+            try:
+                connection.request(self.command, self.path, body=body, headers=headers)
+            except (http.client.HTTPException, ConnectionError):
+                connection.close()
+                self.server.local.connection = None
+                if reused:
+                    continue
+                raise
+            try:
+                response = connection.getresponse()
+                return response.status, response.getheaders(), response.read()
+            except (http.client.HTTPException, ConnectionError):
+                connection.close()
+                self.server.local.connection = None
+                raise
+
+    def _send(self, status, headers, body):
+        self.send_response(status)
+        for key, value in headers:
+            if key.lower() not in HOP_BY_HOP_HEADERS:
+                self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        state = self.server.state
+
+        if self.path == '/_fault-proxy/stats':
+            self._send(200, [('Content-Type', 'application/json')], json.dumps(state.snapshot()).encode())
+            return
+
+        request = ParsedRequest(self.command, self.path, self.headers, body)
+        state.count('requests')
+        delay = state.sample_latency(request)
+        if delay:
+            time.sleep(delay)
+
+        injected = None
+        if state.should_throttle(request):
+            status, code = THROTTLE_ERRORS.get(request.service, DEFAULT_THROTTLE_ERROR)
+            injected = error_response(request, status, code, 'Rate exceeded')
+        else:
+            injected = check_propagation(state, request)
+        if injected is not None:
+            status, headers, response_body = injected
+            self._send(status, list(headers.items()), response_body)
+            return
+
+        status, headers, response_body = self._forward(body)
+        response_body = record_creation(state, request, status, response_body)
+        self._send(status, headers, response_body)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = do_PATCH = _handle
+
+
+class FaultProxy:
+    """在本機替身（moto server）前注入延遲、節流與最終一致性的 HTTP 反向代理"""
+
+    def __init__(self, upstream, profile, host='127.0.0.1', port=0):
+        self.server = http.server.ThreadingHTTPServer((host, port), FaultProxyHandler)
+        self.server.daemon_threads = True
+        self.server.upstream = urllib.parse.urlsplit(upstream)
+        self.server.state = FaultState(profile)
+        self.server.local = threading.local()
+        self._thread = None
+
+    @property
+    def endpoint(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fault-injection proxy in front of a local AWS stand-in.")
+    parser.add_argument('--upstream', required=True, help="stand-in endpoint, e.g. http://127.0.0.1:5000")
+    parser.add_argument('--port', type=int, default=5005)
+    parser.add_argument('--faults', default='realistic',
+                        help=f"built-in profile ({', '.join(FAULT_PROFILES)}) or path to a JSON profile")
+    args = parser.parse_args()
+
+    proxy = FaultProxy(args.upstream, load_fault_profile(args.faults), port=args.port).start()
+    print(f"Fault proxy listening on {proxy.endpoint} -> {args.upstream} (faults: {args.faults})")
+    print("Point scripts at it with AWS_ENDPOINT_URL; stats at /_fault-proxy/stats")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        proxy.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import argparse
+import concurrent.futures
+import fnmatch
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.clients import get_client, get_session
+from common.iam_snapshot import load_iam_snapshot, invalidate_iam_snapshot
+from common.tagging import find_tagged_arns, arn_resource, run_path
+from common.teardown import TeardownNode, run_teardown, print_teardown_report
+
+# 各情境留下、沒有清除腳本的資源名稱
+# aksk-loop.py / aksk-loop-one-lambda.py / aksk-loop-muti-lambda.py: nested_user_*
+# test/federation-token.py / federation-token-v2.py: ft_nested_user_*
+# 名稱可能帶有執行 ID 後綴（common.tagging）
+USER_PATTERNS = ['nested_user_*', 'ft_nested_user_*']
+ROLE_PATTERNS = ['MyLambdaExecutionRole', 'MyLambdaExecutionRole-*', 'EC2TestRole', 'EC2TestRole-*']
+INSTANCE_PROFILE_PATTERNS = ['EC2TestProfile', 'EC2TestProfile-*']
+FUNCTION_PATTERNS = ['MyLambdaFunctionLoop*']
+
+# aksk-loop-one-lambda.py 部署在 us-east-2，aksk-loop-muti-lambda.py 部署在 ap-southeast-1
+LAMBDA_REGIONS = ['us-east-2', 'ap-southeast-1']
+
+MAX_WORKERS = 16
+
+def matches(name, patterns):
+    return any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)
+
+class Selector:
+    """指定 run_id 時只選取該次執行的資源（IAM 以 Path、Lambda 以標籤），否則以名稱比對"""
+
+    def __init__(self, run_id=None):
+        self.run_id = run_id
+
+    def iam_entity(self, name, entity, patterns):
+        if self.run_id:
+            return entity.get('Path') == run_path(self.run_id)
+        return matches(name, patterns)
+
+def list_matching_functions(lambda_client):
+    function_names = []
+    paginator = lambda_client.get_paginator('list_functions')
+    for page in paginator.paginate():
+        for function in page['Functions']:
+            if matches(function['FunctionName'], FUNCTION_PATTERNS):
+                function_names.append(function['FunctionName'])
+    return function_names
+
+def list_run_functions(tagging_client, run_id):
+    # 以標籤直接查詢，不需列出區域內所有函數
+    arns = find_tagged_arns(tagging_client, run_id, ['lambda:function'])
+    return [arn_resource(arn)[2] for arn in arns]
+
+def find_orphan_functions(session, lambda_clients, run_id=None):
+    # 各區域同時查詢 Lambda 函數
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(lambda_clients) or 1) as executor:
+        if run_id:
+            futures = {executor.submit(list_run_functions,
+                                       get_client('resourcegroupstaggingapi', region_name=region,
+                                                  session=session, governed=True),
+                                       run_id): region
+                       for region in lambda_clients}
+        else:
+            futures = {executor.submit(list_matching_functions, client): region
+                       for region, client in lambda_clients.items()}
+        return {futures[future]: future.result() for future in concurrent.futures.as_completed(futures)}
+
+def clear_user_attachments(iam_client, snapshot, user):
+    user_name = user['UserName']
+    for policy_arn in snapshot.attached_policy_arns(user):
+        iam_client.detach_user_policy(UserName=user_name, PolicyArn=policy_arn)
+    for policy_name in snapshot.user_inline_policy_names(user):
+        iam_client.delete_user_policy(UserName=user_name, PolicyName=policy_name)
+    for group_name in user.get('GroupList', []):
+        iam_client.remove_user_from_group(UserName=user_name, GroupName=group_name)
+
+def delete_user_access_keys(iam_client, user_name):
+    # GetAccountAuthorizationDetails 不含存取金鑰，只能逐一列出
+    access_keys = iam_client.list_access_keys(UserName=user_name)
+    for key in access_keys.get('AccessKeyMetadata', []):
+        iam_client.delete_access_key(UserName=user_name, AccessKeyId=key['AccessKeyId'])
+
+def delete_user(iam_client, user_name):
+    iam_client.delete_user(UserName=user_name)
+    print(f"Deleted IAM user: {user_name}")
+
+def clear_role_policies(iam_client, snapshot, role):
+    role_name = role['RoleName']
+    for policy_arn in snapshot.attached_policy_arns(role):
+        iam_client.detach_role_policy(RoleName=role_name, PolicyArn=policy_arn)
+    for policy_name in snapshot.role_inline_policy_names(role):
+        iam_client.delete_role_policy(RoleName=role_name, PolicyName=policy_name)
+
+def remove_role_from_instance_profile(iam_client, profile_name, role_name):
+    iam_client.remove_role_from_instance_profile(InstanceProfileName=profile_name, RoleName=role_name)
+
+def delete_instance_profile(iam_client, profile_name):
+    iam_client.delete_instance_profile(InstanceProfileName=profile_name)
+    print(f"Deleted Instance Profile: {profile_name}")
+
+def delete_role(iam_client, role_name):
+    iam_client.delete_role(RoleName=role_name)
+    print(f"Deleted IAM role: {role_name}")
+
+def delete_function(lambda_client, function_name):
+    lambda_client.delete_function(FunctionName=function_name)
+    print(f"Deleted Lambda function: {function_name}")
+
+def build_sweep_graph(snapshot, functions_by_region, iam_client, lambda_clients, selector):
+    nodes = []
+
+    for user_name, user in snapshot.users.items():
+        if not selector.iam_entity(user_name, user, USER_PATTERNS):
+            continue
+        attachments_id = f"user-attachments:{user_name}"
+        keys_id = f"user-keys:{user_name}"
+        nodes.append(TeardownNode(attachments_id, lambda u=user: clear_user_attachments(iam_client, snapshot, u)))
+        nodes.append(TeardownNode(keys_id, lambda u=user_name: delete_user_access_keys(iam_client, u)))
+        nodes.append(TeardownNode(f"user:{user_name}", lambda u=user_name: delete_user(iam_client, u),
+                                  depends_on=[attachments_id, keys_id]))
+
+    function_ids = []
+    for region, function_names in functions_by_region.items():
+        for function_name in function_names:
+            function_id = f"function:{region}:{function_name}"
+            function_ids.append(function_id)
+            nodes.append(TeardownNode(function_id,
+                                      lambda c=lambda_clients[region], f=function_name: delete_function(c, f)))
+
+    profile_ids = set()
+    for role_name, role in snapshot.roles.items():
+        if not selector.iam_entity(role_name, role, ROLE_PATTERNS):
+            continue
+        policies_id = f"role-policies:{role_name}"
+        nodes.append(TeardownNode(policies_id, lambda r=role: clear_role_policies(iam_client, snapshot, r)))
+
+        # 角色須先從所有 Instance Profile 移除才能刪除
+        remove_ids = []
+        for profile_name in snapshot.role_instance_profile_names(role):
+            remove_id = f"profile-role:{profile_name}:{role_name}"
+            remove_ids.append(remove_id)
+            nodes.append(TeardownNode(
+                remove_id, lambda p=profile_name, r=role_name: remove_role_from_instance_profile(iam_client, p, r)))
+            profile = snapshot.instance_profiles[profile_name]
+            if (selector.iam_entity(profile_name, profile, INSTANCE_PROFILE_PATTERNS)
+                    and profile_name not in profile_ids):
+                profile_ids.add(profile_name)
+                nodes.append(TeardownNode(f"profile:{profile_name}",
+                                          lambda p=profile_name: delete_instance_profile(iam_client, p),
+                                          depends_on=[remove_id]))
+
+        # Lambda 函數先於執行角色刪除
+        nodes.append(TeardownNode(f"role:{role_name}", lambda r=role_name: delete_role(iam_client, r),
+                                  depends_on=[policies_id] + remove_ids + function_ids))
+
+    return nodes
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep resources left behind by the scenarios in this repo.")
+    parser.add_argument('--profile', default='harry-redteam')
+    parser.add_argument('--regions', nargs='+', default=LAMBDA_REGIONS, help="regions to search for Lambda functions")
+    parser.add_argument('--refresh', action='store_true', help="ignore the cached IAM snapshot")
+    parser.add_argument('--run-id', help="only select resources created by this run (by tag / IAM path)")
+    parser.add_argument('--execute', action='store_true', help="delete the resources (default only lists them)")
+    args = parser.parse_args()
+
+    session = get_session(profile_name=args.profile)
+    # 所有呼叫經過共用的速率控制器，大量刪除時不會因 IAM 節流而中途失敗
+    iam_client = get_client('iam', session=session, governed=True)
+    lambda_clients = {region: get_client('lambda', region_name=region, session=session, governed=True)
+                      for region in args.regions}
+
+    # IAM 以一次分頁的 GetAccountAuthorizationDetails 讀取並快取，Lambda 則各區域同時列出
+    snapshot = load_iam_snapshot(iam_client, refresh=args.refresh)
+    functions_by_region = find_orphan_functions(session, lambda_clients, args.run_id)
+
+    nodes = build_sweep_graph(snapshot, functions_by_region, iam_client, lambda_clients, Selector(args.run_id))
+    if not args.execute:
+        for node in nodes:
+            print(node.node_id)
+        print(f"{len(nodes)} teardown steps planned. Re-run with --execute to delete.")
+        return
+
+    results = run_teardown(nodes, max_workers=MAX_WORKERS)
+    invalidate_iam_snapshot()
+    print_teardown_report(results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+import argparse
+import collections
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(ROOT)
+from common.manifest import load_manifest_index
+from detection.daemon import LATENESS, StreamingDetector
+from detection.reader import iter_log_files, iter_records, parse_event_time
+from detection.rules import RULES, SCENARIO_RULES
+from detection.synth import (DELIVERY_DELAY, REGION_WEIGHTS, SLICE_SECONDS, SYNTH_START, Footprint,
+                             build_footprints, generate)
+
+# 技術目錄 → 合成產生器的情境與實際執行時 API 清單標頭中的情境名稱（test/ 為 federation token 情境）
+TECHNIQUES = collections.OrderedDict([
+    ('Backdoor-an-IAM-Role', {
+        'scenario': 'ec2-backdoor-by-assume-role',
+        'manifests': ('ec2-backdoor-by-assume-role',)
+    }),
+    ('Create-an-Access-Key-on-an-IAM-User', {
+        'scenario': 'aksk-loop',
+        'manifests': ('aksk-loop', 'aksk-loop-one-lambda', 'aksk-loop-muti-lambda')
+    }),
+    ('Retrieve-a-High-Number-of-Secrets-Manager-secrets', {
+        'scenario': 'muti-get-secrets',
+        'manifests': ('muti-get-secrets',)
+    }),
+    ('test', {
+        'scenario': 'federation-token',
+        'manifests': ('federation-token', 'federation-token-v2')
+    })
+])
+
+# 每個 5 分鐘時間片結束後、日誌檔送達前的額外延遲（秒）；typical 與 detection.synth 預設相同
+DELAY_PROFILES = collections.OrderedDict([
+    ('fast', (30, 120)),
+    ('typical', DELIVERY_DELAY),
+    ('slow', (300, 900))
+])
+
+# 視窗型規則可能在情境最後一個事件之後才達到門檻
+MATCH_SLACK = 600
+# 重播實際執行時，情境前後加入的背景時間
+MANIFEST_LEAD = 1800
+
+
+def technique_of(scenario):
+    for folder, technique in TECHNIQUES.items():
+        if scenario in technique['manifests']:
+            return folder
+    return None
+
+
+def summarize(values, digits=1):
+    if not values:
+        return None
+    return {'p50': round(statistics.median(values), digits), 'max': round(max(values), digits)}
+
+
+# ---- 情境來源：合成產生器或實際執行的 API 清單 ----
+
+def synth_footprint(scenario, seed, start, duration):
+    return build_footprints(seed, start, duration, [scenario])[0]
+
+
+def manifest_footprint(manifest, cloudtrail_root, seed=0):
+    """
+    從實際的 CloudTrail 匯出擷取一次執行的事件，建立可重新送達的 Footprint：
+    requestID 出現在 API 清單中，或主體 / 請求參數含有執行 ID（與 detection.verify 相同）
+    """
+    header, by_request_id, _ = load_manifest_index(manifest)
+    if not header:
+        raise ValueError(f"{manifest} has no header")
+    run_id = header['run_id']
+    started = datetime.datetime.fromtimestamp(header['ts'], datetime.timezone.utc).date()
+    records = []
+    for path in iter_log_files(cloudtrail_root, start_date=started, end_date=started + datetime.timedelta(days=1)):
+        for record in iter_records(path):
+            if record.get('requestID') in by_request_id \
+                    or run_id in (record.get('userIdentity') or {}).get('arn', '') \
+                    or run_id in json.dumps(record.get('requestParameters') or {}):
+                records.append(record)
+    if not records:
+        raise ValueError(f"no CloudTrail events of run {run_id} under {cloudtrail_root}")
+    records.sort(key=lambda record: record['eventTime'])
+    # 背景只涵蓋 REGION_WEIGHTS 中的區域，其他區域的事件無法送達
+    records = [record for record in records if record.get('awsRegion') in REGION_WEIGHTS]
+    footprint = Footprint(header.get('scenario'), run_id, parse_event_time(records[0]['eventTime']),
+                          random.Random(f"{seed}:{run_id}"))
+    footprint.records = records
+    footprint.calls = list(by_request_id.values())
+    footprint.now = parse_event_time(records[-1]['eventTime'])
+    return footprint
+
+
+# ---- 重播 ----
+
+def delivered_files(output):
+    """依送達時間（檔案 mtime）排序的日誌檔"""
+    paths = list(iter_log_files(output))
+    return sorted(paths, key=lambda path: (os.path.getmtime(path), path))
+
+
+def replay(paths, rules=RULES):
+    """
+    依送達順序逐檔交給 StreamingDetector，以虛擬時鐘記錄每個告警的偵測時間：
+    檔案送達時開始處理（前一個檔案尚未處理完則等待），偵測時間 = 開始時間 + 實際處理時間
+    """
+    detector = StreamingDetector(rules)
+    clock = None
+    detections = []
+    try:
+        for path in paths:
+            delivered = os.path.getmtime(path)
+            clock = delivered if clock is None else max(clock, delivered)
+            started = time.perf_counter()
+            alerts = detector.process([path])
+            clock += time.perf_counter() - started
+            detections.extend((alert, delivered, clock) for alert in alerts)
+        detections.extend((alert, None, clock) for alert in detector.flush())
+    finally:
+        detector.close()
+    return detections, detector.records
+
+
+def throughput(paths, rules):
+    """以 rules 評估所有檔案的事件處理速率（events/s）"""
+    detector = StreamingDetector(rules)
+    started = time.perf_counter()
+    try:
+        detector.process(paths)
+        detector.flush()
+    finally:
+        detector.close()
+    elapsed = time.perf_counter() - started
+    return round(detector.records / elapsed) if elapsed else None
+
+
+def measure(footprint, expected, detections):
+    """每條預期規則在情境時間範圍內的第一個告警；其餘告警計為誤報"""
+    first = {}
+    false_positives = collections.Counter()
+    for alert, delivered, detected_at in sorted(detections, key=lambda detection: detection[2]):
+        in_run = footprint.start - 1 <= alert.first <= footprint.now + MATCH_SLACK
+        if alert.rule in expected and in_run:
+            first.setdefault(alert.rule, (alert, delivered, detected_at))
+        else:
+            false_positives[alert.rule] += 1
+    results = {}
+    for name in expected:
+        if name not in first:
+            results[name] = None
+            continue
+        alert, delivered, detected_at = first[name]
+        results[name] = {
+            # 從情境第一個呼叫到告警
+            'time_to_detect': detected_at - footprint.start,
+            # 從觸發告警的事件到告警
+            'event_to_alert': detected_at - alert.first,
+            # 日誌檔送達後的處理時間
+            'processing': detected_at - delivered if delivered is not None else None
+        }
+    return results, false_positives
+
+
+def run_technique(folder, profiles, repeat, events, hours, seed, footprints=None, measure_throughput=True):
+    """
+    footprints 為從 API 清單擷取的執行（每次重複都重播同一組）；未指定時每次重複以不同 seed 與切片相位合成情境
+    """
+    scenario = TECHNIQUES[folder]['scenario']
+    expected = SCENARIO_RULES[scenario]
+    samples = collections.defaultdict(lambda: collections.defaultdict(lambda: collections.defaultdict(list)))
+    missed = collections.defaultdict(collections.Counter)
+    false_positives = collections.defaultdict(collections.Counter)
+    rates = {}
+    runs = footprints or [None]
+    replays = 0
+    for profile in profiles:
+        for iteration in range(repeat):
+            for footprint in runs:
+                # seed 混入技術名稱，各技術與各次重複的背景、送達延遲與切片相位都不同
+                rng = random.Random(f"{seed}:{folder}:{iteration}")
+                replay_seed = rng.getrandbits(32)
+                if footprint is None:
+                    start, duration = SYNTH_START, hours * 3600
+                    # 情境起點落在切片內的隨機位置，而非總是對齊 SLICE_SECONDS 的邊界
+                    offset = rng.uniform(0, SLICE_SECONDS)
+                    current = synth_footprint(scenario, replay_seed, start + offset, duration)
+                else:
+                    current = footprint
+                    start = (current.start // SLICE_SECONDS) * SLICE_SECONDS - MANIFEST_LEAD
+                    duration = max(hours * 3600, current.now - start + MANIFEST_LEAD)
+                with tempfile.TemporaryDirectory(prefix='cloud-attack-ttd-') as output:
+                    generate(output, events, start, duration, replay_seed, output_format='gzip',
+                             delivery_delay=DELAY_PROFILES[profile], footprints=[current])
+                    paths = delivered_files(output)
+                    detections, records = replay(paths)
+                    results, noise = measure(current, expected, detections)
+                    if measure_throughput and not rates:
+                        rates = collections.OrderedDict(
+                            (rule.name, throughput(paths, [rule])) for rule in RULES)
+                        rates['all'] = throughput(paths, RULES)
+                replays += 1
+                false_positives[profile].update(noise)
+                for name, result in results.items():
+                    if result is None:
+                        missed[profile][name] += 1
+                        continue
+                    for metric, value in result.items():
+                        if value is not None:
+                            samples[profile][name][metric].append(value)
+                line = ', '.join(f"{name} " + ('MISSED' if result is None else f"{result['time_to_detect']:.0f}s")
+                                 for name, result in results.items())
+                print(f"{folder:<50} {profile:<8} {current.run_id} {records:8d} events: {line}", flush=True)
+
+    report = collections.OrderedDict()
+    for profile in profiles:
+        report[profile] = {
+            'replays': replays // len(profiles),
+            'rules': collections.OrderedDict(
+                (name, {
+                    'detected': len(samples[profile][name]['time_to_detect']),
+                    'missed': missed[profile][name],
+                    'time_to_detect': summarize(samples[profile][name]['time_to_detect']),
+                    'event_to_alert': summarize(samples[profile][name]['event_to_alert']),
+                    'processing': summarize(samples[profile][name]['processing'], 3)
+                }) for name in expected),
+            'false_positives': dict(false_positives[profile].most_common())
+        }
+    return {
+        'scenario': scenario,
+        'source': 'synth' if footprints is None else 'manifest',
+        'runs': [footprint.run_id for footprint in footprints] if footprints else None,
+        'delays': report,
+        'throughput': rates
+    }
+
+
+def load_manifests(manifests, cloudtrail_root, seed):
+    """依 API 清單標頭的情境名稱，將實際執行分到技術目錄"""
+    by_folder = collections.defaultdict(list)
+    for manifest in manifests:
+        footprint = manifest_footprint(manifest, cloudtrail_root, seed)
+        folder = technique_of(footprint.scenario)
+        if folder is None:
+            raise ValueError(f"{manifest}: scenario {footprint.scenario!r} does not belong to any technique")
+        print(f"{manifest}: {footprint.scenario} run {footprint.run_id}, {len(footprint.records)} events")
+        by_folder[folder].append(footprint)
+    return by_folder
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment_info():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count()
+    }
+
+
+def compare(baseline_path, results):
+    with open(baseline_path, 'r') as file:
+        baseline = json.load(file)
+    print(f"\nCompared with {baseline_path} ({(baseline.get('commit') or 'unknown')[:12]}):")
+    for folder, current in results.items():
+        previous = baseline.get('techniques', {}).get(folder)
+        if previous is None:
+            print(f"{folder:<50} (new)")
+            continue
+        for profile, delay in current['delays'].items():
+            for name, rule in delay['rules'].items():
+                before = previous.get('delays', {}).get(profile, {}).get('rules', {}).get(name)
+                if not before or not before['time_to_detect'] or not rule['time_to_detect']:
+                    print(f"{folder:<50} {profile:<8} {name:<32} (not comparable)")
+                    continue
+                delta = rule['time_to_detect']['p50'] - before['time_to_detect']['p50']
+                print(f"{folder:<50} {profile:<8} {name:<32} time to detect {delta:+8.1f}s "
+                      f"missed {rule['missed'] - before['missed']:+d}")
+        for name, rate in current['throughput'].items():
+            before = previous.get('throughput', {}).get(name)
+            if rate and before:
+                print(f"{folder:<50} {'':<8} {name:<32} throughput {rate / before:5.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay each technique's footprint through the streaming detector at realistic CloudTrail "
+                    "delivery delays and record first-alert latency and per-rule throughput.")
+    parser.add_argument('--techniques', nargs='+', choices=list(TECHNIQUES), default=list(TECHNIQUES))
+    parser.add_argument('--delays', nargs='+', choices=list(DELAY_PROFILES), default=['typical'],
+                        help="delivery delay profiles to replay at")
+    parser.add_argument('--manifest', action='append', default=[],
+                        help="replay a real run: API manifest written by the scenario script (repeatable, "
+                             "needs --cloudtrail)")
+    parser.add_argument('--cloudtrail', help="CloudTrail export the manifests' events are read from")
+    parser.add_argument('--events', type=int, default=100000, help="background events per replay")
+    parser.add_argument('--hours', type=float, default=2, help="background time span per replay")
+    parser.add_argument('--repeat', type=int, default=3, help="replay each technique N times with different seeds")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-throughput', action='store_true', help="skip the per-rule throughput passes")
+    parser.add_argument('--output', default='time_to_detect.json', help="where to write the JSON results")
+    parser.add_argument('--compare', help="previous results file to compare against")
+    args = parser.parse_args()
+    if args.manifest and not args.cloudtrail:
+        parser.error("--manifest needs --cloudtrail")
+
+    started_at = time.time()
+    by_folder = load_manifests(args.manifest, args.cloudtrail, args.seed) if args.manifest else None
+    results = collections.OrderedDict()
+    for folder in args.techniques:
+        footprints = by_folder.get(folder) if by_folder is not None else None
+        if by_folder is not None and not footprints:
+            print(f"{folder:<50} no manifest given, skipped")
+            continue
+        results[folder] = run_technique(folder, args.delays, args.repeat, args.events, args.hours, args.seed,
+                                        footprints, not args.no_throughput)
+
+    report = {
+        'commit': git_commit(),
+        'started_at': started_at,
+        'events': args.events,
+        'hours': args.hours,
+        'repeat': args.repeat,
+        'lateness': LATENESS,
+        'delay_profiles': {name: DELAY_PROFILES[name] for name in args.delays},
+        'environment': environment_info(),
+        'techniques': results
+    }
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        compare(args.compare, results)
+    missed = sum(rule['missed'] for technique in results.values()
+                 for delay in technique['delays'].values() for rule in delay['rules'].values())
+    raise SystemExit(1 if missed else 0)
+
+
+if __name__ == "__main__":
+    main()